@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import threading
+import urllib.request
+
+API_URL = os.environ.get("ETF_API_URL", "").rstrip("/")
+TIMEOUT_SECONDS = 60
+# Client-side TTLs; tickers the server had no value for are asked again after MISS_TTL_SECONDS
+PRICE_TTL_SECONDS = 300
+CAP_TTL_SECONDS = 3600
+MISS_TTL_SECONDS = 60
+CONSOLIDATION_TTL_SECONDS = 300
+
+_lock = threading.Lock()
+_tickers = {}  # {(path, ticker): (value or None, fetched_at)}
+_consolidation = {}
+
+
+def enabled():
+    return bool(API_URL)
+
+
+def _call(path, payload=None):
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    req = urllib.request.Request(
+        f"{API_URL}{path}",
+        data=data,
+        headers={"Content-Type": "application/json"},
+        method="POST" if data is not None else "GET",
+    )
+    with urllib.request.urlopen(req, timeout=TIMEOUT_SECONDS) as resp:
+        return json.loads(resp.read().decode('utf-8'))
+
+
+def _cached_tickers(path, tickers, ttl):
+    """
+    Per-ticker lookup that only asks the server for tickers without a fresh entry.
+    Missing tickers are remembered as misses for MISS_TTL_SECONDS.
+    """
+    now = time.time()
+    result, todo = {}, []
+    with _lock:
+        for t in dict.fromkeys(tickers):
+            entry = _tickers.get((path, t))
+            if entry and now - entry[1] <= (ttl if entry[0] is not None else MISS_TTL_SECONDS):
+                if entry[0] is not None:
+                    result[t] = entry[0]
+            else:
+                todo.append(t)
+    if todo:
+        fetched = _call(path, {"tickers": todo})
+        with _lock:
+            for t in todo:
+                _tickers[(path, t)] = (fetched.get(t), now)
+        result.update({t: fetched[t] for t in todo if t in fetched})
+    return result
+
+
+def _consolidation_payload():
+    with _lock:
+        cons = _consolidation.get("value")
+        if cons is not None and time.time() - _consolidation["fetched_at"] <= CONSOLIDATION_TTL_SECONDS:
+            return cons
+    cons = _call("/consolidation")
+    with _lock:
+        _consolidation.update(value=cons, fetched_at=time.time())
+    return cons
+
+
+# Same signatures as data_loader / utils / theme_index, so the app can swap backends
+
+def get_latest_prices(tickers):
+    return _cached_tickers("/prices", tickers, PRICE_TTL_SECONDS)
+
+
+def get_market_caps(tickers):
+    return _cached_tickers("/market_caps", tickers, CAP_TTL_SECONDS)
+
+
+def get_etf_aums(etf_metadata):
+    cons = _consolidation_payload()
+    return cons["etf_aums"], cons["used_fallbacks"]
+
+
+def get_consolidation():
+    """
+    Returns:
+        dict: final_weights
+        dict: stock_breakdown
+    """
+    cons = _consolidation_payload()
+    return cons["weights"], cons["breakdown"]
+
+
+def get_consolidated_weights(etf_aums, compositions):
+    """
+    The server's consolidation when it was computed from the same AUMs and
+    compositions (the full universe); other inputs are consolidated locally.
+    """
+    import utils
+    cons = _consolidation_payload()
+    if cons.get("fingerprint") == utils.consolidation_fingerprint(etf_aums, compositions):
+        return cons["weights"], cons["breakdown"]
+    return utils.get_consolidated_weights(etf_aums, compositions)
+
+
+def exposures(final_weights, stock_breakdown, by="theme"):
+    """
+    The server's exposure rollup for its own consolidation, else computed locally.
+    """
+    import pandas as pd
+    import theme_index
+    cons = _consolidation_payload()
+    served = cons.get("exposures", {})
+    if by in served and final_weights == cons["weights"]:
+        return pd.Series(served[by], dtype=float).sort_values(ascending=False)
+    return theme_index.exposures(final_weights, stock_breakdown, by=by)
+
+
+def get_purchase_plan(investments, allow_fractional=True):
+    return _call("/purchase_plan", {"investments": investments, "allow_fractional": allow_fractional})
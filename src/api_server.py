@@ -0,0 +1,333 @@
+import json
+import math
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import data_loader
+import utils
+import purchase_plan
+import theme_index
+import instrumentation
+
+PRICE_TTL_SECONDS = 300
+CAP_TTL_SECONDS = 3600 * 24
+CONSOLIDATION_TTL_SECONDS = 3600
+# Tickers upstream had no value for are not re-fetched for this long
+MISS_TTL_SECONDS = 60
+# Exposure rollups served with the consolidation
+EXPOSURE_DIMENSIONS = ("theme", "etf", "country", "currency")
+BATCH_WINDOW_SECONDS = 0.05
+
+
+class _TickerCache:
+    """
+    Per-ticker TTL cache, so overlapping requests only fetch the tickers they miss.
+    Tickers without a value are cached as misses for miss_ttl.
+    """
+    def __init__(self, ttl, miss_ttl=MISS_TTL_SECONDS):
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def split(self, tickers):
+        now = time.time()
+        hits, misses = {}, []
+        with self._lock:
+            for t in tickers:
+                entry = self._values.get(t)
+                if entry is None or now - entry[1] > (self.ttl if entry[0] is not None else self.miss_ttl):
+                    misses.append(t)
+                elif entry[0] is not None:
+                    hits[t] = entry[0]
+        return hits, misses
+
+    def update(self, values, requested=()):
+        now = time.time()
+        with self._lock:
+            for t in requested:
+                if t not in values:
+                    self._values[t] = (None, now)
+            for t, v in values.items():
+                self._values[t] = (v, now)
+
+
+class _Batch:
+    def __init__(self):
+        self.tickers = set()
+        self.done = threading.Event()
+        self.result = {}
+        self.error = None
+
+
+class _Batcher:
+    """
+    Coalesces concurrent lookups: the first caller waits BATCH_WINDOW_SECONDS,
+    then fetches the union of every ticker requested meanwhile in one call.
+    """
+    def __init__(self, fetch, name, window=BATCH_WINDOW_SECONDS):
+        self.fetch = fetch
+        self.name = name
+        self.window = window
+        self._lock = threading.Lock()
+        self._current = None
+
+    def get(self, tickers):
+        with self._lock:
+            batch = self._current
+            leader = batch is None
+            if leader:
+                batch = self._current = _Batch()
+            batch.tickers.update(tickers)
+
+        if leader:
+            time.sleep(self.window)
+            with self._lock:
+                self._current = None
+            instrumentation.increment(f"api.{self.name}.batches")
+            instrumentation.increment(f"api.{self.name}.batched_tickers", len(batch.tickers))
+            try:
+                batch.result = self.fetch(sorted(batch.tickers))
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return {t: batch.result[t] for t in tickers if t in batch.result}
+
+
+class MarketService:
+    """
+    Long-lived, thread-safe wrapper around the data_loader/utils/purchase_plan logic
+    with warm in-process caches.
+    """
+    def __init__(self):
+        self._prices = _TickerCache(PRICE_TTL_SECONDS)
+        self._caps = _TickerCache(CAP_TTL_SECONDS)
+        self._price_batcher = _Batcher(lambda ts: data_loader.get_latest_prices(ts), "prices")
+        self._cap_batcher = _Batcher(lambda ts: data_loader.get_market_caps(ts), "market_caps")
+        self._consolidation = None
+        self._consolidation_lock = threading.Lock()
+
+    def _cached(self, cache, batcher, tickers):
+        hits, misses = cache.split(tickers)
+        if misses:
+            fetched = batcher.get(misses)
+            cache.update(fetched, requested=misses)
+            hits.update(fetched)
+        return hits
+
+    def prices(self, tickers):
+        return self._cached(self._prices, self._price_batcher, tickers)
+
+    def market_caps(self, tickers):
+        return self._cached(self._caps, self._cap_batcher, tickers)
+
+    def consolidation(self):
+        with self._consolidation_lock:
+            if self._consolidation is None or time.time() - self._consolidation["computed_at"] > CONSOLIDATION_TTL_SECONDS:
+                etf_metadata = data_loader.load_etf_metadata()
+                etf_aums, used_fallbacks = data_loader.get_etf_aums(etf_metadata)
+                compositions = data_loader.load_compositions()
+                final_weights, breakdown = utils.get_consolidated_weights(etf_aums, compositions)
+                self._consolidation = {
+                    "computed_at": time.time(),
+                    "fingerprint": utils.consolidation_fingerprint(etf_aums, compositions),
+                    "etf_aums": etf_aums,
+                    "used_fallbacks": used_fallbacks,
+                    "weights": final_weights,
+                    "breakdown": breakdown,
+                    "exposures": {
+                        by: theme_index.exposures(final_weights, breakdown, by=by).to_dict() for by in EXPOSURE_DIMENSIONS
+                    },
+                }
+            return self._consolidation
+
+    def purchase_plan(self, investments, allow_fractional=True):
+        cons = self.consolidation()
+        prices = self.prices(sorted(cons["weights"].keys()))
+        plan = purchase_plan.compute_purchase_plan(cons["weights"], prices, investments, allow_fractional=allow_fractional)
+        accounts = []
+        for k in range(len(plan["investments"])):
+            df_buy, df_skipped = purchase_plan.plan_frames(plan, k, cons["breakdown"])
+            accounts.append({
+                "total_investment": float(plan["investments"][k]),
+                "total_cost": float(plan["cost"][k].sum()),
+                "cash": float(plan["cash"][k]),
+                "tracking_error": float(plan["tracking_error"][k]),
+                "orders": df_buy.to_dict(orient="records"),
+                "skipped": df_skipped["Ticker"].tolist(),
+            })
+        return {"accounts": accounts, "missing": plan["missing"]}
+
+    def warm(self):
+        """
+        Fills the consolidation and price caches so the first request is fast.
+        """
+        try:
+            cons = self.consolidation()
+            self.prices(sorted(cons["weights"].keys()))
+        except Exception as e:
+            instrumentation.record_error("api.warm", "startup", e)
+
+
+def _tickers_from(query, body):
+    tickers = body.get("tickers") if body else None
+    if tickers is None:
+        raw = ",".join(query.get("tickers", []))
+        tickers = [t for t in raw.replace(" ", ",").split(",") if t]
+    if isinstance(tickers, str):
+        tickers = tickers.split()
+    return [t for t in tickers if isinstance(t, str)]
+
+
+_TRUE = ("1", "true", "yes", "on")
+_FALSE = ("0", "false", "no", "off")
+
+
+def _flag_from(query, body, name, default):
+    """
+    A boolean parameter from the JSON body or the query string. Strings are parsed
+    explicitly ("false" is False); anything else raises ValueError.
+    """
+    value = body.get(name) if body and name in body else (query[name][0] if name in query else default)
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in _TRUE + _FALSE:
+        return value.strip().lower() in _TRUE
+    raise ValueError(f"{name} must be a boolean, got {value!r}")
+
+
+def _investments_from(query, body):
+    """
+    Positive account sizes from body "investments" / "total_investment" (a number or
+    a list) or the total_investment query parameter (repeated or comma-separated).
+    Returns None when none is given; raises ValueError on malformed values.
+    """
+    investments = body.get("investments", body.get("total_investment")) if body else None
+    if investments is None and "total_investment" in query:
+        investments = [v for raw in query["total_investment"] for v in raw.split(",")]
+        investments = investments[0] if len(investments) == 1 else investments
+    if investments is None:
+        return None
+    values = investments if isinstance(investments, list) else [investments]
+    if not values:
+        raise ValueError("total_investment must not be empty")
+    parsed = []
+    for v in values:
+        if isinstance(v, bool) or not isinstance(v, (int, float, str)):
+            raise ValueError(f"total_investment must be a number, got {v!r}")
+        try:
+            amount = float(v)
+        except ValueError:
+            raise ValueError(f"total_investment must be a number, got {v!r}") from None
+        if not math.isfinite(amount) or amount <= 0:
+            raise ValueError(f"total_investment must be positive, got {v!r}")
+        parsed.append(amount)
+    return parsed if isinstance(investments, list) else parsed[0]
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send(self, status, payload):
+            body = json.dumps(payload, default=float).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if not length:
+                return {}
+            return json.loads(self.rfile.read(length).decode('utf-8'))
+
+        def _route(self, method):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            try:
+                body = self._read_body() if method == "POST" else {}
+            except ValueError:
+                return self._send(400, {"error": "invalid JSON body"})
+
+            instrumentation.increment(f"api.requests{url.path.replace('/', '.')}")
+            with instrumentation.timer(f"api{url.path.replace('/', '.')}"):
+                if url.path == "/health":
+                    return self._send(200, {"status": "ok"})
+                if url.path == "/consolidation":
+                    cons = service.consolidation()
+                    return self._send(200, {k: v for k, v in cons.items() if k != "computed_at"})
+                if url.path == "/prices":
+                    return self._send(200, service.prices(_tickers_from(query, body)))
+                if url.path == "/market_caps":
+                    return self._send(200, service.market_caps(_tickers_from(query, body)))
+                if url.path == "/purchase_plan":
+                    try:
+                        investments = _investments_from(query, body)
+                        allow_fractional = _flag_from(query, body, "allow_fractional", True)
+                    except ValueError as e:
+                        return self._send(400, {"error": str(e)})
+                    if investments is None:
+                        return self._send(400, {"error": "total_investment or investments is required"})
+                    return self._send(200, service.purchase_plan(investments, allow_fractional))
+                if url.path == "/metrics":
+                    return self._send(200, instrumentation.snapshot())
+                return self._send(404, {"error": f"unknown endpoint {url.path}"})
+
+        def do_GET(self):
+            try:
+                self._route("GET")
+            except Exception as e:
+                instrumentation.record_error("api.handler", self.path, e)
+                self._send(500, {"error": str(e)})
+
+        def do_POST(self):
+            try:
+                self._route("POST")
+            except Exception as e:
+                instrumentation.record_error("api.handler", self.path, e)
+                self._send(500, {"error": str(e)})
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8765, warm=True):
+    service = MarketService()
+    if warm:
+        threading.Thread(target=service.warm, daemon=True).start()
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    print(f"ETF API listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless HTTP API for consolidation, pricing and purchase plans.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--no-warm", action="store_true", help="Skip cache warm-up on startup")
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, warm=not args.no_warm)
+
+
+if __name__ == "__main__":
+    main()
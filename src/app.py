@@ -1,62 +1,70 @@
 import streamlit as st
 import pandas as pd
+import plotly.express as px
 import os
-import json
 import data_loader
 import utils
+import instrumentation
+import purchase_plan
+import rebalance
+import theme_index
+import etf_overlap
+import api_client
+import price_validation
+import nav_tracker
+import chart_data
+import holdings_table
+import memory_monitor
+import stress_test
+import result_cache
+import holdings_history
+import attribution
+
+NAV_POLL_SECONDS = 15
 
 # Page Config
 st.set_page_config(page_title="Indy's ETF Manager", layout="wide")
 
 # --- Sidebar Navigation ---
 st.sidebar.title("📌 Menu")
+MENU_ITEMS = ["Indy's ETF Information", "ETF Composition", "Invest in ETF"]
+# Hidden diagnostics page: open the app with ?diagnostics=1 (or set ETF_DIAGNOSTICS=1)
+if st.query_params.get("diagnostics") == "1" or os.environ.get("ETF_DIAGNOSTICS") == "1":
+    MENU_ITEMS.append("Diagnostics")
 menu = st.sidebar.radio(
     "Go to",
-    ["Indy's ETF Information", "ETF Composition", "Invest in ETF"]
+    MENU_ITEMS
 )
 
+# Memory profiling per view (tracemalloc; ETF_TRACEMALLOC=1 or the Diagnostics toggle)
+if os.environ.get("ETF_TRACEMALLOC") == "1":
+    memory_monitor.start_tracing()
+view_memory = memory_monitor.begin(f"view.{menu}")
+
 # --- Shared Data Loading ---
+# With ETF_API_URL set, market data comes from the shared API server (api_server.py)
+market = api_client if api_client.enabled() else data_loader
+# With the API, the full-universe consolidation and its exposure rollups come from the server
+consolidate = api_client.get_consolidated_weights if api_client.enabled() else utils.get_consolidated_weights
+exposures = api_client.exposures if api_client.enabled() else theme_index.exposures
+
+
 @st.cache_data
 def load_etf_metadata():
-    try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        meta_path = os.path.join(base_dir, '..', 'data', 'etf_metadata.json')
-        with open(meta_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return {}
+    return data_loader.load_etf_metadata()
 
 def load_compositions():
-    try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        comp_path = os.path.join(base_dir, '..', 'data', 'etf_compositions.json')
-        with open(comp_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return {}
+    return data_loader.load_compositions()
 
 etf_metadata = load_etf_metadata()
 compositions = load_compositions()
 
 # Mapping for View 3 AUM aggregation - Now DYNAMIC
-@st.cache_data(ttl=3600)
-def get_dynamic_etf_aums(etf_tickers):
-    caps = data_loader.get_market_caps(etf_tickers)
-    # Convert to Billions for internal scaling consistency
-    return {t: (v / 1e9) for t, v in caps.items()}
-
-ETF_AUMS_RAW = get_dynamic_etf_aums(list(etf_metadata.keys()))
-# Combine with metadata to ensure we have a fallback
-ETF_AUMS = {}
-used_fallbacks = []
-for k, meta in etf_metadata.items():
-    val = ETF_AUMS_RAW.get(k, 0.0)
-    if val <= 0:
-        val = meta.get('fallback_aum', 0.0)
-        used_fallbacks.append(k)
-    ETF_AUMS[k] = val
+# Live AUMs (Billions) with the metadata fallback_aum for ETFs the API could not resolve
+ETF_AUMS, used_fallbacks = market.get_etf_aums(etf_metadata)
 
 TOTAL_AUM = sum(ETF_AUMS.values())
+memory_monitor.record_object("ETF_AUMS", ETF_AUMS)
 
 if used_fallbacks:
     st.sidebar.info(f"💡 현재 실시간 API 제한으로 인해 **2026년 2월 최신 보정 데이터**를 사용하여 포트폴리오를 구성 중입니다. (대상: {len(used_fallbacks)}개 ETF)")
@@ -131,19 +139,19 @@ if menu == "Indy's ETF Information":
     
     with tab1:
         st.subheader("인공지능과 로봇 혁명")
-        show_etf_details(["AIQ", "BOTZ", "ROBO", "CHAT", "QTUM"], "AI 모델, 빅데이터 처리, 그리고 물리적 로봇 자동화 기술에 투자합니다.")
+        show_etf_details(theme_index.THEME_TABS["AI & Robotics"], "AI 모델, 빅데이터 처리, 그리고 물리적 로봇 자동화 기술에 투자합니다.")
         
     with tab2:
         st.subheader("디지털 산업의 쌀, 반도체")
-        show_etf_details(["SMH", "SOXX", "CIBR", "HACK"], "AI 연산의 핵심인 GPU/NPU와 이를 지키는 사이버 보안 기술입니다.")
+        show_etf_details(theme_index.THEME_TABS["Semiconductor"], "AI 연산의 핵심인 GPU/NPU와 이를 지키는 사이버 보안 기술입니다.")
         
     with tab3:
         st.subheader("우주 개척과 자율주행 파괴적 혁신")
-        show_etf_details(["ARKX", "UFO", "ROKT", "DRIV", "IDRV"], "지구를 넘어 우주로 확장하고, 도로 위의 이동 혁명을 주도하는 기업들입니다.")
+        show_etf_details(theme_index.THEME_TABS["Future Mobility"], "지구를 넘어 우주로 확장하고, 도로 위의 이동 혁명을 주도하는 기업들입니다.")
         
     with tab4:
         st.subheader("생명 연장과 필수 자원")
-        show_etf_details(["IBB", "XBI", "XME", "PICK", "SETM", "COPP"], "인류 수명 연장의 꿈(Bio)과 기술 구현에 필수적인 희소 자원(Resources)입니다.")
+        show_etf_details(theme_index.THEME_TABS["Bio & Resources"], "인류 수명 연장의 꿈(Bio)과 기술 구현에 필수적인 희소 자원(Resources)입니다.")
     
     st.markdown("---")
     
@@ -162,6 +170,22 @@ if menu == "Indy's ETF Information":
         *   ETF 수수료(0.75%~)를 아끼고, 원하지 않는 종목은 걸러낼 수 있는 **'다이렉트 인덱싱'**을 구현합니다.
         """)
 
+    st.markdown("---")
+
+    st.markdown("### 5. ETF Overlap (중복도 분석)")
+    st.caption("NVDA처럼 여러 ETF에 동시에 담긴 종목이 많을수록 통합 비중이 해당 종목에 집중됩니다.")
+    overlap = etf_overlap.compute_overlap(compositions)
+    overlap_metric = st.radio(
+        "Overlap Metric",
+        ["weight", "count", "jaccard", "cosine"],
+        format_func=lambda m: {"weight": "Weight Overlap (%)", "count": "Shared Holdings (#)", "jaccard": "Jaccard", "cosine": "Cosine Similarity"}[m],
+        horizontal=True
+    )
+    fig = px.imshow(overlap[overlap_metric], color_continuous_scale="Blues", aspect="auto", text_auto=".2g" if overlap_metric != "count" else True)
+    fig.update_layout(height=650, margin=dict(l=0, r=0, t=10, b=0))
+    st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(etf_overlap.most_overlapping(overlap, overlap_metric).to_frame(), use_container_width=True)
+
 # --- View 2: ETF Composition ---
 elif menu == "ETF Composition":
     st.title("🧩 ETF Composition (Underlying Stocks)")
@@ -176,51 +200,24 @@ elif menu == "ETF Composition":
 
     # 1. Calculate Consolidated Weights using centralized logic
     with st.spinner("Calculating Portfolio Weights..."):
-        stock_counter, stock_cap_details = utils.calculate_consolidated_weights(ETF_AUMS, compositions)
+        stock_counter, stock_cap_details = consolidate(ETF_AUMS, compositions)
         # Total score for display purposes
         total_raw_score = sum(sum(breakdown.values()) for breakdown in stock_cap_details.values())
 
-    # Create DF
-    data = []
-    
     # Needs Market Cap Data
     with st.spinner("Fetching Market Cap Data for Portfolio Analysis..."):
         all_tickers = list(stock_counter.keys())
-        market_caps = data_loader.get_market_caps(all_tickers)
-    
-    total_portfolio_mcap = 0
+        market_caps = market.get_market_caps(all_tickers)
     
-    for t, w in stock_counter.items():
-        # Get sectors/ETFs this stock belongs to from the breakdown keys
-        sectors = ", ".join(list(stock_cap_details.get(t, {}).keys()))
-        mcap = market_caps.get(t) or market_caps.get(t.replace('.', '-'), 0)
-        total_portfolio_mcap += mcap
-        
-        # Format Market Cap
-        if mcap > 0:
-            mcap_str = f"${mcap/1e9:,.2f} B"
-        else:
-            mcap_str = "$0.00 B"
-            
-        # Get Capital Contribution for this stock
-        allocated_cap = sum(stock_cap_details.get(t, {}).values())
-        
-        data.append({
-            "Ticker": t, 
-            "Consolidated Weight (%)": w, 
-            "Allocated Cap ($B)": allocated_cap,
-            "Market Cap": mcap_str,
-            "Raw Mcap": mcap,
-            "Sectors": sectors
-        })
-        
-    df = pd.DataFrame(data).sort_values(by="Consolidated Weight (%)", ascending=False)
+    # Columnar result shared across sessions; sorting/filtering/paging happen server-side
+    table = holdings_table.build_holdings_table(stock_counter, stock_cap_details, market_caps)
+    total_portfolio_mcap = table.total_market_cap
     
     # Metrics
     c1, c2, c3 = st.columns(3)
     
     with c1:
-        st.metric("Total Unique Stocks", len(df))
+        st.metric("Total Unique Stocks", len(table))
         
     with c2:
         # Portfolio Market Cap vs US Total
@@ -233,25 +230,174 @@ elif menu == "ETF Composition":
 
     with st.expander("🔍 지표 상세 설명 (Metric Definitions)", expanded=False):
         st.markdown(f"""
-        1. **Total Unique Stocks ({len(df)})**
+        1. **Total Unique Stocks ({len(table)})**
             *   22개 ETF에서 중복을 제거하고 선별된 **최종 기업 수**입니다. 여러 지수에 중복 포함된 핵심 우량주들을 통합하여 관리합니다.
         
         2. **Portfolio Mcap Coverage ({coverage:.1f}%)**
-            *   선별된 {len(df)}개 기업이 **미국 전체 주식 시장($65T)**에서 차지하는 가치의 비중입니다. 상위 우량주 집중 투자를 통해 시장의 80% 이상을 효과적으로 추종합니다.
+            *   선별된 {len(table)}개 기업이 **미국 전체 주식 시장($65T)**에서 차지하는 가치의 비중입니다. 상위 우량주 집중 투자를 통해 시장의 80% 이상을 효과적으로 추종합니다.
         
         3. **Total Allocated Capital (${total_raw_score:.1f} B)**
             *   각 ETF의 자산 규모(AUM)와 비중을 고려해 계산된 **가상의 총 투자 원금**입니다. 이 금액을 기준으로 각 개별 종목의 최종 비중(%)이 결정됩니다.
         """)
 
-    st.dataframe(
-        df[["Ticker", "Consolidated Weight (%)", "Allocated Cap ($B)", "Market Cap", "Sectors"]].style.format({
-            "Consolidated Weight (%)": "{:.5f}%",
-            "Allocated Cap ($B)": "${:.2f} B"
-        }),
-        use_container_width=True,
-        height=800
+    with st.expander("🧭 Exposure Breakdown (Theme / ETF / Country / Currency)", expanded=False):
+        exp_cols = st.columns(4)
+        for col, (label, dim) in zip(exp_cols, [("Theme", "theme"), ("Source ETF", "etf"), ("Country", "country"), ("Currency", "currency")]):
+            with col:
+                st.markdown(f"**{label}**")
+                exposure = exposures(stock_counter, stock_cap_details, by=dim)
+                st.dataframe(exposure.rename("Exposure (%)").to_frame().style.format("{:.2f}%"), use_container_width=True)
+
+    f_col1, f_col2, f_col3, f_col4 = st.columns([2, 2, 2, 1])
+    with f_col1:
+        search = st.text_input("Search Ticker", "")
+    with f_col2:
+        etf_filter = st.multiselect("Source ETF", list(compositions.keys()))
+    with f_col3:
+        sort_by = st.selectbox("Sort By", holdings_table.SORT_COLUMNS)
+    with f_col4:
+        ascending = st.toggle("Ascending", value=sort_by == "Ticker")
+
+    rows = table.query(sort_by, ascending=ascending, search=search, etfs=etf_filter)
+    p_col1, p_col2, p_col3 = st.columns([1, 1, 3])
+    with p_col1:
+        page_size = st.selectbox("Rows per Page", holdings_table.PAGE_SIZES)
+    n_pages = max(1, -(-len(rows) // page_size))
+    with p_col2:
+        page = st.number_input("Page", min_value=1, max_value=n_pages, value=1, step=1)
+    with p_col3:
+        first = (page - 1) * page_size
+        st.caption(f"Rows {min(first + 1, len(rows))}–{min(first + page_size, len(rows))} of {len(rows)} (page {page} / {n_pages})")
+
+    st.dataframe(table.page(rows, page, page_size), use_container_width=True)
+    st.download_button(
+        label="💾 Download Filtered Holdings (CSV)",
+        data=table.to_frame(rows).to_csv(index=False).encode('utf-8'),
+        file_name="holdings.csv",
+        mime="text/csv"
     )
 
+    st.markdown("### 📈 Backtest vs VOO (5Y)")
+    if st.checkbox("Run Backtest", help="5년 일별 가격을 불러와 현재 통합 비중을 VOO와 비교합니다."):
+        with st.spinner("Loading 5Y Price History..."):
+            bt_weights = {}
+            for t, w in stock_counter.items():
+                norm = data_loader.normalize_ticker(t)
+                bt_weights[norm] = bt_weights.get(norm, 0.0) + w / 100.0
+            history = holdings_history.HoldingsHistory.load()
+            history_symbols = {data_loader.normalize_ticker(t) for t in history.tickers()}
+            price_data = data_loader.load_shared_stock_data(sorted(set(bt_weights) | history_symbols | {"VOO"}), period="5y")
+
+        if price_data.empty or "VOO" not in price_data.columns:
+            st.warning("가격 데이터를 불러오지 못했습니다. 네트워크 연결을 확인해주세요.")
+        else:
+            matrix = utils.build_return_matrix(price_data)
+            _, daily_port = utils.calculate_portfolio_returns(bt_weights, matrix)
+            _, daily_voo = utils.calculate_portfolio_returns({"VOO": 1.0}, matrix)
+            dead = matrix.dead_tickers(bt_weights)
+            if dead:
+                st.warning(f"⚠️ 가격 이력이 없는 {len(dead)}개 종목은 제외하고 비중을 나머지 종목에 재분배했습니다: {', '.join(dead[:20])}")
+            # Both series on the dates they share, compounded from the same start
+            daily = pd.DataFrame({"Indy's ETF": daily_port, "VOO": daily_voo}).dropna()
+            daily_port, daily_voo = daily["Indy's ETF"], daily["VOO"]
+            curves = (1 + daily).cumprod() - 1
+            data_key = result_cache.fingerprint(bt_weights, [str(price_data.index[0]), str(price_data.index[-1]), len(price_data.index)])
+
+            if len(curves) > 1:
+                dates = curves.index.to_pydatetime()
+                x_range = st.slider("Zoom", min_value=dates[0], max_value=dates[-1], value=(dates[0], dates[-1]), format="YYYY-MM-DD")
+                st.plotly_chart(
+                    chart_data.line_figure(f"backtest|{data_key}", curves, x_range=x_range, title="Cumulative Return", y_format=".0%"),
+                    use_container_width=True
+                )
+
+                metrics = utils.calculate_metrics(daily_port, daily_voo)
+                m_cols = st.columns(len(metrics))
+                for col, (name, value) in zip(m_cols, metrics.items()):
+                    col.metric(name, f"{value:.2f}" if name in ("Sharpe", "Beta") else f"{value:.1%}")
+
+                r_col1, r_col2 = st.columns(2)
+                with r_col1:
+                    window = st.selectbox("Rolling Window (days)", utils.ROLLING_WINDOWS, index=2)
+                with r_col2:
+                    rolling_metric = st.selectbox("Rolling Metric", ["CAGR", "Volatility", "Sharpe", "Beta", "Tracking Error", "Drawdown"])
+                rolling = utils.calculate_rolling_metrics(pd.DataFrame({"Indy's ETF": daily_port, "VOO": daily_voo}), daily_voo, windows=[window])
+                if window in rolling:
+                    st.plotly_chart(
+                        chart_data.line_figure(f"rolling|{window}|{rolling_metric}|{data_key}", rolling[window][rolling_metric], x_range=x_range, title=f"Rolling {rolling_metric} ({window}d)"),
+                        use_container_width=True
+                    )
+
+                st.markdown("#### 🧩 Return Attribution")
+                attributed = attribution.attribute_returns(stock_counter, stock_cap_details, matrix)
+                if attributed:
+                    attribute_by = st.radio(
+                        "Attribute By", ["theme", "etf", "stock"],
+                        format_func=lambda g: {"theme": "Theme", "etf": "Source ETF", "stock": "Stock (Top 20)"}[g],
+                        horizontal=True
+                    )
+                    totals = attributed["totals"][attribute_by]
+                    totals = (totals.head(20) if attribute_by == "stock" else totals) * 100.0
+                    fig = px.bar(totals.rename("Contribution (%p)").rename_axis(attribute_by).reset_index(), x=attribute_by, y="Contribution (%p)",
+                                 title=f"Contribution to the {attributed['daily'].add(1).prod() - 1:.0%} Total Return")
+                    fig.update_layout(height=350, margin=dict(l=0, r=0, t=40, b=0), xaxis_title="")
+                    st.plotly_chart(fig, use_container_width=True)
+
+            st.markdown("#### 🕰️ Point-in-Time Rebalancing")
+            if history.first_date is None:
+                st.info("저장된 보유종목 이력이 없습니다. `python holdings_history.py`로 스냅샷을 기록하세요.")
+            else:
+                if history.first_date > price_data.index[0].strftime("%Y-%m-%d"):
+                    st.warning(f"⚠️ 보유종목 이력이 {history.first_date}부터 있어, 분기별 재조정 백테스트는 그 이후 구간만 계산합니다.")
+                wf_cum, wf_daily, wf_weights = holdings_history.walk_forward_backtest(history, ETF_AUMS, matrix, before_history="skip")
+                wf = pd.DataFrame({"Point-in-Time": wf_daily, "VOO": daily_voo}).dropna()
+                if len(wf) > 1:
+                    st.caption(f"{len(wf_weights)}번의 재조정 시점마다 당시 보유종목으로 비중을 다시 계산했습니다 (AUM은 현재값).")
+                    st.plotly_chart(
+                        chart_data.line_figure(f"walk_forward|{data_key}|{len(history.snapshots)}|{history.dates[-1]}", (1 + wf).cumprod() - 1, title="Point-in-Time Cumulative Return", y_format=".0%"),
+                        use_container_width=True
+                    )
+                else:
+                    st.info("보유종목 이력 이후의 가격 데이터가 부족합니다.")
+
+    st.markdown("### 🌪️ Stress Test")
+    if st.checkbox("Run Stress Test", help="과거 급락 구간(2018·2020·2022)과 가상 충격(테마·환율)을 현재 통합 포트폴리오에 적용합니다."):
+        s_col1, s_col2, s_col3 = st.columns(3)
+        with s_col1:
+            custom_theme = st.selectbox("Custom Shock: Theme", list(theme_index.THEME_TABS))
+        with s_col2:
+            custom_shock = st.slider("Theme Shock (%)", min_value=-80, max_value=40, value=-30, step=5)
+        with s_col3:
+            custom_fx = st.slider("Non-USD Currencies vs USD (%)", min_value=-30, max_value=30, value=0, step=5)
+        factors = dict(stress_test.FACTOR_SCENARIOS)
+        factors[f"Custom: {custom_theme} {custom_shock:+d}%, FX {custom_fx:+d}%"] = {
+            "theme": {custom_theme: custom_shock / 100.0}, "fx": custom_fx / 100.0,
+        }
+
+        with st.spinner("Loading 10Y Price History..."):
+            core_weights, _ = consolidate({e: ETF_AUMS[e] for e in utils.INDEX_ETFS}, compositions)
+            portfolios = {"Indy's ETF": stock_counter, "Core (VOO+QQQ)": core_weights}
+            symbols = {data_loader.normalize_ticker(t) for t in stock_counter} | set(compositions) | {stress_test.MARKET_PROXY}
+            stress_prices = data_loader.load_shared_stock_data(sorted(symbols), period=stress_test.HISTORY_PERIOD)
+        result = stress_test.stress_test(portfolios, stock_cap_details, None if stress_prices.empty else stress_prices, factors=factors)
+
+        if result:
+            summary = result["pnl"].copy()
+            summary.insert(0, "Type", result["kind"])
+            summary["Own History (%)"] = result["coverage"]["Indy's ETF"]
+            st.dataframe(summary.style.format("{:+.2f}%", subset=list(portfolios)).format("{:.0f}%", subset=["Own History (%)"]), use_container_width=True)
+
+            scenario = st.selectbox("Scenario Breakdown", list(result["pnl"].index))
+            b_col1, b_col2 = st.columns(2)
+            with b_col1:
+                by_theme = result["theme"].loc[scenario, "Indy's ETF"].rename("Contribution (%p)").reset_index()
+                fig = px.bar(by_theme, x="theme", y="Contribution (%p)", title="Loss by Theme")
+                fig.update_layout(height=350, margin=dict(l=0, r=0, t=40, b=0), xaxis_title="")
+                st.plotly_chart(fig, use_container_width=True)
+            with b_col2:
+                st.markdown("**Largest Stock Contributions**")
+                st.dataframe(stress_test.stock_losses(result, scenario, "Indy's ETF").style.format("{:.2f}"), use_container_width=True)
+
 # --- View 3: Invest in ETF ---
 elif menu == "Invest in ETF":
     st.title("💰 Invest in ETF (Execution)")
@@ -277,61 +423,38 @@ elif menu == "Invest in ETF":
     *   **Themes (Growth)**: 전체의 약 **{(sum(list(ETF_AUMS.values())[2:])/TOTAL_AUM)*100:.1f}%**
     """)
 
+    # Fractional Shares Option (Default: True per user request)
+    allow_fractional = st.checkbox("Allow Fractional Shares (소수점 거래 허용)", value=True, help="체크하면 1주 미만의 소수점 단위까지 매수하여 현금을 최대한 활용합니다. 해제하면 정수 주식 단위로 매수하고, 남은 현금은 목표 비중에 가장 가까워지도록 재배분합니다.")
+
     if st.button("🚀 Calculate Purchase Plan (Data-Driven)", type="primary"):
         final_weights = {}
         
         # Use centralized logic from utils
-        final_weights, stock_cap_details = utils.calculate_consolidated_weights(ETF_AUMS, compositions)
+        final_weights, stock_cap_details = consolidate(ETF_AUMS, compositions)
         total_raw_score = sum(ETF_AUMS.values()) # Just for metrics display
-                        
-        # Fractional Shares Option (Default: True per user request)
-        allow_fractional = st.checkbox("Allow Fractional Shares (소수점 거래 허용)", value=True, help="체크하면 1주 미만의 소수점 단위까지 매수하여 현금을 최대한 활용합니다.")
         
         # Price Fetch & Calc
         with st.spinner("Fetching Real-time Prices..."):
             sorted_t = sorted(final_weights.keys())
-            prices = data_loader.get_latest_prices(sorted_t)
+            prices = market.get_latest_prices(sorted_t)
             
-            buy_list = []
-            skipped_list = []
-            missing_price_list = []
-            total_cost = 0
-            
-            for t, w in final_weights.items():
-                p = prices.get(t) or prices.get(t.replace('.', '-'), 0)
-                if p > 0:
-                    amt = total_investment * (w/100)
-                    
-                    if allow_fractional:
-                        shares = round(amt / p, 6) # Increase to 6 decimal places to catch small positions
-                    else:
-                        shares = int(amt // p)
-                        
-                    if shares > 0:
-                        cost = shares * p
-                        # Get sectors/ETFs this stock belongs to from the breakdown keys (from refactored utils call)
-                        sectors = ", ".join(list(stock_cap_details.get(t, {}).keys()))
-                        
-                        buy_list.append({
-                            "Ticker": t, "Shares": shares, "Price ($)": p, 
-                            "Cost ($)": cost, "Weight (%)": w, "Sectors": sectors
-                        })
-                        total_cost += cost
-                    else:
-                        skipped_list.append({
-                            "Ticker": t, "Price ($)": p, "Required ($)": p, "Allocated ($)": amt
-                        })
-                else:
-                    missing_price_list.append(t)
+            # Vectorized order sizing (whole-share mode redistributes the leftover cash)
+            plan = purchase_plan.compute_purchase_plan(final_weights, prices, total_investment, allow_fractional=allow_fractional)
+            df_buy, df_skipped = purchase_plan.plan_frames(plan, 0, stock_cap_details)
+            st.session_state["last_plan"] = plan
+            memory_monitor.record_object("purchase_plan.plan", plan)
+            memory_monitor.record_object("purchase_plan.df_buy", df_buy)
+            memory_monitor.record_object("purchase_plan.df_skipped", df_skipped)
+            st.session_state.pop("nav_tracker", None)
+            missing_price_list = plan["missing"]
+            total_cost = float(plan["cost"][0].sum())
             
             # Display
-            if buy_list:
-                df_buy = pd.DataFrame(buy_list).sort_values("Cost ($)", ascending=False)
-                
+            if not df_buy.empty:
                 c1, c2, c3 = st.columns(3)
                 c1.metric("Total Cost", f"${total_cost:,.2f}")
-                c2.metric("Cash Balance", f"${total_investment - total_cost:,.2f}")
-                c3.metric("Purchased Stocks", f"{len(buy_list)} / {len(final_weights)}")
+                c2.metric("Cash Balance", f"${total_investment - total_cost:,.2f}", f"Tracking Error {plan['tracking_error'][0]:.3f}%p", delta_color="off")
+                c3.metric("Purchased Stocks", f"{len(df_buy)} / {len(final_weights)}")
                 
                 st.dataframe(
                     df_buy.style.format({"Price ($)": "${:.2f}", "Cost ($)": "${:.2f}", "Weight (%)": "{:.2f}%", "Shares": "{:.6f}"}),
@@ -353,15 +476,15 @@ elif menu == "Invest in ETF":
                     key="download_order_sheet_button"
                 )
                 
-                if skipped_list:
-                    with st.expander(f"⚠️ Skipped Stocks ({len(skipped_list)}) - Insufficient Capital", expanded=False):
+                if not df_skipped.empty:
+                    with st.expander(f"⚠️ Skipped Stocks ({len(df_skipped)}) - Insufficient Capital", expanded=False):
                         st.warning(f"""
-                        **{len(skipped_list)}개 종목은 투자금 부족으로 매수하지 못했습니다.**
+                        **{len(df_skipped)}개 종목은 투자금 부족으로 매수하지 못했습니다.**
                         
                         예: 1주 가격이 $100인데, 배정된 금액이 $10라면 매수할 수 없습니다.
                         모든 종목을 사려면 투자 금액을 늘려야 합니다.
                         """)
-                        st.dataframe(pd.DataFrame(skipped_list))
+                        st.dataframe(df_skipped)
                         
             else:
                 st.warning("매수할 종목이 없습니다. 투자 금액을 늘리거나 네트워크 연결을 확인해주세요.")
@@ -381,3 +504,192 @@ elif menu == "Invest in ETF":
                         st.write("Sample Prices:")
                         st.json(dict(list(prices.items())[:5]))
                         st.json({k: v for k, v in prices.items() if 'BRK' in k}) # Explicitly check BRK
+
+    if "last_plan" in st.session_state:
+        st.markdown("---")
+        st.markdown("### 📡 Live NAV Tracker")
+        st.caption("마지막으로 계산한 매수 계획을 체결했다고 가정하고, 실시간 시세로 NAV·당일 손익·목표 비중 이탈을 추적합니다.")
+
+        if st.toggle("Track live NAV", key="nav_tracking"):
+            @st.fragment(run_every=NAV_POLL_SECONDS)
+            def live_nav():
+                if "nav_tracker" not in st.session_state:
+                    plan = st.session_state["last_plan"]
+                    tracker = nav_tracker.NavTracker.from_plan(plan)
+                    st.session_state["nav_tracker"] = tracker
+                    st.session_state["nav_source"] = nav_tracker.YFinanceQuoteSource(tracker.tickers)
+                tracker = st.session_state["nav_tracker"]
+                snap = tracker.update(st.session_state["nav_source"].poll())
+
+                n1, n2, n3 = st.columns(3)
+                n1.metric("NAV", f"${snap['nav']:,.2f}")
+                n2.metric("P&L vs. Plan Prices", f"${snap['pnl']:,.2f}", f"{snap['pnl_pct']:+.2f}%")
+                n3.metric("Tracking Error", f"{snap['tracking_error']:.3f}%p", f"{snap['ticks']} updates", delta_color="off")
+                history = tracker.history.to_frame()
+                if len(history) > 1:
+                    st.line_chart(history["nav"], height=220)
+                with st.expander("Largest Weight Drifts"):
+                    st.dataframe(tracker.drift().head(20).style.format("{:.2f}"), use_container_width=True)
+
+            live_nav()
+
+    st.markdown("---")
+    st.markdown("### 🔄 Rebalance Existing Holdings")
+    st.caption("현재 보유 종목(CSV: `Ticker,Shares`)을 업로드하면, 최신 통합 비중으로 되돌리기 위한 **최소 매매 목록**을 계산합니다.")
+
+    holdings_file = st.file_uploader("Current Positions (CSV)", type=["csv"], key="rebalance_holdings")
+    rb_col1, rb_col2 = st.columns(2)
+    with rb_col1:
+        tolerance = st.number_input("Tolerance Band (%p)", value=0.5, min_value=0.0, step=0.1, help="목표 비중과의 차이가 이 값 이하인 종목은 매매하지 않습니다.")
+    with rb_col2:
+        extra_cash = st.number_input("Available Cash ($)", value=0.0, min_value=0.0, step=100.0)
+
+    if holdings_file is not None and st.button("🔄 Calculate Rebalance Trades"):
+        try:
+            holdings = rebalance.read_holdings(holdings_file)
+        except ValueError as e:
+            st.error(str(e))
+            holdings = None
+
+        if holdings is not None:
+            final_weights, _ = consolidate(ETF_AUMS, compositions)
+            with st.spinner("Fetching Real-time Prices..."):
+                rb_tickers = sorted(set(final_weights.keys()) | set(holdings.index))
+                prices = market.get_latest_prices(rb_tickers)
+                last_prices = rebalance.last_known_prices([t for t in holdings.index if t not in prices])
+
+            try:
+                trades, rb_summary = rebalance.compute_rebalance_trades(
+                    holdings, final_weights, prices, tolerance=tolerance, cash=extra_cash, allow_fractional=allow_fractional,
+                    last_prices=last_prices
+                )
+            except ValueError as e:
+                st.error(f"⚠️ 리밸런싱을 계산할 수 없습니다. {e}")
+                rb_summary = None
+
+            if rb_summary is not None:
+                c1, c2, c3 = st.columns(3)
+                c1.metric("Portfolio NAV", f"${rb_summary['nav']:,.2f}")
+                c2.metric("Turnover", f"${rb_summary['turnover']:,.2f}", f"{len(trades)} trades", delta_color="off")
+                c3.metric("Cash After", f"${rb_summary['cash_after']:,.2f}", f"{rb_summary['in_band']} positions within band", delta_color="off")
+
+                if trades.empty:
+                    st.success("모든 종목이 허용 범위 안에 있습니다. 매매가 필요 없습니다.")
+                else:
+                    st.dataframe(
+                        trades.style.format({
+                            "Trade Shares": "{:.6f}", "Price ($)": "${:.2f}", "Trade Value ($)": "${:,.2f}",
+                            "Current Weight (%)": "{:.2f}%", "Target Weight (%)": "{:.2f}%", "Drift (%p)": "{:+.2f}"
+                        }),
+                        use_container_width=True,
+                        hide_index=True
+                    )
+                    st.download_button(
+                        label="💾 Download Rebalance Orders",
+                        data=trades.to_csv(index=False).encode('utf-8'),
+                        file_name="rebalance_orders.csv",
+                        mime="text/csv",
+                        key="download_rebalance_button"
+                    )
+
+                if rb_summary["last_known_price"]:
+                    st.warning(f"⚠️ 실시간 가격이 없어 마지막으로 기록된 가격으로 평가한 보유 종목 (매매 제외): {', '.join(rb_summary['last_known_price'][:20])}")
+                if rb_summary["untradeable"]:
+                    st.error(f"⚠️ {len(rb_summary['untradeable'])} Stocks Failed to Fetch Price: {', '.join(rb_summary['untradeable'][:20])}")
+
+# --- Hidden View: Diagnostics ---
+elif menu == "Diagnostics":
+    st.title("🩺 Diagnostics")
+    st.caption("Per-process counters, timers and latency histograms collected by `instrumentation`.")
+
+    snap = instrumentation.snapshot()
+
+    col_dl, col_reset, _ = st.columns([1, 1, 3])
+    with col_dl:
+        st.download_button(
+            label="💾 Export Metrics (JSON)",
+            data=instrumentation.export_json().encode('utf-8'),
+            file_name="diagnostics.json",
+            mime="application/json"
+        )
+    with col_reset:
+        if st.button("Reset Metrics"):
+            instrumentation.reset()
+            memory_monitor.reset()
+            st.rerun()
+
+    st.markdown("#### Cache Hits / Misses")
+    if snap["cache"]:
+        st.dataframe(pd.DataFrame(snap["cache"]).T, use_container_width=True)
+    else:
+        st.write("No cached calls recorded yet.")
+
+    st.markdown("#### Timers")
+    if snap["timers"]:
+        df_timers = pd.DataFrame(snap["timers"]).T.sort_values("total_ms", ascending=False)
+        st.dataframe(df_timers.style.format("{:.1f}"), use_container_width=True)
+
+    st.markdown("#### Counters (fallback paths, retries, errors)")
+    if snap["counters"]:
+        st.dataframe(pd.Series(snap["counters"], name="count").sort_index(), use_container_width=True)
+
+    st.markdown("#### Per-Ticker Latency Histograms")
+    bucket_labels = [f"<={b}ms" for b in snap["latency_buckets_ms"]] + [f">{snap['latency_buckets_ms'][-1]}ms"]
+    for name, per_ticker in snap["histograms"].items():
+        with st.expander(f"{name} ({len(per_ticker)} tickers)"):
+            st.dataframe(pd.DataFrame(per_ticker, index=bucket_labels).T, use_container_width=True)
+
+    st.markdown("#### Price Data Quality")
+    quality = pd.Series(price_validation.latest_quality(), name="score", dtype=float)
+    if not quality.empty:
+        flagged = quality[quality < 1.0].sort_values()
+        st.caption(f"{len(quality)} tickers scored; {int((quality < price_validation.QUARANTINE_BELOW).sum())} low quality or quarantined, {len(flagged)} below 1.0.")
+        st.dataframe(flagged, use_container_width=True)
+    else:
+        st.write("No price series validated yet.")
+
+    st.markdown("#### Memory")
+    limit_mb = memory_monitor.container_limit_mb()
+    m1, m2, m3 = st.columns(3)
+    m1.metric("Process RSS", f"{memory_monitor.rss_mb():,.0f} MB")
+    m2.metric("Container Limit", f"{limit_mb:,.0f} MB" if limit_mb else "unlimited")
+    m3.metric("Cache Budget", f"{memory_monitor.CACHE_BUDGET_MB:,.0f} MB", memory_monitor.EVICTION_POLICY, delta_color="off")
+
+    tracing = st.toggle("Trace allocations (tracemalloc)", value=memory_monitor.tracing(), help="Per-view and per-cached-function allocations; slows the app down while on.")
+    if tracing != memory_monitor.tracing():
+        if tracing:
+            memory_monitor.start_tracing()
+        else:
+            memory_monitor.stop_tracing()
+        st.rerun()
+
+    usage = memory_monitor.usage()
+    if not usage.empty:
+        st.caption("Traced allocations per view and cached function (net = still held at the end, peak = high-water mark).")
+        st.dataframe(usage.sort_values("max_peak_mb", ascending=False).style.format("{:.2f}"), use_container_width=True)
+    elif memory_monitor.tracing():
+        st.write("Open the other views to collect per-view allocations.")
+
+    cache_usage = memory_monitor.cache_usage()
+    if not cache_usage.empty:
+        st.caption("st.cache_data entries (pickled size). Budgets are enforced after every run.")
+        st.dataframe(cache_usage.style.format("{:.2f}", subset=["Size (MB)", "Largest (MB)", "Budget (MB)"]), use_container_width=True)
+        if st.button("Enforce Cache Budgets Now"):
+            evicted = memory_monitor.enforce_budgets()
+            st.success(f"Evicted {len(evicted)} entries ({sum(size for _, size in evicted) / memory_monitor.MB:.1f} MB).")
+
+    objects = memory_monitor.objects()
+    if not objects.empty:
+        st.caption("Long-lived objects (deep size).")
+        st.dataframe(objects[["type", "mb"]], use_container_width=True)
+
+    if memory_monitor.tracing():
+        with st.expander("Top allocation sites (app modules)"):
+            st.dataframe(memory_monitor.top_allocations(under=os.path.dirname(os.path.abspath(__file__))), use_container_width=True, hide_index=True)
+
+    if snap["errors"]:
+        st.markdown(f"#### Recent Errors ({len(snap['errors'])})")
+        st.dataframe(pd.DataFrame(snap["errors"]), use_container_width=True, hide_index=True)
+
+memory_monitor.end(view_memory)
+memory_monitor.enforce_budgets()
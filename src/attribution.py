@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import instrumentation
+import theme_index
+from return_matrix import ReturnMatrix, build_return_matrix
+
+
+def share_matrix(stocks, stock_breakdown):
+    """
+    Sparse (stock x ETF) matrix: the fraction of each stock's weight that came
+    from each source ETF (raw-score shares, rows sum to 1).
+
+    Returns:
+        scipy.sparse.csr_matrix: shares
+        list: ETF tickers (column labels)
+    """
+    df = theme_index.breakdown_frame({t: stock_breakdown.get(t, {}) for t in stocks})
+    etfs = list(dict.fromkeys(df["etf"]))
+    if df.empty:
+        return sp.csr_matrix((len(stocks), 0)), etfs
+    row_of = {t: i for i, t in enumerate(stocks)}
+    col_of = {e: j for j, e in enumerate(etfs)}
+    share = (df["raw_score"] / df.groupby("ticker")["raw_score"].transform("sum")).fillna(0.0)
+    matrix = sp.csr_matrix(
+        (share.to_numpy(), (df["ticker"].map(row_of).to_numpy(), df["etf"].map(col_of).to_numpy())),
+        shape=(len(stocks), len(etfs))
+    )
+    return matrix, etfs
+
+
+def theme_matrix(etfs):
+    """
+    Sparse (ETF x theme) membership matrix; ETFs outside THEME_TABS go to 'Other'.
+    """
+    themes = [theme_index.ETF_TO_THEME.get(e, "Other") for e in etfs]
+    labels = list(dict.fromkeys(themes))
+    col_of = {t: j for j, t in enumerate(labels)}
+    matrix = sp.csr_matrix(
+        (np.ones(len(etfs)), (np.arange(len(etfs)), [col_of[t] for t in themes])),
+        shape=(len(etfs), len(labels))
+    )
+    return matrix, labels
+
+
+def _link_factors(daily):
+    """
+    Carino linking: per-day scale factors so that the daily contributions of any
+    grouping add up exactly to the compounded total return.
+    """
+    total = np.prod(1.0 + daily) - 1.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        k_total = np.log1p(total) / total if total != 0 else 1.0
+        k_daily = np.where(daily != 0, np.log1p(daily) / daily, 1.0)
+    return k_daily / k_total
+
+
+@instrumentation.timed("attribution.attribute_returns")
+def attribute_returns(final_weights, stock_breakdown, price_data):
+    """
+    Splits the backtested portfolio return into contributions by stock, source ETF
+    and theme tab.
+
+    Daily stock contributions are C = R * w (same constant-weight, zero-masked
+    portfolio as ReturnMatrix.portfolio_returns). ETF and theme contributions are
+    two sparse products on top: C @ S (S = stock x ETF shares from stock_breakdown)
+    and (C @ S) @ M (M = ETF x theme membership).
+
+    Args:
+        final_weights (dict): {ticker: weight_percentage} from calculate_consolidated_weights
+        stock_breakdown (dict): {ticker: {etf: raw_score}} from calculate_consolidated_weights
+        price_data (pd.DataFrame | ReturnMatrix): close prices or a prebuilt ReturnMatrix
+
+    Returns:
+        dict: {
+            "daily": pd.Series portfolio daily return,
+            "stock" / "etf" / "theme": pd.DataFrame daily contributions (dates x group),
+            "totals": {"stock"/"etf"/"theme": pd.Series linked contribution to the total return},
+        }
+        Empty dict when no holding has price history.
+    """
+    matrix = price_data if isinstance(price_data, ReturnMatrix) else build_return_matrix(price_data)
+    stocks, cols = [], []
+    for t in final_weights:
+        col = matrix.price_column(t)
+        if col:
+            stocks.append(t)
+            cols.append(col)
+    if not stocks or not len(matrix.dates):
+        return {}
+
+    # Holdings without any valid return are dropped and their weight spread over the rest
+    live = set(matrix.tickers) - set(matrix.dead_tickers(cols))
+    stocks, cols = [t for t, c in zip(stocks, cols) if c in live], [c for c in cols if c in live]
+    if not stocks:
+        return {}
+    idx = matrix.columns_for(cols)
+    valid = matrix.valid[:, idx]
+    start = int(valid.argmax(axis=0).max())
+
+    w = np.array([final_weights[t] for t in stocks], dtype=float)
+    w *= sum(final_weights.values()) / w.sum() / 100.0
+    contrib = matrix.returns[start:, idx] * w[None, :]
+    daily = contrib.sum(axis=1)
+    dates = matrix.dates[start:]
+
+    S, etfs = share_matrix(stocks, stock_breakdown)
+    M, themes = theme_matrix(etfs)
+    by_etf = np.asarray((S.T @ contrib.T).T)
+    by_theme = np.asarray((M.T @ by_etf.T).T)
+
+    link = _link_factors(daily)[:, None]
+    frames = {
+        "stock": pd.DataFrame(contrib, index=dates, columns=stocks),
+        "etf": pd.DataFrame(by_etf, index=dates, columns=etfs),
+        "theme": pd.DataFrame(by_theme, index=dates, columns=themes),
+    }
+    totals = {
+        name: pd.Series((frame.to_numpy() * link).sum(axis=0), index=frame.columns).sort_values(ascending=False)
+        for name, frame in frames.items()
+    }
+    return {"daily": pd.Series(daily, index=dates), **frames, "totals": totals}
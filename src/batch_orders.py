@@ -0,0 +1,199 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+import data_loader
+import utils
+import purchase_plan
+import instrumentation
+import theme_index
+
+# Column types of the two sheets, declared up front so every chunk (also an empty
+# first one) writes the same Parquet schema
+ORDER_COLUMNS = {
+    "Account": "string",
+    "Ticker": "string",
+    "Shares": "float64",
+    "Price ($)": "float64",
+    "Cost ($)": "float64",
+    "Weight (%)": "float64",
+    "Sectors": "string",
+}
+SUMMARY_COLUMNS = {
+    "Account": "string",
+    "Total Investment ($)": "float64",
+    "Total Cost ($)": "float64",
+    "Cash Balance ($)": "float64",
+    "Tracking Error (%p)": "float64",
+    "Positions": "int64",
+}
+
+
+def read_accounts(path):
+    """
+    Reads the accounts file (CSV or Parquet) with columns `account` and `total_investment`.
+    """
+    if path.lower().endswith('.parquet'):
+        accounts = pd.read_parquet(path)
+    else:
+        accounts = pd.read_csv(path)
+
+    accounts.columns = [c.strip().lower() for c in accounts.columns]
+    missing = {"account", "total_investment"} - set(accounts.columns)
+    if missing:
+        raise ValueError(f"Accounts file is missing columns: {', '.join(sorted(missing))}")
+
+    accounts = accounts[["account", "total_investment"]].copy()
+    accounts["account"] = accounts["account"].astype(str)
+    accounts["total_investment"] = pd.to_numeric(accounts["total_investment"], errors="coerce")
+    return accounts.dropna(subset=["total_investment"])
+
+
+def iter_order_sheets(accounts, final_weights, prices, allow_fractional=True, stock_cap_details=None, chunk_size=500):
+    """
+    Yields (orders, summary) DataFrames for consecutive chunks of accounts.
+    Each chunk is sized in one vectorized compute_purchase_plan call, so only
+    `chunk_size` accounts are held in memory at a time.
+    """
+    sectors_s = theme_index.sectors_by_stock(stock_cap_details or {})
+    sectors = None
+
+    for start in range(0, len(accounts), chunk_size):
+        chunk = accounts.iloc[start:start + chunk_size]
+        plan = purchase_plan.compute_purchase_plan(
+            final_weights, prices, chunk["total_investment"].to_numpy(), allow_fractional=allow_fractional
+        )
+        tickers = np.asarray(plan["tickers"], dtype=object)
+        if sectors is None:
+            sectors = sectors_s.reindex(tickers).fillna("").to_numpy(dtype=object)
+
+        # Long format: one row per (account, ticker) with a non-zero order
+        rows, cols = np.nonzero(plan["shares"] > 0)
+        account_ids = chunk["account"].to_numpy()
+        orders = pd.DataFrame({
+            "Account": account_ids[rows],
+            "Ticker": tickers[cols],
+            "Shares": plan["shares"][rows, cols],
+            "Price ($)": plan["prices"][cols],
+            "Cost ($)": plan["cost"][rows, cols],
+            "Weight (%)": plan["weights"][cols],
+            "Sectors": sectors[cols],
+        })
+
+        summary = pd.DataFrame({
+            "Account": account_ids,
+            "Total Investment ($)": plan["investments"],
+            "Total Cost ($)": plan["cost"].sum(axis=1),
+            "Cash Balance ($)": plan["cash"],
+            "Tracking Error (%p)": plan["tracking_error"],
+            "Positions": (plan["shares"] > 0).sum(axis=1),
+        })
+        yield orders, summary
+
+
+class _SheetWriter:
+    """
+    Appends DataFrames to a CSV or Parquet file chunk by chunk, with the declared
+    columns ({name: dtype}). A run without any chunk still writes an empty sheet.
+    """
+    def __init__(self, path, fmt, columns):
+        self.path = path
+        self.fmt = fmt
+        self.columns = columns
+        self._writer = None
+        self._wrote_header = False
+
+    def write(self, df):
+        df = df[list(self.columns)].astype(self.columns)
+        if self.fmt == "parquet":
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise ImportError("Parquet output requires pyarrow (pip install pyarrow)")
+            schema = pa.schema([(name, pa.from_numpy_dtype(np.dtype(dtype)) if dtype != "string" else pa.string())
+                                for name, dtype in self.columns.items()])
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, schema)
+            self._writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+        else:
+            df.to_csv(self.path, mode='a' if self._wrote_header else 'w', header=not self._wrote_header, index=False)
+            self._wrote_header = True
+
+    def close(self):
+        if self._writer is None and not self._wrote_header:
+            self.write(pd.DataFrame({name: pd.Series(dtype=dtype) for name, dtype in self.columns.items()}))
+        if self._writer is not None:
+            self._writer.close()
+
+
+def write_order_sheets(accounts, final_weights, prices, out_path, fmt=None, allow_fractional=True,
+                       stock_cap_details=None, chunk_size=500, summary_path=None):
+    """
+    Streams order sheets for every account to `out_path` (CSV or Parquet).
+
+    Args:
+        accounts (pd.DataFrame): columns `account`, `total_investment`
+        final_weights (dict): {ticker: weight_percentage}, shared by all accounts
+        prices (dict): {ticker: latest_price}, fetched once for all accounts
+        fmt (str): 'csv' or 'parquet' (default: from the file extension)
+        summary_path (str): optional per-account summary file (same format)
+
+    Returns:
+        int: number of order rows written
+    """
+    fmt = fmt or ('parquet' if out_path.lower().endswith('.parquet') else 'csv')
+    order_writer = _SheetWriter(out_path, fmt, ORDER_COLUMNS)
+    summary_writer = _SheetWriter(summary_path, fmt, SUMMARY_COLUMNS) if summary_path else None
+    n_rows = 0
+
+    try:
+        with instrumentation.timer("batch_orders.write_order_sheets"):
+            for orders, summary in iter_order_sheets(accounts, final_weights, prices, allow_fractional,
+                                                     stock_cap_details, chunk_size):
+                order_writer.write(orders)
+                n_rows += len(orders)
+                if summary_writer:
+                    summary_writer.write(summary)
+    finally:
+        order_writer.close()
+        if summary_writer:
+            summary_writer.close()
+
+    return n_rows
+
+
+def generate_order_sheets(accounts_path, out_path, fmt=None, allow_fractional=True, chunk_size=500, summary_path=None):
+    """
+    End-to-end batch run: consolidated weights and prices are computed once,
+    then every account in `accounts_path` is sized against them.
+    """
+    accounts = read_accounts(accounts_path)
+
+    etf_aums, _ = data_loader.get_etf_aums(data_loader.load_etf_metadata())
+    final_weights, stock_cap_details = utils.get_consolidated_weights(etf_aums, data_loader.load_compositions())
+    prices = data_loader.get_latest_prices(sorted(final_weights.keys()))
+
+    return write_order_sheets(accounts, final_weights, prices, out_path, fmt, allow_fractional,
+                              stock_cap_details, chunk_size, summary_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate order sheets for many accounts in one run.")
+    parser.add_argument("accounts", help="CSV/Parquet file with columns: account, total_investment")
+    parser.add_argument("-o", "--output", default="order_sheets.csv", help="Output file (.csv or .parquet)")
+    parser.add_argument("--format", choices=["csv", "parquet"], help="Override format detected from the extension")
+    parser.add_argument("--summary", help="Optional per-account summary output file")
+    parser.add_argument("--whole-shares", action="store_true", help="Buy whole shares only (leftover cash is redistributed)")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Accounts sized per vectorized batch")
+    args = parser.parse_args(argv)
+
+    n_rows = generate_order_sheets(
+        args.accounts, args.output, fmt=args.format, allow_fractional=not args.whole_shares,
+        chunk_size=args.chunk_size, summary_path=args.summary
+    )
+    print(f"Wrote {n_rows} order rows to {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
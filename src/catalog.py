@@ -0,0 +1,277 @@
+import os
+import time
+import sqlite3
+import argparse
+import threading
+import data_loader
+import instrumentation
+
+CATALOG_PATH = os.environ.get("ETF_CATALOG_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'cache', 'catalog.sqlite3'
+)
+
+# Observations older than this are deleted (the latest one per ticker and kind is always kept)
+OBSERVATION_RETENTION_DAYS = float(os.environ.get("ETF_OBSERVATION_RETENTION_DAYS", 90))
+# The fetchers prune at most this often per process
+PRUNE_INTERVAL_SECONDS = 3600 * 6
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS etfs (
+    ticker        TEXT PRIMARY KEY,
+    name          TEXT,
+    fallback_aum  REAL,
+    description   TEXT
+);
+CREATE TABLE IF NOT EXISTS holdings (
+    etf      TEXT NOT NULL,
+    ticker   TEXT NOT NULL,
+    weight   REAL NOT NULL,
+    as_of    TEXT NOT NULL,
+    PRIMARY KEY (etf, as_of, ticker)
+);
+CREATE INDEX IF NOT EXISTS idx_holdings_ticker ON holdings (ticker, as_of);
+CREATE TABLE IF NOT EXISTS ticker_aliases (
+    alias   TEXT PRIMARY KEY,
+    ticker  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_aliases_ticker ON ticker_aliases (ticker);
+CREATE TABLE IF NOT EXISTS stock_pool (
+    ticker   TEXT PRIMARY KEY,
+    name     TEXT,
+    sector   TEXT,
+    sources  TEXT
+);
+CREATE TABLE IF NOT EXISTS observations (
+    ticker       TEXT NOT NULL,
+    kind         TEXT NOT NULL,   -- 'price' | 'market_cap' | 'aum' | 'shares'
+    observed_at  REAL NOT NULL,   -- unix time
+    value        REAL NOT NULL,
+    currency     TEXT NOT NULL DEFAULT 'USD',
+    source       TEXT,
+    PRIMARY KEY (kind, ticker, observed_at)
+);
+"""
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = set()
+_last_pruned = {}
+
+
+def connect(path=None):
+    """
+    Per-thread connection in WAL mode, so the app, fetcher threads and CLI tools
+    can read while one of them writes.
+    """
+    path = os.path.abspath(path or CATALOG_PATH)
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with _init_lock:
+            if path not in _initialized:
+                conn.executescript(SCHEMA)
+                _initialized.add(path)
+        conns[path] = conn
+    return conn
+
+
+def _bulk(sql, rows, path=None):
+    if not rows:
+        return 0
+    conn = connect(path)
+    with instrumentation.timer("catalog.bulk_upsert"):
+        with conn:
+            conn.executemany(sql, rows)
+    return len(rows)
+
+
+def upsert_etfs(etf_metadata, path=None):
+    rows = [(t, m.get('name'), m.get('fallback_aum'), m.get('description')) for t, m in etf_metadata.items()]
+    return _bulk("""
+        INSERT INTO etfs (ticker, name, fallback_aum, description) VALUES (?, ?, ?, ?)
+        ON CONFLICT (ticker) DO UPDATE SET
+            name = excluded.name, fallback_aum = excluded.fallback_aum, description = excluded.description
+    """, rows, path)
+
+
+def upsert_holdings(compositions, as_of, path=None):
+    """
+    Replaces the holdings of each ETF for `as_of` with `compositions`.
+    """
+    rows = [(etf, t, float(w), as_of) for etf, h in compositions.items() for t, w in h.items()]
+    conn = connect(path)
+    with instrumentation.timer("catalog.bulk_upsert"):
+        with conn:
+            conn.executemany("DELETE FROM holdings WHERE etf = ? AND as_of = ?", [(etf, as_of) for etf in compositions])
+            conn.executemany("INSERT INTO holdings (etf, ticker, weight, as_of) VALUES (?, ?, ?, ?)", rows)
+    return len(rows)
+
+
+def upsert_aliases(name_to_ticker, path=None):
+    return _bulk("""
+        INSERT INTO ticker_aliases (alias, ticker) VALUES (?, ?)
+        ON CONFLICT (alias) DO UPDATE SET ticker = excluded.ticker
+    """, list(name_to_ticker.items()), path)
+
+
+def upsert_stock_pool(pool, path=None):
+    rows = [(s['ticker'], s.get('name'), s.get('sector'), s.get('sources')) for s in pool if s.get('ticker')]
+    return _bulk("""
+        INSERT INTO stock_pool (ticker, name, sector, sources) VALUES (?, ?, ?, ?)
+        ON CONFLICT (ticker) DO UPDATE SET
+            name = excluded.name, sector = excluded.sector, sources = excluded.sources
+    """, rows, path)
+
+
+def record_observations(kind, values, currency="USD", source="yfinance", observed_at=None, path=None):
+    """
+    Bulk-stores timestamped observations, e.g. record_observations('price', {'NVDA': 181.2}).
+    """
+    observed_at = observed_at or time.time()
+    rows = [(t, kind, observed_at, float(v), currency, source) for t, v in values.items() if v is not None]
+    return _bulk("""
+        INSERT INTO observations (ticker, kind, observed_at, value, currency, source) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (kind, ticker, observed_at) DO UPDATE SET
+            value = excluded.value, currency = excluded.currency, source = excluded.source
+    """, rows, path)
+
+
+def try_record_observations(kind, values, **kwargs):
+    """
+    Best-effort variant for the fetchers: a locked or read-only catalog never breaks a fetch.
+    """
+    try:
+        count = record_observations(kind, values, **kwargs)
+        path = os.path.abspath(kwargs.get("path") or CATALOG_PATH)
+        if time.time() - _last_pruned.get(path, 0.0) > PRUNE_INTERVAL_SECONDS:
+            _last_pruned[path] = time.time()
+            prune_observations(path=path)
+        return count
+    except (sqlite3.Error, OSError) as e:
+        instrumentation.record_error("catalog.record_observations", kind, e)
+        return 0
+
+
+def prune_observations(retention_days=None, path=None):
+    """
+    Deletes observations older than the retention window, keeping the latest one
+    per (kind, ticker) so lookups without max_age still find a value.
+
+    Returns:
+        int: rows deleted
+    """
+    retention_days = OBSERVATION_RETENTION_DAYS if retention_days is None else retention_days
+    conn = connect(path)
+    with instrumentation.timer("catalog.prune_observations"):
+        with conn:
+            deleted = conn.execute("""
+                DELETE FROM observations
+                WHERE observed_at < ? AND (kind, ticker, observed_at) NOT IN (
+                    SELECT kind, ticker, MAX(observed_at) FROM observations GROUP BY kind, ticker
+                )
+            """, (time.time() - retention_days * 86400,)).rowcount
+    instrumentation.increment("catalog.observations_pruned", deleted)
+    return deleted
+
+
+def sync_reference_data(as_of=None, path=None):
+    """
+    Loads the four JSON reference files into the catalog in bulk.
+    """
+    as_of = as_of or time.strftime("%Y-%m-%d")
+    counts = {
+        "etfs": upsert_etfs(data_loader.load_etf_metadata(), path),
+        "holdings": upsert_holdings(data_loader.load_compositions(), as_of, path),
+        "ticker_aliases": upsert_aliases(data_loader.load_ticker_mapping(), path),
+        "stock_pool": upsert_stock_pool(data_loader.load_stock_pool(), path),
+    }
+    return counts
+
+
+def etfs_holding(ticker, as_of=None, path=None):
+    """
+    Which ETFs hold `ticker` (latest snapshot on or before `as_of`), via idx_holdings_ticker.
+
+    Returns:
+        list: [(etf, weight), ...] sorted by weight desc
+    """
+    conn = connect(path)
+    as_of = as_of or "9999-12-31"
+    return conn.execute("""
+        SELECT h.etf, h.weight FROM holdings h
+        WHERE h.ticker = ? AND h.as_of = (
+            SELECT MAX(as_of) FROM holdings WHERE etf = h.etf AND as_of <= ?
+        )
+        ORDER BY h.weight DESC
+    """, (ticker, as_of)).fetchall()
+
+
+def holdings_of(etf, as_of=None, path=None):
+    conn = connect(path)
+    as_of = as_of or "9999-12-31"
+    rows = conn.execute("""
+        SELECT ticker, weight FROM holdings
+        WHERE etf = ? AND as_of = (SELECT MAX(as_of) FROM holdings WHERE etf = ? AND as_of <= ?)
+        ORDER BY weight DESC
+    """, (etf, etf, as_of)).fetchall()
+    return dict(rows)
+
+
+def resolve_alias(alias, path=None):
+    row = connect(path).execute("SELECT ticker FROM ticker_aliases WHERE alias = ?", (alias,)).fetchone()
+    return row[0] if row else None
+
+
+def latest_observations(kind, tickers=None, max_age_seconds=None, with_currency=False, path=None):
+    """
+    Most recent observation per ticker: {ticker: (value, observed_at)},
+    or {ticker: (value, observed_at, currency)} with with_currency=True.
+    """
+    conn = connect(path)
+    sql = """
+        SELECT o.ticker, o.value, o.observed_at, o.currency FROM observations o
+        JOIN (SELECT ticker, MAX(observed_at) AS ts FROM observations WHERE kind = ? GROUP BY ticker) m
+          ON o.ticker = m.ticker AND o.observed_at = m.ts
+        WHERE o.kind = ?
+    """
+    params = [kind, kind]
+    if max_age_seconds is not None:
+        sql += " AND o.observed_at >= ?"
+        params.append(time.time() - max_age_seconds)
+    rows = conn.execute(sql, params).fetchall()
+    wanted = set(tickers) if tickers is not None else None
+    return {
+        t: ((v, ts, ccy) if with_currency else (v, ts))
+        for t, v, ts, ccy in rows if wanted is None or t in wanted
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local SQLite catalog of ETFs, holdings, aliases and fetched data.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_sync = sub.add_parser("sync", help="Load the JSON reference files into the catalog")
+    p_sync.add_argument("--as-of", help="Holdings snapshot date (default: today)")
+    p_holders = sub.add_parser("holders", help="Which ETFs hold a ticker")
+    p_holders.add_argument("ticker")
+    p_prune = sub.add_parser("prune", help="Delete observations older than the retention window")
+    p_prune.add_argument("--days", type=float, help=f"Retention in days (default: {OBSERVATION_RETENTION_DAYS:g})")
+    args = parser.parse_args(argv)
+
+    if args.command == "sync":
+        counts = sync_reference_data(args.as_of)
+        print(", ".join(f"{k}: {v}" for k, v in counts.items()))
+    elif args.command == "holders":
+        for etf, weight in etfs_holding(args.ticker):
+            print(f"{etf:<6} {weight:.2f}%")
+    elif args.command == "prune":
+        print(f"Deleted {prune_observations(args.days)} observations")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import streamlit as st
+import instrumentation
+import memory_monitor
+
+# About two points per horizontal pixel of a wide chart
+DEFAULT_POINTS = 1200
+METHODS = ("lttb", "minmax")
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: picks n_out points that keep the visual shape
+    of the line. The first and last points are always kept.
+
+    Returns:
+        np.ndarray: indices of the selected points (increasing)
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=int)
+    selected[0] = 0
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nxt = slice(edges[i + 1], edges[i + 2])
+        else:
+            nxt = slice(n - 1, n)
+        avg_x, avg_y = x[nxt].mean(), y[nxt].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area)) if hi > lo else lo
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+def minmax(y, n_out):
+    """
+    Min/max bucketing: the lowest and highest point of each of n_out/2 buckets,
+    so every spike and trough survives. Vectorized over the buckets.
+
+    Returns:
+        np.ndarray: indices of the selected points (increasing, unique)
+    """
+    n = len(y)
+    n_buckets = n_out // 2
+    if n_out >= n or n_buckets < 1:
+        return np.arange(n)
+
+    size = -(-n // n_buckets)
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = y
+    blocks = padded.reshape(n_buckets, size)
+    filled = ~np.isnan(blocks).all(axis=1)
+    offsets = np.arange(n_buckets)[filled] * size
+    lows = offsets + np.nanargmin(blocks[filled], axis=1)
+    highs = offsets + np.nanargmax(blocks[filled], axis=1)
+    return np.unique(np.concatenate([[0], lows, highs, [n - 1]]))
+
+
+def downsample(series, n_points=DEFAULT_POINTS, method="lttb"):
+    """
+    Shape-preserving downsample of one series (NaNs dropped first).
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method '{method}', expected one of {METHODS}")
+    s = series.dropna()
+    if len(s) <= n_points:
+        return s
+    y = s.to_numpy(dtype=float)
+    if method == "lttb":
+        index = s.index
+        x = index.asi8.astype(float) if isinstance(index, pd.DatetimeIndex) else np.arange(len(s), dtype=float)
+        keep = lttb(x, y, n_points)
+    else:
+        keep = minmax(y, n_points)
+    return s.iloc[keep]
+
+
+@memory_monitor.cached("chart_frame")
+@st.cache_data(max_entries=64)
+def chart_frame(key, _frame, n_points=DEFAULT_POINTS, x_range=None, method="lttb"):
+    """
+    Downsampled long-form (Date, Series, Value) data for a plotly line chart.
+
+    Cached on (key, n_points, x_range, method); the frame itself is not hashed, so
+    `key` must identify its content (e.g. portfolio id + last date of the data).
+    Zooming to x_range re-samples that window at full chart resolution.
+    """
+    frame = _frame
+    if x_range is not None:
+        frame = frame.loc[x_range[0]:x_range[1]]
+
+    pieces = []
+    for col in frame.columns:
+        s = downsample(frame[col], n_points, method)
+        pieces.append(pd.DataFrame({"Date": s.index, "Series": str(col), "Value": s.to_numpy()}))
+    instrumentation.increment("chart_data.points_in", int(frame.notna().to_numpy().sum()))
+    instrumentation.increment("chart_data.points_out", sum(len(p) for p in pieces))
+    if not pieces:
+        return pd.DataFrame(columns=["Date", "Series", "Value"])
+    return pd.concat(pieces, ignore_index=True)
+
+
+def line_figure(key, frame, n_points=DEFAULT_POINTS, x_range=None, method="lttb", title=None, y_format=None, height=400):
+    """
+    Plotly line chart of a (Date x Series) frame built from the cached downsampled data.
+    """
+    data = chart_frame(key, frame, n_points, x_range, method)
+    fig = px.line(data, x="Date", y="Value", color="Series", title=title)
+    fig.update_layout(height=height, margin=dict(l=0, r=0, t=40 if title else 10, b=0), legend_title_text="")
+    if y_format:
+        fig.update_yaxes(tickformat=y_format)
+    return fig
@@ -3,7 +3,18 @@ import pandas as pd
 import streamlit as st
 import os
 import json
+import time
+import functools
 import concurrent.futures
+import instrumentation
+import fx_service
+import shared_prices
+import catalog
+import price_validation
+import download_planner
+import result_cache
+import memory_monitor
+import theme_index
 
 # Load ticker mapping from JSON
 def load_ticker_mapping():
@@ -39,11 +50,102 @@ def normalize_ticker(ticker):
     # 3. Default (Assume it is a ticker if not mapped)
     return t_upper
 
+@instrumentation.track_cache("load_stock_data")
+@memory_monitor.cached("load_stock_data")
 @st.cache_data(ttl=3600*24) # Cache data for 24 hours
-def load_stock_data(tickers, period="5y", interval="1d"):
+def load_stock_data(tickers, period="5y", interval="1d", to_usd=True):
     """
-    Fetches historical stock data for the given tickers.
+    Fetches historical stock data for the given tickers, in parallel ticker/date
+    chunks (see download_planner); a failed chunk only drops its own tickers.
+    With to_usd=True, foreign listings (e.g. 9984.T, 000660.KS) are converted to USD
+    with the daily FX history so mixed-currency backtests are consistent.
+    Series are validated and repaired at ingestion (see price_validation);
+    quarantined tickers are left out.
     """
+    instrumentation.cache_miss("load_stock_data")
+    prices, _ = download_planner.download_history(tickers, period, interval)
+    prices = _validated(prices)
+    if to_usd and not prices.empty:
+        with instrumentation.timer("load_stock_data.fx_convert"):
+            prices = fx_service.convert_prices_to_usd(prices)
+    return prices
+
+@st.cache_resource(ttl=3600*24)
+def load_shared_stock_data(tickers, period="5y", interval="1d", to_usd=True):
+    """
+    Like load_stock_data, but returns a read-only frame backed by the host-wide
+    shared price matrix (see shared_prices). Sessions and worker processes reuse
+    the same memory instead of receiving a pickled copy on every cache hit.
+    """
+    name = f"{' '.join(sorted(tickers)) if isinstance(tickers, list) else tickers}|{period}|{interval}|{to_usd}"
+    shared = shared_prices.attach_price_matrix(name=name)
+    if shared is None or _is_stale(shared):
+        prices, _ = download_planner.download_history(tickers, period, interval)
+        prices = _validated(prices)
+        if to_usd and not prices.empty:
+            prices = fx_service.convert_prices_to_usd(prices)
+        if prices.empty:
+            return prices
+        shared = shared_prices.attach_price_matrix(shared_prices.publish_price_matrix(prices, name=name))
+        # Each refresh publishes a new content-hashed file; drop the ones nothing points to anymore
+        shared_prices.prune()
+    return shared.frame()
+
+def _is_stale(shared, max_age_seconds=3600*24):
+    # A matrix published more than a day ago is refreshed, mirroring load_stock_data's TTL
+    return shared.published_at is None or time.time() - shared.published_at > max_age_seconds
+
+def get_splits(tickers):
+    """
+    Reported stock splits per (normalized) ticker, fetched in parallel. Only asked for
+    the few tickers whose prices show a split-like move.
+
+    Returns:
+        dict: {ticker: pd.Series(split ratio, index=date)}
+    """
+    def fetch(ticker, submitted_at):
+        with instrumentation.queued("get_splits.fetch", submitted_at):
+            try:
+                return ticker, yf.Ticker(ticker).splits
+            except Exception as e:
+                instrumentation.record_error("get_splits", ticker, e)
+                return ticker, None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+        fetched = list(executor.map(lambda t: fetch(t, time.perf_counter()), tickers))
+    return {t: s for t, s in fetched if s is not None and len(s)}
+
+# Catalog quotes older than this are not used to cross-check the last close
+REFERENCE_PRICE_MAX_AGE_SECONDS = 3600 * 24 * 3
+
+def _reference_prices(tickers):
+    """
+    Independent last quotes in listing currency (fast_info prices recorded in the
+    catalog by get_latest_prices), keyed by the normalized tickers in `tickers`.
+    """
+    try:
+        recorded = catalog.latest_observations('price', max_age_seconds=REFERENCE_PRICE_MAX_AGE_SECONDS)
+    except Exception as e:
+        instrumentation.record_error("load_stock_data.reference_prices", "price", e)
+        return {}
+    wanted = set(tickers)
+    quotes = {}
+    for t, (v, _) in recorded.items():
+        normalized = normalize_ticker(t)
+        if normalized in wanted:
+            quotes.setdefault(normalized, v)
+    return quotes
+
+def _validated(prices):
+    # Runs in listing currency, before FX conversion, so unit changes are not blurred by FX moves
+    if prices.empty:
+        return prices
+    reference = _reference_prices([str(c) for c in prices.columns])
+    prices, report = price_validation.validate_prices(prices, reference_prices=reference, splits=get_splits)
+    price_validation.record_report(report)
+    return prices
+
+def _download_close_prices(tickers, period, interval, start=None, end=None, raise_errors=False):
     if isinstance(tickers, list):
         tickers = " ".join(tickers)
     
@@ -54,7 +156,11 @@ def load_stock_data(tickers, period="5y", interval="1d"):
         # No, by default it groups by Column (Open, Close...), then Ticker. 
         # So data['Close'] gives a DF with tickers as columns.
         
-        data = yf.download(tickers, period=period, interval=interval, auto_adjust=True, progress=False)
+        with instrumentation.timer("load_stock_data.download"):
+            if start is not None:
+                data = yf.download(tickers, start=start, end=end, interval=interval, auto_adjust=True, progress=False, threads=False)
+            else:
+                data = yf.download(tickers, period=period, interval=interval, auto_adjust=True, progress=False)
         
         if data.empty:
             return pd.DataFrame()
@@ -108,14 +214,18 @@ def load_stock_data(tickers, period="5y", interval="1d"):
         return pd.DataFrame()
 
     except Exception as e:
+        if raise_errors:
+            raise
         # Don't show error to user immediately, just return empty so app can handle
-        print(f"Debug Error fetching {tickers}: {e}") 
+        instrumentation.record_error("load_stock_data", tickers, e)
         return pd.DataFrame()
         
     except Exception as e:
         # st.error(f"Error fetching data: {e}")
         return pd.DataFrame()
 
+@instrumentation.track_cache("get_latest_prices")
+@memory_monitor.cached("get_latest_prices")
 @st.cache_data(ttl=300) # Cache for 5 minutes
 def get_latest_prices(tickers):
     """
@@ -125,10 +235,9 @@ def get_latest_prices(tickers):
     Note: The key in the returned dict must MATCH the input ticker (even if it's a name) 
     so the app can look it up.
     """
+    instrumentation.cache_miss("get_latest_prices")
     if not tickers:
         return {}
-        
-    prices = {}
     
     # Create list of (Original, Normalized) tuples
     if isinstance(tickers, list):
@@ -139,36 +248,159 @@ def get_latest_prices(tickers):
     # Unique pairs to avoid blocking on duplicates
     unique_pairs = list(set(ticker_pairs))
     
-    def fetch_price(original, normalized):
-        try:
-            dat = yf.Ticker(normalized)
-            p = dat.fast_info.get('last_price', None)
-            if p is None:
-                p = dat.fast_info.get('previous_close', None)
-            
-            if p is None:
-                hist = dat.history(period="1d")
-                if not hist.empty:
-                    p = hist['Close'].iloc[-1]
-            
-            return original, p
-        except Exception as e:
-            return original, None
+    def fetch_price(original, normalized, submitted_at):
+        with instrumentation.queued("get_latest_prices.fetch", submitted_at):
+            start = time.perf_counter()
+            try:
+                dat = yf.Ticker(normalized)
+                p = dat.fast_info.get('last_price', None)
+                path = "last_price"
+                if p is None:
+                    p = dat.fast_info.get('previous_close', None)
+                    path = "previous_close"
+                
+                if p is None:
+                    hist = dat.history(period="1d")
+                    path = "history"
+                    if not hist.empty:
+                        p = hist['Close'].iloc[-1]
+                
+                instrumentation.increment(f"get_latest_prices.path.{path}")
+                return original, p
+            except Exception as e:
+                instrumentation.record_error("get_latest_prices", normalized, e)
+                return original, None
+            finally:
+                instrumentation.observe_latency("get_latest_prices.ticker_latency", normalized, time.perf_counter() - start)
 
     with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
-        future_to_ticker = {executor.submit(fetch_price, orig, norm): orig for orig, norm in unique_pairs}
+        future_to_ticker = {executor.submit(fetch_price, orig, norm, time.perf_counter()): orig for orig, norm in unique_pairs}
         
-        for future in concurrent.futures.as_completed(future_to_ticker):
-            t, p = future.result()
-            if p and p > 0:
-                prices[t] = p
-            
+        results = dict(future.result() for future in concurrent.futures.as_completed(future_to_ticker))
+
+    prices = price_validation.valid_quotes(results)
+    catalog.try_record_observations('price', prices)
     return prices
 
-import concurrent.futures
+MARKET_CAP_TTL_SECONDS = 3600 * 24
+
+# Shares outstanding rarely change, so they are kept in the catalog for a week
+SHARES_TTL_SECONDS = 3600 * 24 * 7
+
+# A share count that is a whole multiple (2x..MAX_SHARE_RATIO) of what Yahoo's reported
+# market cap implies counts more than the quoted line (e.g. an ADR whose count includes
+# the home-market listing as well); SHARE_RATIO_TOLERANCE is the allowed distance from it
+MAX_SHARE_RATIO = 10
+SHARE_RATIO_TOLERANCE = 0.05
+
+# Fallback map for tickers with missing market cap data in Yahoo (e.g. ADRs)
+MCAP_FALLBACKS = {
+    "ABB": "ABBN.SW",
+}
 
-@st.cache_data(ttl=3600*24) # Cache for 24 hours
-def get_market_caps(tickers):
+def share_ratio(shares, price, reported_cap):
+    """
+    Whole-number ratio between shares x price and the reported market cap, or 1 when
+    they agree (or differ by something that is not a share-count multiple).
+    """
+    if not (shares and price and reported_cap) or reported_cap <= 0:
+        return 1
+    ratio = shares * price / reported_cap
+    n = round(ratio)
+    if 2 <= n <= MAX_SHARE_RATIO and abs(ratio - n) / n < SHARE_RATIO_TOLERANCE:
+        return n
+    return 1
+
+def _fetch_shares(normalized):
+    """
+    Shares outstanding and quote currency from fast_info, checked once against the
+    reported market cap (share counts are cached for a week, so .info is rare).
+    """
+    ticker_obj = yf.Ticker(normalized)
+    f_info = ticker_obj.fast_info
+    shares = f_info.get('shares')
+    currency = f_info.get('currency') or "USD"
+    if shares:
+        try:
+            info = ticker_obj.info
+            ratio = share_ratio(shares, info.get('currentPrice') or info.get('previousClose'), info.get('marketCap'))
+        except Exception as e:
+            instrumentation.record_error("get_shares_outstanding.info", normalized, e)
+            ratio = 1
+        if ratio > 1:
+            instrumentation.increment("get_shares_outstanding.share_ratio")
+            shares = shares / ratio
+    return shares, currency
+
+def get_shares_outstanding(tickers):
+    """
+    Shares outstanding per normalized ticker, persisted in the catalog.
+    Only tickers without a fresh entry are fetched, in parallel.
+
+    Returns:
+        dict: {normalized_ticker: (shares, currency)}
+    """
+    tickers = list(dict.fromkeys(tickers))
+    try:
+        cached = catalog.latest_observations('shares', tickers, max_age_seconds=SHARES_TTL_SECONDS, with_currency=True)
+    except Exception as e:
+        instrumentation.record_error("get_shares_outstanding.catalog", "shares", e)
+        cached = {}
+    result = {t: (v, ccy) for t, (v, _, ccy) in cached.items()}
+    instrumentation.increment("get_shares_outstanding.cached", len(result))
+
+    missing = [t for t in tickers if t not in result]
+    if missing:
+        def fetch(normalized, submitted_at):
+            with instrumentation.queued("get_shares_outstanding.fetch", submitted_at):
+                try:
+                    return normalized, _fetch_shares(normalized)
+                except Exception as e:
+                    instrumentation.record_error("get_shares_outstanding", normalized, e)
+                    return normalized, (None, None)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
+            fetched = list(executor.map(lambda t: fetch(t, time.perf_counter()), missing))
+        instrumentation.increment("get_shares_outstanding.fetched", len(missing))
+
+        by_currency = {}
+        for t, (shares, currency) in fetched:
+            if shares and shares > 0:
+                result[t] = (shares, currency)
+                by_currency.setdefault(currency, {})[t] = shares
+        for currency, values in by_currency.items():
+            catalog.try_record_observations('shares', values, currency=currency)
+
+    return result
+
+def get_batch_prices(tickers):
+    """
+    Last close per ticker from a single batched download, in listing currency.
+
+    Returns:
+        pd.Series: indexed by ticker (tickers without data are absent)
+    """
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return pd.Series(dtype=float)
+    data = _download_close_prices(tickers, "5d", "1d")
+    if data.empty:
+        return pd.Series(dtype=float)
+    return pd.Series(price_validation.valid_quotes(data.ffill().iloc[-1]), dtype=float)
+
+@instrumentation.track_cache("get_market_caps")
+@memory_monitor.cached("get_market_caps")
+@st.cache_data(ttl=MARKET_CAP_TTL_SECONDS) # Cache for 24 hours
+def get_market_caps(tickers, kind='market_cap'):
+    """
+    Market caps (ETFs: total assets) in USD, keyed by the original ticker.
+    Fresh values are recorded in the catalog as `kind` observations ('aum' for ETFs).
+
+    Caps are computed locally as cached shares outstanding x latest batch price x FX,
+    so a refresh costs one batched price download. Tickers without a share count
+    (mostly ETFs) or without a price go through the per-ticker lookup instead.
+    """
+    instrumentation.cache_miss("get_market_caps")
     if not tickers:
         return {}
     
@@ -182,28 +414,46 @@ def get_market_caps(tickers):
     
     # Unique pairs
     unique_pairs = list(set(ticker_pairs))
+    normalized = [norm for _, norm in unique_pairs]
+
+    # Persistent result for the same ticker set, shared across restarts and workers
+    cache_key = result_cache.fingerprint(sorted(unique_pairs))
+    stored = result_cache.get("market_caps", cache_key, max_age_seconds=MARKET_CAP_TTL_SECONDS)
+    if stored is not None:
+        return stored
+
+    # 1. Local computation: shares x price x FX, one vectorized multiply
+    with instrumentation.timer("get_market_caps.local"):
+        shares_map = get_shares_outstanding(normalized)
+        prices = get_batch_prices(list(shares_map.keys()))
+        shares = pd.Series({t: s for t, (s, _) in shares_map.items()}, dtype=float)
+        currencies = pd.Series({t: c for t, (_, c) in shares_map.items()}, dtype=object)
+        fx_rates = fx_service.get_fx_rates(set(currencies))
+        local_caps = (shares * prices.reindex(shares.index) * currencies.map(fx_rates).astype(float)).dropna()
+        local_caps = local_caps[local_caps > 0]
+    instrumentation.increment("get_market_caps.path.local", len(local_caps))
+
+    for orig, norm in unique_pairs:
+        if norm in local_caps.index:
+            market_caps[orig] = float(local_caps[norm])
+
+    # 2. Per-ticker lookup for the rest
+    remaining = [(orig, norm) for orig, norm in unique_pairs if orig not in market_caps]
+    if remaining:
+        market_caps.update(_fetch_market_caps(remaining))
     
-    # Fallback map for tickers with missing market cap data in Yahoo (e.g. ADRs)
-    MCAP_FALLBACKS = {
-        "ABB": "ABBN.SW",
-    }
-
-    # Approximated exchange rates (Target: USD)
-    EXCHANGE_RATES = {
-        "JPY": 1/150.0,
-        "TWD": 1/32.0,
-        "KRW": 1/1350.0,
-        "EUR": 1.08,
-        "GBP": 1.26,
-        "CAD": 0.74,
-        "HKD": 0.128,
-        "AUD": 0.65,
-        "CHF": 1.13,
-        "PLN": 0.25,
-        "MXN": 0.058,
-        "SAR": 0.27
-    }
+    catalog.try_record_observations(kind, market_caps)
+    # Only complete results are persisted: a failed lookup must not outlive this process
+    if len(market_caps) == len({orig for orig, _ in unique_pairs}):
+        result_cache.put("market_caps", cache_key, market_caps)
+    else:
+        instrumentation.increment("get_market_caps.partial_not_persisted")
+    return market_caps
 
+def _fetch_market_caps(ticker_pairs):
+    """
+    Per-ticker fallback: fast_info, then .info, then MCAP_FALLBACKS; converted to USD.
+    """
     def get_stable_mcap(ticker_obj, info):
         """Cross-checks marketCap with Price * Shares to avoid Yahoo noise."""
         try:
@@ -213,6 +463,10 @@ def get_market_caps(tickers):
             
             if price and shares:
                 calculated_cap = price * shares
+                if share_ratio(shares, price, mcap_raw) > 1:
+                    # The share count covers more than this listing: the reported cap is right
+                    instrumentation.increment("get_market_caps.share_ratio")
+                    return mcap_raw
                 if mcap_raw:
                     # If discrepancy > 10% (Scale error), trust the calculated value
                     if abs(mcap_raw - calculated_cap) / calculated_cap > 0.1:
@@ -222,84 +476,165 @@ def get_market_caps(tickers):
         except:
             return info.get('marketCap')
 
-    def fetch_cap(original, normalized):
+    def fetch_cap(original, normalized, submitted_at):
+        with instrumentation.queued("get_market_caps.fetch", submitted_at):
+            start = time.perf_counter()
+            try:
+                cap, currency = _fetch_cap(normalized)
+                return original, cap, currency
+            except Exception as e:
+                instrumentation.record_error("get_market_caps", normalized, e)
+                return original, None, None
+            finally:
+                instrumentation.observe_latency("get_market_caps.ticker_latency", normalized, time.perf_counter() - start)
+
+    def _fetch_cap(normalized):
         cap = None
         currency = "USD"
+        ticker_obj = yf.Ticker(normalized)
+        
+        # 1. Try Fast Info first (Much faster and less likely to be blocked in Cloud)
         try:
-            ticker_obj = yf.Ticker(normalized)
-            
-            # 1. Try Fast Info first (Much faster and less likely to be blocked in Cloud)
-            try:
+            with instrumentation.timer("get_market_caps.fast_info"):
                 f_info = ticker_obj.fast_info
                 cap = f_info.get('market_cap') or f_info.get('total_assets')
                 currency = f_info.get('currency', 'USD')
-            except:
-                pass
+        except Exception as e:
+            instrumentation.record_error("get_market_caps.fast_info", normalized, e)
+        if cap is not None:
+            instrumentation.increment("get_market_caps.path.fast_info")
 
-            # 2. If Fast Info failed or returned nothing, try full .info as fallback
-            if cap is None:
-                try:
+        # 2. If Fast Info failed or returned nothing, try full .info as fallback
+        if cap is None:
+            instrumentation.increment("get_market_caps.path.info")
+            try:
+                with instrumentation.timer("get_market_caps.info"):
                     info = ticker_obj.info
-                    quote_type = info.get('quoteType', '').upper()
-                    if quote_type == 'ETF':
-                        cap = info.get('totalAssets') or info.get('marketCap')
-                    else:
-                        cap = get_stable_mcap(ticker_obj, info)
-                    currency = info.get('currency', 'USD')
-                except:
-                    pass
-            
-            # Simple TSM double counting check
-            if normalized == "TSM" and cap and cap > 1.5e12:
-                cap = cap / 2.0
+                quote_type = info.get('quoteType', '').upper()
+                if quote_type == 'ETF':
+                    cap = info.get('totalAssets') or info.get('marketCap')
+                else:
+                    cap = get_stable_mcap(ticker_obj, info)
+                currency = info.get('currency', 'USD')
+            except Exception as e:
+                instrumentation.record_error("get_market_caps.info", normalized, e)
 
-            # 3. Try Explicit Fallback (e.g. Swiss ticker for ABB)
-            if cap is None and normalized in MCAP_FALLBACKS:
-                fb_ticker = MCAP_FALLBACKS[normalized]
-                try:
-                    fb_obj = yf.Ticker(fb_ticker)
-                    cap = fb_obj.fast_info.get('market_cap')
-                    currency = fb_obj.fast_info.get('currency', 'USD')
-                except:
-                    pass
-            
-            # 4. Currency Conversion
-            if cap and currency != "USD":
-                rate = EXCHANGE_RATES.get(currency, 1.0)
-                cap = cap * rate
+        # 3. Try Explicit Fallback (e.g. Swiss ticker for ABB)
+        if cap is None and normalized in MCAP_FALLBACKS:
+            instrumentation.increment("get_market_caps.path.mcap_fallback")
+            fb_ticker = MCAP_FALLBACKS[normalized]
+            try:
+                fb_obj = yf.Ticker(fb_ticker)
+                cap = fb_obj.fast_info.get('market_cap')
+                currency = fb_obj.fast_info.get('currency', 'USD')
+            except Exception as e:
+                instrumentation.record_error("get_market_caps.mcap_fallback", fb_ticker, e)
+        
+        if cap is None:
+            instrumentation.increment("get_market_caps.path.missing")
 
-            return original, cap
-        except Exception:
-            return original, None
+        return cap, currency or "USD"
 
     with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
-        future_to_ticker = {executor.submit(fetch_cap, orig, norm): orig for orig, norm in unique_pairs}
+        future_to_ticker = {executor.submit(fetch_cap, orig, norm, time.perf_counter()): orig for orig, norm in ticker_pairs}
         
-        for future in concurrent.futures.as_completed(future_to_ticker):
-            t, cap = future.result()
-            if cap and cap > 0:
-                market_caps[t] = cap
-            
+        results = [future.result() for future in concurrent.futures.as_completed(future_to_ticker)]
+
+    # Currency Conversion: all needed pairs in one batch (TTL-cached in fx_service)
+    market_caps = {}
+    fx_rates = fx_service.get_fx_rates({currency for _, cap, currency in results if cap})
+    for t, cap, currency in results:
+        if cap and currency != "USD":
+            instrumentation.increment(f"get_market_caps.currency.{currency}")
+            cap = fx_service.convert_to_usd(cap, currency, fx_rates)
+        if cap and cap > 0:
+            market_caps[t] = cap
     return market_caps
     
+def _load_data_json(filename):
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    path = os.path.join(base_dir, '..', 'data', filename)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def load_etf_metadata():
+    """
+    Loads ETF metadata (name, fallback_aum, description) keyed by ETF ticker.
+    """
+    try:
+        return _load_data_json('etf_metadata.json')
+    except:
+        return {}
+
+def load_compositions():
+    """
+    Loads ETF holdings snapshot: {etf: {ticker: weight_percentage}}.
+    """
+    try:
+        return _load_data_json('etf_compositions.json')
+    except:
+        return {}
+
+# A failed AUM lookup uses the last recorded value if it is at most this old
+AUM_CATALOG_MAX_AGE_SECONDS = 3600 * 24 * 30
+
+@memory_monitor.cached("get_dynamic_etf_aums")
+@st.cache_data(ttl=3600)
+def get_dynamic_etf_aums(etf_tickers):
+    caps = get_market_caps(etf_tickers, kind='aum')
+    # Convert to Billions for internal scaling consistency
+    return {t: (v / 1e9) for t, v in caps.items()}
+
+def get_etf_aums(etf_metadata):
+    """
+    Live ETF AUMs in Billions. A failed lookup falls back to the last AUM recorded
+    in the catalog, then to the metadata `fallback_aum`.
+    Shared by the app and the batch/CLI tools so they size portfolios identically.
+    
+    Returns:
+        dict: {etf: aum_in_billions}
+        list: ETFs that used the metadata fallback value
+    """
+    aums_raw = get_dynamic_etf_aums(list(etf_metadata.keys()))
+    missing = [k for k in etf_metadata if aums_raw.get(k, 0.0) <= 0]
+    if missing:
+        try:
+            recorded = catalog.latest_observations('aum', missing, max_age_seconds=AUM_CATALOG_MAX_AGE_SECONDS)
+        except Exception as e:
+            instrumentation.record_error("get_etf_aums.catalog", "aum", e)
+            recorded = {}
+        instrumentation.increment("get_etf_aums.catalog", len(recorded))
+        aums_raw.update({k: v / 1e9 for k, (v, _) in recorded.items()})
+    etf_aums = {}
+    used_fallbacks = []
+    for k, meta in etf_metadata.items():
+        val = aums_raw.get(k, 0.0)
+        if val <= 0:
+            val = meta.get('fallback_aum', 0.0)
+            used_fallbacks.append(k)
+        etf_aums[k] = val
+    return etf_aums, used_fallbacks
+
+@functools.lru_cache(maxsize=1)
 def load_stock_pool():
     """
-    Loads the master stock pool from the JSON file.
+    Loads the master stock pool from the JSON file (read once per process).
     """
     file_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'stock_pool.json')
     with open(file_path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
+@functools.lru_cache(maxsize=1)
 def get_sector_map():
     """
-    Returns a dictionary mapping tickers to their primary sector/theme.
+    Returns a dictionary mapping tickers to their primary theme: the theme of the
+    ETF that holds the stock with the largest weight (theme_index), else the
+    pool's own sector.
+    Computed once per process.
     """
-    pool = load_stock_pool()
+    index = theme_index.get_index(load_compositions())
     sector_map = {}
-    for stock in pool:
-        # Simple heuristic: use the first source as the "primary" sector for now
-        # logic can be improved later
-        sources = stock.get('sources', 'Unknown')
-        primary_sector = sources.split(',')[0].strip()
-        sector_map[stock['ticker']] = primary_sector
+    for stock in load_stock_pool():
+        ticker = stock['ticker']
+        sector_map[ticker] = index.primary_theme.get(ticker) or stock.get('sector') or "Unknown"
     return sector_map
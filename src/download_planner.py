@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+import concurrent.futures
+import pandas as pd
+import data_loader
+import instrumentation
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'cache', 'downloads')
+
+TICKERS_PER_CHUNK = 50
+YEARS_PER_CHUNK = 2
+MAX_WORKERS = 4
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 2.0
+# An unfinished plan is resumed with its original as-of date for this long (so a resume
+# survives midnight); plan directories untouched for longer are pruned
+RESUME_MAX_AGE_SECONDS = 3600 * 24 * 3
+
+_PERIOD_UNITS = {"d": "days", "wk": "weeks", "mo": "months", "y": "years"}
+
+
+def period_start(period, end):
+    """
+    First date covered by a yfinance period string ('5y', '6mo', '5d', '2wk').
+    Returns None for periods without a fixed length ('max', 'ytd').
+    """
+    for suffix in ("mo", "wk", "d", "y"):
+        if period.endswith(suffix) and period[:-len(suffix)].isdigit():
+            return end - pd.DateOffset(**{_PERIOD_UNITS[suffix]: int(period[:-len(suffix)])})
+    if period == "ytd":
+        return pd.Timestamp(year=end.year, month=1, day=1)
+    return None
+
+
+def plan_chunks(tickers, period="5y", interval="1d", end=None,
+                tickers_per_chunk=TICKERS_PER_CHUNK, years_per_chunk=YEARS_PER_CHUNK):
+    """
+    Splits a download into (ticker chunk x date range) pieces.
+
+    The plan id depends only on the request (tickers, period, interval, chunk sizes),
+    not on the date, so running the same request again, e.g. after an interruption,
+    picks up the same manifest; `as_of` records the date the ranges were cut at.
+
+    Returns:
+        dict: {"plan_id", "interval", "as_of", "chunks": [{"id", "tickers", "start", "end", "period", "latest"}]}
+    """
+    tickers = sorted(dict.fromkeys(t for t in tickers if isinstance(t, str)))
+    as_of = pd.Timestamp(end or pd.Timestamp.today()).normalize()
+    end = as_of + pd.Timedelta(days=1)
+    start = period_start(period, end)
+
+    if start is None or interval not in ("1d", "5d", "1wk", "1mo", "3mo"):
+        # Open-ended or intraday ranges go as one date piece per ticker chunk
+        ranges = [(None, None)]
+    else:
+        ranges = []
+        cursor = start
+        while cursor < end:
+            nxt = min(cursor + pd.DateOffset(years=years_per_chunk), end)
+            ranges.append((cursor.strftime("%Y-%m-%d"), nxt.strftime("%Y-%m-%d")))
+            cursor = nxt
+
+    key = json.dumps([tickers, period, interval, tickers_per_chunk, years_per_chunk])
+    plan_id = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+    chunks = []
+    for i in range(0, len(tickers), tickers_per_chunk):
+        group = tickers[i:i + tickers_per_chunk]
+        for start_s, end_s in ranges:
+            chunk_id = f"t{i // tickers_per_chunk:04d}_{start_s or period}"
+            chunks.append({
+                "id": chunk_id, "tickers": group, "start": start_s, "end": end_s, "period": period,
+                "latest": end_s == ranges[-1][1],
+            })
+    return {"plan_id": plan_id, "interval": interval, "as_of": as_of.strftime("%Y-%m-%d"), "chunks": chunks}
+
+
+class DownloadManifest:
+    """
+    On-disk status of every chunk of a plan (data/cache/downloads/<plan_id>/manifest.json).
+    Each finished chunk is stored next to it, so completed work survives a crash.
+    A manifest saved for another as-of date describes other ranges and is not reused.
+
+    States: pending, done, failed, and partial (stored, but some tickers of the latest
+    range came back without data; only those are fetched again).
+    """
+
+    def __init__(self, plan, cache_dir=None):
+        self.plan = plan
+        self.dir = os.path.join(cache_dir or CACHE_DIR, plan["plan_id"])
+        self.path = os.path.join(self.dir, "manifest.json")
+        self._lock = threading.Lock()
+        self.status = {c["id"]: {"state": "pending", "attempts": 0, "error": None, "missing": []} for c in plan["chunks"]}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            saved = saved.get("chunks", {}) if saved.get("as_of") == plan.get("as_of") else {}
+            for chunk_id, entry in saved.items():
+                if chunk_id in self.status and (entry["state"] not in ("done", "partial") or os.path.exists(self.chunk_path(chunk_id))):
+                    self.status[chunk_id] = {"missing": [], **entry}
+
+    def chunk_path(self, chunk_id):
+        return os.path.join(self.dir, f"{chunk_id}.pkl")
+
+    def pending(self):
+        return [c for c in self.plan["chunks"] if self.status[c["id"]]["state"] != "done"]
+
+    def update(self, chunk_id, **fields):
+        with self._lock:
+            self.status[chunk_id].update(fields)
+            self._save()
+
+    def _save(self):
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({"plan_id": self.plan["plan_id"], "as_of": self.plan.get("as_of"), "updated_at": time.time(), "chunks": self.status}, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def summary(self):
+        states = pd.Series({k: v["state"] for k, v in self.status.items()}, dtype=object)
+        return {
+            "plan_id": self.plan["plan_id"],
+            "chunks": len(states),
+            "done": int((states == "done").sum()),
+            "failed": sorted(states.index[states == "failed"]),
+            "missing": sorted({t for v in self.status.values() for t in v.get("missing", [])}),
+        }
+
+
+def _read_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def resumable_as_of(plan_id, cache_dir=None, max_age_seconds=RESUME_MAX_AGE_SECONDS):
+    """
+    As-of date of an unfinished, recently updated manifest for plan_id, or None.
+    """
+    saved = _read_manifest(os.path.join(cache_dir or CACHE_DIR, plan_id, "manifest.json"))
+    if not saved or time.time() - saved.get("updated_at", 0) > max_age_seconds:
+        return None
+    unfinished = any(entry["state"] != "done" for entry in saved.get("chunks", {}).values())
+    return saved.get("as_of") if unfinished else None
+
+
+def prune(cache_dir=None, max_age_seconds=RESUME_MAX_AGE_SECONDS, keep=()):
+    """
+    Removes plan directories whose manifest was last updated more than max_age_seconds
+    ago (or that have no readable manifest and are as old), except the plan ids in `keep`.
+
+    Returns:
+        int: directories removed
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        return 0
+    now = time.time()
+    removed = 0
+    for plan_id in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, plan_id)
+        if plan_id in keep or not os.path.isdir(path):
+            continue
+        saved = _read_manifest(os.path.join(path, "manifest.json"))
+        updated_at = saved.get("updated_at", 0) if saved else os.path.getmtime(path)
+        if now - updated_at > max_age_seconds:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    instrumentation.increment("download_planner.pruned", removed)
+    return removed
+
+
+def _fetch_chunk(chunk, interval, tickers=None):
+    tickers = tickers or chunk["tickers"]
+    prices = data_loader._download_close_prices(
+        tickers, chunk["period"], interval, start=chunk["start"], end=chunk["end"], raise_errors=True
+    )
+    # Older ranges can legitimately be empty (tickers listed later); the latest cannot
+    if prices.empty and chunk["latest"]:
+        raise ValueError(f"no data for {len(tickers)} tickers {chunk['start'] or chunk['period']}..{chunk['end'] or ''}")
+    return prices.dropna(how="all").dropna(axis=1, how="all")
+
+
+def _missing_tickers(chunk, prices):
+    """
+    Requested tickers without a single close in the latest range. yf.download reports
+    per-ticker failures as all-NaN (or absent) columns instead of raising.
+    """
+    if not chunk["latest"]:
+        return []
+    present = set(prices.columns[prices.notna().any()].map(str)) if not prices.empty else set()
+    return [t for t in chunk["tickers"] if t not in present]
+
+
+def run_plan(plan, max_workers=MAX_WORKERS, max_attempts=MAX_ATTEMPTS, cache_dir=None):
+    """
+    Downloads every pending chunk of a plan in parallel. Chunks that fail are
+    retried (with backoff) in later rounds, up to max_attempts per run; so are the
+    tickers a chunk returned without data. Tickers still missing after the last round
+    are recorded in the chunk's "missing" list and the chunk is marked done.
+
+    Returns:
+        DownloadManifest: final chunk status
+    """
+    manifest = DownloadManifest(plan, cache_dir)
+    os.makedirs(manifest.dir, exist_ok=True)
+    # Chunk files of an earlier as-of date are not part of this plan
+    current = {f"{c['id']}.pkl" for c in plan["chunks"]}
+    for name in os.listdir(manifest.dir):
+        if name.endswith(".pkl") and name not in current:
+            os.remove(os.path.join(manifest.dir, name))
+
+    def work(chunk, submitted_at):
+        with instrumentation.queued("download_planner.chunk", submitted_at):
+            entry = manifest.status[chunk["id"]]
+            attempts = entry["attempts"] + 1
+            path = manifest.chunk_path(chunk["id"])
+            partial = entry["state"] == "partial"
+            try:
+                with instrumentation.timer("download_planner.chunk"):
+                    if partial:
+                        instrumentation.increment("download_planner.tickers.retried", len(entry["missing"]))
+                        prices = pd.read_pickle(path).combine_first(_fetch_chunk(chunk, plan["interval"], entry["missing"]))
+                    else:
+                        prices = _fetch_chunk(chunk, plan["interval"])
+                missing = _missing_tickers(chunk, prices)
+                prices.to_pickle(path)
+                if missing:
+                    instrumentation.increment("download_planner.chunks.partial")
+                    manifest.update(chunk["id"], state="partial", attempts=attempts,
+                                    error=f"no data for {len(missing)} tickers", missing=missing)
+                else:
+                    manifest.update(chunk["id"], state="done", attempts=attempts, error=None, missing=[])
+                    instrumentation.increment("download_planner.chunks.done")
+            except Exception as e:
+                instrumentation.record_error("download_planner.chunk", chunk["id"], e)
+                instrumentation.increment("download_planner.chunks.failed")
+                # A failed retry keeps the partial chunk's stored prices
+                manifest.update(chunk["id"], state="partial" if partial else "failed", attempts=attempts, error=str(e))
+
+    # Attempts are counted per run, so re-running retries chunks that failed last time
+    for round_no in range(max_attempts):
+        todo = manifest.pending()
+        if not todo:
+            break
+        if round_no:
+            instrumentation.increment("download_planner.chunks.retried", len(todo))
+            time.sleep(RETRY_BACKOFF_SECONDS * 2 ** (round_no - 1))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda c: work(c, time.perf_counter()), todo))
+
+    # Tickers that never returned data (delisted, renamed) do not hold the plan open
+    for chunk in plan["chunks"]:
+        entry = manifest.status[chunk["id"]]
+        if entry["state"] == "partial":
+            instrumentation.increment("download_planner.tickers.missing", len(entry["missing"]))
+            manifest.update(chunk["id"], state="done")
+    return manifest
+
+
+def merge_chunks(manifest):
+    """
+    Combines the stored chunks into one (Date x Ticker) close-price frame.
+    Overlapping cells (same date and ticker in two chunks) keep the later chunk.
+    """
+    frames = []
+    for chunk in manifest.plan["chunks"]:
+        path = manifest.chunk_path(chunk["id"])
+        if manifest.status[chunk["id"]]["state"] == "done" and os.path.exists(path):
+            frames.append(pd.read_pickle(path))
+    if not frames:
+        return pd.DataFrame()
+    long = pd.concat([f.stack() for f in frames])
+    long = long[~long.index.duplicated(keep="last")]
+    prices = long.unstack().sort_index()
+    prices.columns.name = None
+    return prices
+
+
+@instrumentation.timed("download_planner.download_history")
+def download_history(tickers, period="5y", interval="1d", max_workers=MAX_WORKERS,
+                     tickers_per_chunk=TICKERS_PER_CHUNK, cache_dir=None):
+    """
+    Chunked, parallel, resumable replacement for one big yf.download call.
+    Tickers in chunks that still failed after all retries, and tickers that returned
+    no data, are absent from the result (the latter are listed under "missing").
+
+    An unfinished download of the same request is resumed with its original dates
+    (also after midnight); a finished one is merged and its directory removed.
+    Stale plan directories are pruned on every call.
+
+    Returns:
+        pd.DataFrame: close prices (index=Date, columns=Tickers)
+        dict: manifest summary (plan_id, chunks, done, failed, missing)
+    """
+    if isinstance(tickers, str):
+        tickers = tickers.split()
+    plan = plan_chunks(tickers, period, interval, tickers_per_chunk=tickers_per_chunk)
+    as_of = resumable_as_of(plan["plan_id"], cache_dir)
+    if as_of and as_of != plan["as_of"]:
+        instrumentation.increment("download_planner.resumed_earlier_plan")
+        plan = plan_chunks(tickers, period, interval, end=as_of, tickers_per_chunk=tickers_per_chunk)
+    prune(cache_dir, keep={plan["plan_id"]})
+
+    manifest = run_plan(plan, max_workers=max_workers, cache_dir=cache_dir)
+    prices, summary = merge_chunks(manifest), manifest.summary()
+    if not summary["failed"]:
+        shutil.rmtree(manifest.dir, ignore_errors=True)
+    return prices, summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chunked, resumable historical price download.")
+    parser.add_argument("tickers", nargs="*", help="Tickers (default: the whole stock pool)")
+    parser.add_argument("--period", default="10y")
+    parser.add_argument("--interval", default="1d")
+    parser.add_argument("--chunk-size", type=int, default=TICKERS_PER_CHUNK, help="Tickers per chunk")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("-o", "--output", help="Optional CSV output of the merged prices")
+    args = parser.parse_args(argv)
+
+    tickers = args.tickers or [data_loader.normalize_ticker(s["ticker"]) for s in data_loader.load_stock_pool()]
+    prices, summary = download_history(
+        tickers, args.period, args.interval, max_workers=args.workers, tickers_per_chunk=args.chunk_size
+    )
+    print(f"Plan {summary['plan_id']}: {summary['done']}/{summary['chunks']} chunks, "
+          f"{prices.shape[1]} tickers x {prices.shape[0]} dates")
+    if summary["failed"]:
+        print(f"Failed chunks (re-run to retry): {', '.join(summary['failed'])}")
+    if summary["missing"]:
+        print(f"Tickers without data: {', '.join(summary['missing'])}")
+    if args.output:
+        prices.to_csv(args.output)
+        print(f"Wrote {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import streamlit as st
+import instrumentation
+import memory_monitor
+
+# Upper bound on (ETF, ETF, stock) pairs materialized at once by _weight_overlap
+PAIR_BUDGET = 2_000_000
+
+
+def holdings_matrix(compositions):
+    """
+    Sparse (ETF x stock) matrix of holding weights (fractions, not %).
+
+    Returns:
+        scipy.sparse.csr_matrix: weights
+        list: ETF tickers (row labels)
+        list: stock tickers (column labels)
+    """
+    etfs = list(compositions.keys())
+    stock_ids = {}
+    rows, cols, vals = [], [], []
+    for i, etf in enumerate(etfs):
+        for t, w in compositions[etf].items():
+            j = stock_ids.setdefault(t, len(stock_ids))
+            rows.append(i)
+            cols.append(j)
+            vals.append(float(w) / 100.0)
+    matrix = sp.csr_matrix((vals, (rows, cols)), shape=(len(etfs), len(stock_ids)))
+    matrix.sum_duplicates()
+    return matrix, etfs, list(stock_ids.keys())
+
+
+def _weight_overlap(W, pair_budget=PAIR_BUDGET):
+    """
+    sum_i min(w_a,i, w_b,i) for every ETF pair: the share of each fund that is
+    the same money. Pairs are only generated for stocks two ETFs actually share.
+
+    A stock held by d ETFs yields d^2 pairs, so the stock columns are processed in
+    blocks of at most `pair_budget` pairs (a single wider column is its own block),
+    each summed into a sparse ETF x ETF result. Peak memory is a few arrays of
+    pair_budget elements plus the result, however many holdings there are.
+    """
+    n = W.shape[0]
+    csc = W.tocsc()
+    csc.sum_duplicates()
+    deg = np.diff(csc.indptr)
+    cum = np.concatenate([[0], np.cumsum(deg.astype(np.int64) ** 2)])
+    result = sp.csr_matrix((n, n))
+    start = 0
+    while start < len(deg):
+        end = max(int(np.searchsorted(cum, cum[start] + pair_budget, side="right")) - 1, start + 1)
+        lo, hi = csc.indptr[start], csc.indptr[end]
+        # Every nonzero of the block pairs with every nonzero of its own column
+        entry_deg = np.repeat(deg[start:end], deg[start:end])
+        col_first = np.repeat(csc.indptr[start:end], deg[start:end])
+        a = np.repeat(np.arange(lo, hi), entry_deg)
+        offset = np.arange(len(a)) - np.repeat(np.cumsum(entry_deg) - entry_deg, entry_deg)
+        b = np.repeat(col_first, entry_deg) + offset
+        block = sp.coo_matrix(
+            (np.minimum(csc.data[a], csc.data[b]), (csc.indices[a], csc.indices[b])), shape=(n, n)
+        )
+        result = result + block.tocsr()
+        instrumentation.increment("etf_overlap.weight_blocks")
+        start = end
+    return result
+
+
+@memory_monitor.cached("compute_overlap")
+@st.cache_data
+def compute_overlap(compositions):
+    """
+    Pairwise ETF overlap computed from sparse products of the holdings matrix.
+    Cached on the compositions, so it is recomputed only when they change.
+
+    Returns:
+        dict of (ETF x ETF) DataFrames:
+            "count":   number of shared holdings            (B @ B.T)
+            "jaccard": shared / union of holdings
+            "weight":  sum of min(weight) over shared names, in %
+            "cosine":  cosine similarity of the weight vectors  (W @ W.T normalized)
+    """
+    with instrumentation.timer("etf_overlap.compute_overlap"):
+        W, etfs, _ = holdings_matrix(compositions)
+        B = (W > 0).astype(np.int32)
+
+        count = (B @ B.T).toarray()
+        n_holdings = np.diag(count).astype(float)
+        union = n_holdings[:, None] + n_holdings[None, :] - count
+        with np.errstate(divide="ignore", invalid="ignore"):
+            jaccard = np.where(union > 0, count / union, 0.0)
+
+        gram = (W @ W.T).toarray()
+        norms = np.sqrt(np.diag(gram))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cosine = np.where(np.outer(norms, norms) > 0, gram / np.outer(norms, norms), 0.0)
+
+        weight = _weight_overlap(W).toarray() * 100.0
+
+        def frame(values):
+            return pd.DataFrame(values, index=etfs, columns=etfs)
+
+        return {
+            "count": frame(count),
+            "jaccard": frame(jaccard),
+            "weight": frame(weight),
+            "cosine": frame(cosine),
+        }
+
+
+def most_overlapping(overlap, metric="weight", top=10):
+    """
+    The `top` most overlapping distinct ETF pairs for a metric.
+    """
+    m = overlap[metric]
+    upper = np.triu(np.ones(m.shape, dtype=bool), k=1)
+    pairs = m.where(upper).stack()
+    pairs.index.names = ["ETF A", "ETF B"]
+    return pairs.sort_values(ascending=False).head(top).rename(metric)
@@ -1,59 +1,200 @@
-import yfinance as yf
-import json
 import os
+import sys
+import json
+import time
+import argparse
+import pandas as pd
+import data_loader
+import utils
+import api_client
+import instrumentation
+import theme_index
+
+# Tickers printed in detail when none are given on the command line
+DEFAULT_TICKERS = ["TSM", "AMD", "CSCO", "CRWD", "INFY", "NVDA", "AAPL"]
+# A composition whose weights add up to more than 100% + this is flagged
+WEIGHT_SUM_TOLERANCE = 0.5
+
+
+def fetch_aums(etf_metadata):
+    """
+    Live AUMs (Billions) for every ETF through the same cached, concurrent path the
+    app uses (the API server when ETF_API_URL is set), with the metadata fallbacks.
+
+    Returns:
+        dict: {etf: aum_in_billions}
+        list: ETFs that used the fallback value
+    """
+    market = api_client if api_client.enabled() else data_loader
+    with instrumentation.timer("full_diagnostic.fetch_aums"):
+        return market.get_etf_aums(etf_metadata)
+
+
+def contribution_frame(compositions, etf_aums, stock_breakdown):
+    """
+    Inverted holdings index: one row per (etf, ticker) with the ETF's AUM, the
+    AUM-weighted contribution (raw score in $B) and whether the Top-N rule selected
+    the holding into the consolidated portfolio.
+    """
+    df = theme_index.membership_frame(compositions)
+    df["aum"] = df["etf"].map(etf_aums).fillna(0.0)
+    df["contribution"] = df["aum"] * df["weight"] / 100.0
+    selected = theme_index.breakdown_frame(stock_breakdown)
+    pairs = pd.MultiIndex.from_frame(df[["ticker", "etf"]])
+    df["selected"] = pairs.isin(pd.MultiIndex.from_frame(selected[["ticker", "etf"]])) if len(selected) else False
+    return df
+
+
+def build_report(compositions, etf_metadata, etf_aums, used_fallbacks=()):
+    """
+    Audit of the whole universe: per-ETF inputs, per-stock contributions and
+    consistency checks, as a JSON-serializable dict.
+
+    Per stock, the "consensus" numbers use every listed holding (AUM x weight, as
+    the original diagnostic did), the "final" weight is the app's Top-N consolidation.
+    """
+    final_weights, stock_breakdown = utils.get_consolidated_weights(etf_aums, compositions)
+    df = contribution_frame(compositions, etf_aums, stock_breakdown)
+    total = df["contribution"].sum()
+
+    by_stock = df.groupby("ticker", sort=False).agg(
+        consensus_score=("contribution", "sum"),
+        n_etfs=("etf", "size"),
+        n_selected=("selected", "sum"),
+    )
+    by_stock["consensus_weight"] = by_stock["consensus_score"] / total * 100.0 if total > 0 else 0.0
+    by_stock["final_weight"] = by_stock.index.map(final_weights).fillna(0.0)
+    by_stock["themes"] = df.groupby("ticker", sort=False)["theme"].agg(lambda s: list(dict.fromkeys(s)))
+    by_stock = by_stock.sort_values("consensus_score", ascending=False)
+
+    sources = {}
+    for row in df.itertuples(index=False):
+        sources.setdefault(row.ticker, {})[row.etf] = {
+            "weight_in_etf": row.weight,
+            "aum_b": row.aum,
+            "contribution_b": row.contribution,
+            "selected": bool(row.selected),
+        }
+
+    stocks = {}
+    for ticker, row in by_stock.iterrows():
+        stocks[ticker] = {
+            "consensus_score_b": float(row["consensus_score"]),
+            "consensus_weight": float(row["consensus_weight"]),
+            "final_weight": float(row["final_weight"]),
+            "n_etfs": int(row["n_etfs"]),
+            "n_selected": int(row["n_selected"]),
+            "themes": row["themes"],
+            "sources": sources[ticker],
+        }
+
+    by_etf = df.groupby("etf", sort=False).agg(
+        holdings=("ticker", "size"),
+        weight_sum=("weight", "sum"),
+        selected=("selected", "sum"),
+    )
+    portfolio_share = theme_index.exposures(final_weights, stock_breakdown, by="etf")
+    fallbacks = set(used_fallbacks)
+    etfs = {}
+    for etf in etf_metadata:
+        row = by_etf.loc[etf] if etf in by_etf.index else None
+        etfs[etf] = {
+            "aum_b": float(etf_aums.get(etf, 0.0)),
+            "aum_source": "fallback" if etf in fallbacks else "live",
+            "theme": theme_index.ETF_TO_THEME.get(etf, "Other"),
+            "holdings": int(row["holdings"]) if row is not None else 0,
+            "weight_sum": float(row["weight_sum"]) if row is not None else 0.0,
+            "selected": int(row["selected"]) if row is not None else 0,
+            "portfolio_share": float(portfolio_share.get(etf, 0.0)),
+        }
+
+    # Different composition spellings of one Yahoo symbol (e.g. 'BRK.B' / 'BRK-B')
+    tickers = pd.Series(by_stock.index, index=by_stock.index)
+    symbols = tickers.map(data_loader.normalize_ticker)
+    aliases = tickers.groupby(symbols.to_numpy()).agg(list)
+    checks = {
+        "fallback_aums": sorted(fallbacks),
+        "weight_sum_over_100": sorted(by_etf.index[by_etf["weight_sum"] > 100.0 + WEIGHT_SUM_TOLERANCE]),
+        "etfs_without_composition": sorted(set(etf_metadata) - set(compositions)),
+        "compositions_without_metadata": sorted(set(compositions) - set(etf_metadata)),
+        "alias_collisions": {s: t for s, t in aliases.items() if len(t) > 1},
+        "final_weight_total": float(sum(final_weights.values())),
+    }
+
+    return {
+        "generated_at": time.time(),
+        "source": "api" if api_client.enabled() else "yfinance",
+        "summary": {
+            "etfs": len(etfs),
+            "holdings": int(len(df)),
+            "stocks": len(stocks),
+            "selected_stocks": len(final_weights),
+            "total_consensus_b": float(total),
+        },
+        "etfs": etfs,
+        "stocks": stocks,
+        "checks": checks,
+    }
+
+
+def run_audit(output=None):
+    """
+    Fetches AUMs, builds the report and optionally writes it as JSON.
+    """
+    started = time.perf_counter()
+    etf_metadata = data_loader.load_etf_metadata()
+    compositions = data_loader.load_compositions()
+    etf_aums, used_fallbacks = fetch_aums(etf_metadata)
+    with instrumentation.timer("full_diagnostic.build_report"):
+        report = build_report(compositions, etf_metadata, etf_aums, used_fallbacks)
+    report["elapsed_seconds"] = time.perf_counter() - started
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def print_stock(report, ticker):
+    stock = report["stocks"].get(ticker)
+    print(f"\nStock: {ticker}")
+    if stock is None:
+        print("  not held by any ETF")
+        return
+    for etf, src in stock["sources"].items():
+        mark = "" if src["selected"] else "  (outside Top-N)"
+        print(f"  - {etf}: {src['weight_in_etf']}% in ${src['aum_b']:.2f}B -> {src['contribution_b']:.4f} score{mark}")
+    print(f"Total Raw Score: {stock['consensus_score_b']:.4f}")
+    print(f"Consensus Percentage: {stock['consensus_weight']:.4f}%   Final (Top-N) Percentage: {stock['final_weight']:.4f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Audit ETF AUMs, holdings contributions and consolidation for the whole universe.")
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file")
+    parser.add_argument("--json", action="store_true", help="Print the JSON report to stdout instead of the text summary")
+    parser.add_argument("--tickers", nargs="*", default=DEFAULT_TICKERS, help="Stocks to print in detail")
+    args = parser.parse_args(argv)
+
+    report = run_audit(args.output)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        return
+
+    s = report["summary"]
+    print(f"{s['etfs']} ETFs, {s['holdings']} holdings, {s['stocks']} stocks ({s['selected_stocks']} in the portfolio) in {report['elapsed_seconds']:.1f}s")
+    print("\n--- ETF AUMs ---")
+    for etf, info in report["etfs"].items():
+        note = " (fallback)" if info["aum_source"] == "fallback" else ""
+        print(f"{etf}: ${info['aum_b']:.2f}B{note}")
+    for ticker in args.tickers:
+        print_stock(report, ticker)
+    flagged = {k: v for k, v in report["checks"].items() if v and k != "final_weight_total"}
+    if flagged:
+        print("\n--- Checks ---")
+        for name, value in flagged.items():
+            print(f"{name}: {value}")
+    if args.output:
+        print(f"\nWrote {os.path.abspath(args.output)}")
 
-def load_json(path):
-    with open(path, 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-def debug_full_system():
-    base_dir = "C:/Users/indyc/Desktop/antigravity/project/Stock simulation/etf-analysis/myetf_project/data"
-    compositions = load_json(os.path.join(base_dir, 'etf_compositions.json'))
-    metadata = load_json(os.path.join(base_dir, 'etf_metadata.json'))
-    
-    tickers_to_check = ["TSM", "AMD", "CSCO", "CRWD", "INFY", "NVDA", "AAPL"]
-    etf_tickers = list(metadata.keys())
-    
-    print("--- 1. Fetching Live AUMs ---")
-    etf_aums = {}
-    for etf in etf_tickers:
-        try:
-            t = yf.Ticker(etf)
-            # Use totalAssets for ETFs
-            aum = t.info.get('totalAssets')
-            if aum is None:
-                aum = t.info.get('marketCap', 0)
-            etf_aums[etf] = aum / 1e9 # Billion
-            print(f"{etf}: ${etf_aums[etf]:.2f}B")
-        except:
-            print(f"{etf}: ERROR")
-            etf_aums[etf] = 0.0
-
-    print("\n--- 2. Analyzing Weight Components ---")
-    total_market_consensus = 0
-    stock_scores = {}
-    
-    for etf, holdings in compositions.items():
-        aum = etf_aums.get(etf, 0)
-        for ticker, weight_in_etf in holdings.items():
-            contribution = aum * (weight_in_etf / 100.0)
-            stock_scores[ticker] = stock_scores.get(ticker, 0) + contribution
-            total_market_consensus += contribution
-
-    for stock in tickers_to_check:
-        print(f"\nStock: {stock}")
-        score = stock_scores.get(stock, 0)
-        final_weight = (score / total_market_consensus * 100) if total_market_consensus > 0 else 0
-        
-        # Detail sources
-        for etf, holdings in compositions.items():
-            if stock in holdings:
-                w = holdings[stock]
-                aum = etf_aums.get(etf, 0)
-                print(f"  - {etf}: {w}% in ${aum:.2f}B -> {aum*(w/100):.4f} score")
-        
-        print(f"Total Raw Score: {score:.4f}")
-        print(f"Final Percentage: {final_weight:.4f}%")
 
 if __name__ == "__main__":
-    debug_full_system()
+    main()
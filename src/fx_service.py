@@ -0,0 +1,258 @@
+import os
+import time
+import threading
+import pandas as pd
+import yfinance as yf
+import instrumentation
+
+FX_TTL_SECONDS = 3600
+FALLBACK_RETRY_SECONDS = 300
+HISTORY_REFRESH_DAYS = 3
+
+# Last-resort rates (Target: USD) when the live FX fetch fails
+FALLBACK_EXCHANGE_RATES = {
+    "JPY": 1/150.0,
+    "TWD": 1/32.0,
+    "KRW": 1/1350.0,
+    "EUR": 1.08,
+    "GBP": 1.26,
+    "CAD": 0.74,
+    "HKD": 0.128,
+    "AUD": 0.65,
+    "CHF": 1.13,
+    "PLN": 0.25,
+    "MXN": 0.058,
+    "SAR": 0.27
+}
+
+# Rate for a currency with neither a live nor a static rate: the amount is kept
+# as if it were USD (logged as an error), rather than dropping the value entirely
+UNKNOWN_CURRENCY_RATE = 1.0
+
+# Yahoo quotes some markets in minor units (pence, agorot, cents)
+MINOR_UNITS = {
+    "GBp": ("GBP", 0.01),
+    "GBX": ("GBP", 0.01),
+    "ILA": ("ILS", 0.01),
+    "ZAc": ("ZAR", 0.01),
+}
+
+# Exchange suffix -> (listing country, quote currency); plain US tickers have no suffix
+EXCHANGE_SUFFIXES = {
+    "T": ("Japan", "JPY"),
+    "KS": ("South Korea", "KRW"),
+    "KQ": ("South Korea", "KRW"),
+    "AX": ("Australia", "AUD"),
+    "TW": ("Taiwan", "TWD"),
+    "TWO": ("Taiwan", "TWD"),
+    "HK": ("Hong Kong", "HKD"),
+    "L": ("United Kingdom", "GBp"),
+    "SW": ("Switzerland", "CHF"),
+    "TO": ("Canada", "CAD"),
+    "V": ("Canada", "CAD"),
+    "PA": ("France", "EUR"),
+    "DE": ("Germany", "EUR"),
+    "AS": ("Netherlands", "EUR"),
+    "MI": ("Italy", "EUR"),
+    "MC": ("Spain", "EUR"),
+    "BR": ("Belgium", "EUR"),
+    "HE": ("Finland", "EUR"),
+    "WA": ("Poland", "PLN"),
+    "MX": ("Mexico", "MXN"),
+    "SR": ("Saudi Arabia", "SAR"),
+}
+
+# Used when no currency metadata is at hand
+SUFFIX_CURRENCY = {suffix: currency for suffix, (_, currency) in EXCHANGE_SUFFIXES.items()}
+
+_HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'cache', 'fx_history.csv')
+
+_lock = threading.Lock()
+_rates = {}  # {currency: (rate_to_usd, fetched_at)}
+
+
+def currency_for_ticker(ticker):
+    """
+    Infers the quote currency from the exchange suffix ('9984.T' -> 'JPY'). Defaults to USD.
+    """
+    if not isinstance(ticker, str) or '.' not in ticker:
+        return "USD"
+    suffix = ticker.rsplit('.', 1)[1].upper()
+    return SUFFIX_CURRENCY.get(suffix, "USD")
+
+
+def _split_minor(currency):
+    # 'GBp' -> ('GBP', 0.01); 'JPY' -> ('JPY', 1.0)
+    if currency in MINOR_UNITS:
+        return MINOR_UNITS[currency]
+    return (currency or "USD").upper(), 1.0
+
+
+def _pair_symbol(currency):
+    return f"{currency}USD=X"
+
+
+def _download_pairs(currencies, period):
+    """
+    One yf.download call for all currency pairs. Returns DataFrame (date x currency) of USD per unit.
+    """
+    symbols = [_pair_symbol(c) for c in currencies]
+    with instrumentation.timer("fx_service.download"):
+        data = yf.download(" ".join(symbols), period=period, interval="1d", auto_adjust=False, progress=False)
+    if data is None or data.empty or "Close" not in data:
+        return pd.DataFrame()
+
+    closes = data["Close"]
+    if isinstance(closes, pd.Series):
+        closes = closes.to_frame(symbols[0])
+    closes = closes.rename(columns={_pair_symbol(c): c for c in currencies})
+    closes.index = pd.to_datetime(closes.index).tz_localize(None).normalize()
+    return closes[[c for c in currencies if c in closes.columns]]
+
+
+def _load_history():
+    try:
+        hist = pd.read_csv(_HISTORY_PATH, index_col=0, parse_dates=True)
+        return hist
+    except (OSError, ValueError):
+        return pd.DataFrame()
+
+
+def _store_history(new_rates):
+    """
+    Merges a (date x currency) frame into the on-disk daily FX history.
+    """
+    if new_rates.empty:
+        return
+    try:
+        hist = _load_history()
+        merged = new_rates.combine_first(hist) if not hist.empty else new_rates
+        os.makedirs(os.path.dirname(_HISTORY_PATH), exist_ok=True)
+        tmp_path = _HISTORY_PATH + ".tmp"
+        merged.sort_index().to_csv(tmp_path)
+        os.replace(tmp_path, _HISTORY_PATH)
+    except OSError as e:
+        instrumentation.record_error("fx_service.store_history", _HISTORY_PATH, e)
+
+
+def get_fx_rates(currencies):
+    """
+    Latest USD rate per unit of each currency, e.g. {'JPY': 0.0067, 'GBp': 0.0126}.
+    Expired or unknown currencies are fetched together in one batch and cached
+    for FX_TTL_SECONDS; failures fall back to FALLBACK_EXCHANGE_RATES, and
+    currencies without a static rate to UNKNOWN_CURRENCY_RATE.
+    """
+    wanted = {c for c in currencies if c}
+    majors = {_split_minor(c)[0] for c in wanted} - {"USD"}
+    now = time.time()
+
+    with _lock:
+        stale = sorted(c for c in majors if c not in _rates or now - _rates[c][1] > FX_TTL_SECONDS)
+    instrumentation.increment("fx_service.cache_hits", len(majors) - len(stale))
+
+    if stale:
+        instrumentation.increment("fx_service.cache_misses", len(stale))
+        try:
+            closes = _download_pairs(stale, period="5d")
+        except Exception as e:
+            instrumentation.record_error("fx_service.get_fx_rates", ",".join(stale), e)
+            closes = pd.DataFrame()
+
+        fetched = {}
+        for c in stale:
+            if c in closes.columns and closes[c].notna().any():
+                fetched[c] = (float(closes[c].dropna().iloc[-1]), now)
+            elif c in FALLBACK_EXCHANGE_RATES:
+                instrumentation.increment("fx_service.static_fallback")
+                # Static rates are only kept briefly so the next call retries the live fetch
+                fetched[c] = (FALLBACK_EXCHANGE_RATES[c], now - FX_TTL_SECONDS + FALLBACK_RETRY_SECONDS)
+            else:
+                instrumentation.record_error(
+                    "fx_service.unknown_currency", c,
+                    ValueError(f"no live or static USD rate for {c}, converting at {UNKNOWN_CURRENCY_RATE}")
+                )
+                fetched[c] = (UNKNOWN_CURRENCY_RATE, now - FX_TTL_SECONDS + FALLBACK_RETRY_SECONDS)
+        with _lock:
+            _rates.update(fetched)
+        if not closes.empty:
+            _store_history(closes.dropna(how="all").tail(1))
+
+    result = {}
+    with _lock:
+        for c in wanted:
+            major, scale = _split_minor(c)
+            if major == "USD":
+                result[c] = scale
+            elif major in _rates:
+                result[c] = _rates[major][0] * scale
+    return result
+
+
+def convert_to_usd(amount, currency, rates=None):
+    """
+    Converts a scalar amount. Returns None if no rate is known for the currency.
+    """
+    if amount is None:
+        return None
+    rates = rates if rates is not None else get_fx_rates([currency])
+    rate = rates.get(currency)
+    return amount * rate if rate is not None else None
+
+
+def get_fx_history(currencies, period="5y"):
+    """
+    Daily USD-per-unit history (date x currency) for the given currencies.
+    The stored history is reused; all pairs not covered yet are fetched in one batch.
+    """
+    majors = sorted({_split_minor(c)[0] for c in currencies if c} - {"USD"})
+    hist = _load_history()
+    missing = [c for c in majors if hist.empty or c not in hist.columns or hist[c].notna().sum() < 2]
+    # Covered pairs only need the recent tail when the stored history is behind
+    behind = [c for c in majors if c not in missing
+              and (pd.Timestamp.now().normalize() - hist[c].last_valid_index()).days > HISTORY_REFRESH_DAYS]
+    if missing or behind:
+        try:
+            fetched = _download_pairs(missing, period=period) if missing else pd.DataFrame()
+            if behind:
+                recent = _download_pairs(behind, period="1mo")
+                fetched = recent.combine_first(fetched) if not fetched.empty else recent
+            _store_history(fetched)
+            hist = fetched.combine_first(hist) if not hist.empty else fetched
+        except Exception as e:
+            instrumentation.record_error("fx_service.get_fx_history", ",".join(missing + behind), e)
+    return hist.reindex(columns=majors)
+
+
+def convert_prices_to_usd(price_data, currencies=None):
+    """
+    Converts a (date x ticker) price frame to USD in one vectorized multiply.
+
+    Args:
+        price_data (pd.DataFrame): prices in each ticker's quote currency
+        currencies (dict): optional {ticker: currency}; inferred from the suffix otherwise
+    """
+    if price_data.empty:
+        return price_data
+
+    currencies = currencies or {}
+    col_ccy = [currencies.get(t) or currency_for_ticker(t) for t in price_data.columns]
+    if all(_split_minor(c)[0] == "USD" and _split_minor(c)[1] == 1.0 for c in col_ccy):
+        return price_data
+
+    hist = get_fx_history(col_ccy)
+    index = pd.to_datetime(price_data.index)
+    index = index.tz_localize(None) if index.tz is not None else index
+    hist = hist.reindex(hist.index.union(index.normalize())).sort_index().ffill().bfill()
+    hist = hist.reindex(index.normalize())
+
+    # (date x ticker) FX factor: USD per quote unit, incl. minor-unit scaling
+    hist["USD"] = 1.0
+    majors = [_split_minor(c)[0] for c in col_ccy]
+    scales = pd.Series([_split_minor(c)[1] for c in col_ccy], index=price_data.columns)
+    for m in set(majors):
+        if m not in hist.columns or hist[m].isna().all():
+            # No history at all: fall back to the latest known/static rate
+            hist[m] = get_fx_rates([m]).get(m, float("nan"))
+    factors = hist[majors].to_numpy() * scales.to_numpy()
+
+    return price_data * factors
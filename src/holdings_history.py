@@ -0,0 +1,323 @@
+import os
+import json
+import bisect
+import argparse
+import datetime
+import subprocess
+import pandas as pd
+import instrumentation
+
+HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'holdings_history.json')
+
+# A full materialization is kept in memory every N snapshots, so an as-of lookup
+# never replays more than N-1 deltas.
+CHECKPOINT_EVERY = 16
+# What walk_forward_backtest does with rebalance dates before the first snapshot:
+# "raise" (ValueError) or "skip" (the backtest starts at the first snapshot)
+BEFORE_HISTORY_POLICIES = ("raise", "skip")
+COMPOSITIONS_PATH = os.path.join('data', 'etf_compositions.json')
+
+
+def _to_date(value):
+    return pd.Timestamp(value).strftime("%Y-%m-%d")
+
+
+def _diff(prev, curr):
+    """
+    Delta that turns composition `prev` into `curr`.
+    Only changed/added weights are stored; removals are listed separately.
+    """
+    delta = {"set": {}, "drop": {}, "drop_etfs": []}
+    for etf, holdings in curr.items():
+        old = prev.get(etf, {})
+        changed = {t: w for t, w in holdings.items() if old.get(t) != w}
+        if changed:
+            delta["set"][etf] = changed
+        removed = [t for t in old if t not in holdings]
+        if removed:
+            delta["drop"][etf] = removed
+    delta["drop_etfs"] = [etf for etf in prev if etf not in curr]
+    return delta
+
+
+def _apply(state, delta):
+    # Mutates `state` in place
+    for etf in delta.get("drop_etfs", []):
+        state.pop(etf, None)
+    for etf, removed in delta.get("drop", {}).items():
+        holdings = state.get(etf, {})
+        for t in removed:
+            holdings.pop(t, None)
+    for etf, changed in delta.get("set", {}).items():
+        state.setdefault(etf, {}).update(changed)
+    return state
+
+
+def _copy(state):
+    return {etf: dict(h) for etf, h in state.items()}
+
+
+class HoldingsHistory:
+    """
+    Time-versioned ETF compositions stored as deltas against the previous snapshot.
+
+    The first snapshot holds the full composition; every later one only records
+    the weights that changed, the tickers that left and the ETFs that were removed.
+    """
+
+    def __init__(self, snapshots=None):
+        # [{"date": "YYYY-MM-DD", "set": {...}, "drop": {...}, "drop_etfs": [...]}, ...] sorted by date
+        self.snapshots = snapshots or []
+        self._checkpoints = {}
+
+    @property
+    def dates(self):
+        return [s["date"] for s in self.snapshots]
+
+    @property
+    def first_date(self):
+        return self.snapshots[0]["date"] if self.snapshots else None
+
+    def tickers(self):
+        """
+        Every ticker held at some point in the history.
+        """
+        return sorted({t for s in self.snapshots for holdings in s.get("set", {}).values() for t in holdings})
+
+    @classmethod
+    def load(cls, path=HISTORY_PATH):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls(json.load(f).get("snapshots", []))
+        except (OSError, ValueError):
+            return cls()
+
+    def save(self, path=HISTORY_PATH):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"snapshots": self.snapshots}, f, indent=1)
+        os.replace(tmp_path, path)
+
+    def _materialize(self, idx):
+        """
+        Composition right after snapshot `idx`, starting from the closest checkpoint.
+        """
+        base = idx - idx % CHECKPOINT_EVERY
+        if base not in self._checkpoints:
+            start, state = (0, {})
+            known = [c for c in self._checkpoints if c < base]
+            if known:
+                start = max(known)
+                state = _copy(self._checkpoints[start])
+                start += 1
+            for i in range(start, base + 1):
+                _apply(state, self.snapshots[i])
+                if i % CHECKPOINT_EVERY == 0:
+                    self._checkpoints[i] = _copy(state)
+        state = _copy(self._checkpoints[base])
+        for i in range(base + 1, idx + 1):
+            _apply(state, self.snapshots[i])
+        return state
+
+    def add_snapshot(self, date, compositions):
+        """
+        Records the full composition observed on `date`. Snapshots may arrive out
+        of order; a late one is re-encoded against its neighbours.
+        Identical consecutive compositions are not stored again.
+        """
+        date = _to_date(date)
+        dates = self.dates
+        pos = bisect.bisect_right(dates, date)
+
+        if pos == len(dates):
+            prev = self._materialize(pos - 1) if pos else {}
+            delta = _diff(prev, compositions)
+            if pos and not (delta["set"] or delta["drop"] or delta["drop_etfs"]):
+                return False
+            if pos and dates[-1] == date:
+                # Same-day update replaces the last snapshot
+                before = self._materialize(pos - 2) if pos > 1 else {}
+                self.snapshots[-1] = dict(_diff(before, compositions), date=date)
+            else:
+                self.snapshots.append(dict(delta, date=date))
+        else:
+            full = [self._materialize(i) for i in range(len(dates))]
+            if pos and dates[pos - 1] == date:
+                full[pos - 1] = compositions
+            else:
+                full.insert(pos, compositions)
+                dates.insert(pos, date)
+            self.snapshots = []
+            prev = {}
+            for d, comp in zip(dates, full):
+                self.snapshots.append(dict(_diff(prev, comp), date=d))
+                prev = comp
+
+        self._checkpoints = {}
+        return True
+
+    def as_of(self, date):
+        """
+        Composition in effect on `date` (latest snapshot on or before it), or {} if none.
+        """
+        idx = bisect.bisect_right(self.dates, _to_date(date)) - 1
+        return self._materialize(idx) if idx >= 0 else {}
+
+    def as_of_many(self, dates):
+        """
+        Compositions for many dates in one forward pass over the deltas.
+
+        Returns:
+            dict: {date_string: composition}; dates sharing a snapshot share one dict
+        """
+        with instrumentation.timer("holdings_history.as_of_many"):
+            snap_dates = self.dates
+            result = {}
+            state, applied, cached = {}, -1, None
+            for d in sorted({_to_date(x) for x in dates}):
+                idx = bisect.bisect_right(snap_dates, d) - 1
+                if idx < 0:
+                    result[d] = {}
+                    continue
+                if idx != applied:
+                    for i in range(applied + 1, idx + 1):
+                        _apply(state, self.snapshots[i])
+                    applied, cached = idx, _copy(state)
+                result[d] = cached
+            return result
+
+
+def walk_forward_backtest(history, etf_aums, price_data, rebalance_dates=None, freq="QE", before_history="raise"):
+    """
+    Point-in-time backtest: at each rebalance date the consolidated weights are
+    recomputed from the holdings known on that date, then held until the next one.
+
+    There are no holdings before the first snapshot, so a backtest reaching further
+    back raises unless before_history="skip", which starts it at the first snapshot.
+
+    Args:
+        history (HoldingsHistory): time-versioned compositions
+        etf_aums (dict): {etf: aum_in_billions} (today's AUMs; no AUM history is stored yet)
+        price_data (pd.DataFrame | ReturnMatrix): close prices or a prebuilt ReturnMatrix
+        rebalance_dates (list): explicit dates; defaults to period ends at `freq`
+        before_history (str): one of BEFORE_HISTORY_POLICIES
+
+    Returns:
+        pd.Series: cumulative return
+        pd.Series: daily return
+        dict: {rebalance_date: final_weights} actually used
+    """
+    import utils
+    from return_matrix import ReturnMatrix, build_return_matrix
+
+    if before_history not in BEFORE_HISTORY_POLICIES:
+        raise ValueError(f"Unknown before_history policy '{before_history}', expected one of {BEFORE_HISTORY_POLICIES}")
+    if history.first_date is None:
+        raise ValueError("Holdings history is empty: record a snapshot first (python holdings_history.py)")
+
+    matrix = price_data if isinstance(price_data, ReturnMatrix) else build_return_matrix(price_data)
+    if not len(matrix.dates):
+        return pd.Series(dtype=float), pd.Series(dtype=float), {}
+
+    dates = matrix.dates.tz_localize(None) if getattr(matrix.dates, "tz", None) is not None else matrix.dates
+    if rebalance_dates is None:
+        rebalance_dates = pd.Series(dates, index=dates).resample(freq).first().dropna().tolist()
+    rebalance_dates = sorted(pd.Timestamp(d) for d in rebalance_dates)
+
+    first = pd.Timestamp(history.first_date)
+    early = [d for d in rebalance_dates if d < first]
+    if early:
+        if before_history == "raise":
+            raise ValueError(
+                f"Backtest starts {_to_date(early[0])}, before the first holdings snapshot ({history.first_date}); "
+                "record older snapshots or pass before_history='skip'"
+            )
+        instrumentation.increment("holdings_history.before_history", len(early))
+        # The first snapshot opens the period the skipped rebalance date would have covered
+        rebalance_dates = [first] + [d for d in rebalance_dates if d > first]
+
+    compositions_by_date = history.as_of_many(rebalance_dates)
+    pieces = []
+    weights_used = {}
+
+    for i, start in enumerate(rebalance_dates):
+        end = rebalance_dates[i + 1] if i + 1 < len(rebalance_dates) else None
+        comp = compositions_by_date[_to_date(start)]
+        if not comp:
+            continue
+
+        final_weights, _ = utils.calculate_consolidated_weights(etf_aums, comp)
+        weights = {}
+        for t, w in final_weights.items():
+            col = matrix.price_column(t)
+            if col:
+                weights[col] = weights.get(col, 0.0) + w / 100.0
+        if not weights:
+            continue
+        weights_used[_to_date(start)] = final_weights
+
+        in_period = (dates >= start) & ((dates < end) if end is not None else True)
+        if not in_period.any():
+            continue
+        _, daily = matrix.portfolio_returns(weights, mask="renormalize")
+        daily.index = dates[len(dates) - len(daily):]
+        pieces.append(daily[in_period[len(dates) - len(daily):]])
+
+    if not pieces:
+        return pd.Series(dtype=float), pd.Series(dtype=float), weights_used
+
+    daily = pd.concat(pieces)
+    cumulative = (1 + daily).cumprod() - 1
+    return cumulative, daily, weights_used
+
+
+def committed_compositions(repo_dir, path=COMPOSITIONS_PATH):
+    """
+    Every committed version of the compositions file, oldest first.
+
+    Returns:
+        list: (commit_date, compositions)
+    """
+    log = subprocess.run(
+        ["git", "log", "--reverse", "--format=%H %cs", "--", path],
+        cwd=repo_dir, capture_output=True, text=True, check=True
+    ).stdout.split()
+    versions = []
+    for commit, date in zip(log[::2], log[1::2]):
+        try:
+            blob = subprocess.run(["git", "show", f"{commit}:{path}"], cwd=repo_dir, capture_output=True, text=True, check=True).stdout
+            versions.append((date, json.loads(blob)))
+        except (subprocess.CalledProcessError, ValueError) as e:
+            # Deleted or unparsable in that commit
+            instrumentation.record_error("holdings_history.git", commit, e)
+    return versions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record the current etf_compositions.json as a dated holdings snapshot.")
+    parser.add_argument("--date", default=datetime.date.today().isoformat(), help="Snapshot date (YYYY-MM-DD)")
+    parser.add_argument("--file", help="Compositions JSON to record instead (e.g. an archived copy; set --date to its as-of date)")
+    parser.add_argument("--from-git", action="store_true", help="Record every committed version of data/etf_compositions.json at its commit date")
+    args = parser.parse_args(argv)
+
+    history = HoldingsHistory.load()
+    if args.from_git:
+        repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        versions = committed_compositions(repo_dir)
+    elif args.file:
+        with open(args.file, 'r', encoding='utf-8') as f:
+            versions = [(args.date, json.load(f))]
+    else:
+        import data_loader
+        versions = [(args.date, data_loader.load_compositions())]
+
+    recorded = [date for date, compositions in versions if history.add_snapshot(date, compositions)]
+    if recorded:
+        history.save()
+        print(f"Recorded {len(recorded)} snapshot(s) {', '.join(recorded)} ({len(history.snapshots)} snapshots in history)")
+    else:
+        print(f"Compositions unchanged, nothing recorded ({len(history.snapshots)} snapshots from {history.first_date})")
+
+
+if __name__ == "__main__":
+    main()
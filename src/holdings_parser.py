@@ -1,6 +1,9 @@
 import os
 import re
 import json
+import datetime
+from holdings_history import HoldingsHistory
+import catalog
 
 def parse_holdings():
     # Use relative paths
@@ -116,5 +119,12 @@ def parse_holdings():
         
     print(f"Saved compositions for {len(compositions)} ETFs to {output_path}")
 
+    # Keep a dated copy in the point-in-time holdings history (stored as a delta)
+    history = HoldingsHistory.load()
+    if history.add_snapshot(datetime.date.today(), compositions):
+        history.save()
+        print(f"Recorded holdings snapshot ({len(history.snapshots)} in history)")
+    catalog.upsert_holdings(compositions, datetime.date.today().isoformat())
+
 if __name__ == "__main__":
     parse_holdings()
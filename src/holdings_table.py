@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+import theme_index
+
+PAGE_SIZES = [50, 100, 250, 500]
+SORT_COLUMNS = ["Consolidated Weight (%)", "Allocated Cap ($B)", "Market Cap", "Ticker"]
+
+
+class HoldingsTable:
+    """
+    Columnar holdings result for the "ETF Composition" view, with server-side
+    sorting, filtering and paging. Only the visible page is ever formatted or
+    sent to the browser.
+
+    Sort orders are computed once per column and direction and reused by every
+    filter/page request; filters are boolean masks over the numpy columns.
+    """
+
+    def __init__(self, stock_counter, stock_cap_details, market_caps):
+        index = theme_index.breakdown_index(stock_cap_details)
+        weights_s = pd.Series(stock_counter, dtype=float)
+        caps_s = pd.Series(market_caps, dtype=float)
+        mcap = caps_s.reindex(weights_s.index)
+        # Compositions use 'BRK.B', Yahoo uses 'BRK-B'
+        mcap = mcap.fillna(caps_s.reindex(weights_s.index.str.replace('.', '-', regex=False)).set_axis(weights_s.index)).fillna(0.0)
+
+        self.columns = {
+            "Ticker": weights_s.index.to_numpy(dtype=object),
+            "Consolidated Weight (%)": weights_s.to_numpy(),
+            "Allocated Cap ($B)": index.totals().reindex(weights_s.index).fillna(0.0).to_numpy(),
+            "Market Cap": mcap.to_numpy(),
+            "Sectors": index.labels().reindex(weights_s.index).fillna("").to_numpy(dtype=object),
+        }
+        self._upper_tickers = np.char.upper(self.columns["Ticker"].astype(str))
+        # (row, etf) pairs of the breakdown, for the source-ETF filter
+        position = pd.Series(np.arange(len(weights_s)), index=weights_s.index)
+        self._member_rows = pd.Series(index.stocks).map(position).to_numpy()[index.rows]
+        self._member_etfs = np.array(index.etfs, dtype=object)[index.cols]
+        self._orders = {}
+
+    def __len__(self):
+        return len(self.columns["Ticker"])
+
+    @property
+    def total_market_cap(self):
+        return float(self.columns["Market Cap"].sum())
+
+    def order(self, sort_by, ascending=False):
+        """
+        Row order for a column, cached per (column, direction).
+        """
+        key = (sort_by, ascending)
+        if key not in self._orders:
+            values = self.columns[sort_by]
+            if values.dtype == object:
+                order = np.argsort(values.astype(str), kind="stable")
+            else:
+                order = np.argsort(values, kind="stable")
+            self._orders[key] = order if ascending else order[::-1]
+        return self._orders[key]
+
+    def query(self, sort_by="Consolidated Weight (%)", ascending=False, search=None, etfs=None):
+        """
+        Sorted row indices matching the filters.
+
+        Args:
+            search (str): case-insensitive ticker substring
+            etfs (list): keep stocks held by any of these source ETFs
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if search:
+            mask &= np.char.find(self._upper_tickers, search.strip().upper()) >= 0
+        if etfs:
+            held = np.zeros(len(self), dtype=bool)
+            held[self._member_rows[np.isin(self._member_etfs, list(etfs))]] = True
+            mask &= held
+        order = self.order(sort_by, ascending)
+        return order[mask[order]]
+
+    def page(self, rows, page=1, page_size=PAGE_SIZES[0]):
+        """
+        The visible slice of `rows` as a display-ready DataFrame (formatting
+        applied to these rows only).
+        """
+        start = (max(page, 1) - 1) * page_size
+        idx = rows[start:start + page_size]
+        return pd.DataFrame({
+            "Ticker": self.columns["Ticker"][idx],
+            "Consolidated Weight (%)": [f"{v:.5f}%" for v in self.columns["Consolidated Weight (%)"][idx]],
+            "Allocated Cap ($B)": [f"${v:.2f} B" for v in self.columns["Allocated Cap ($B)"][idx]],
+            "Market Cap": [f"${v / 1e9:,.2f} B" for v in self.columns["Market Cap"][idx]],
+            "Sectors": self.columns["Sectors"][idx],
+        }, index=pd.RangeIndex(start + 1, start + 1 + len(idx), name="#"))
+
+    def to_frame(self, rows=None):
+        """
+        Numeric (unformatted) rows, e.g. for a CSV export of the filtered result.
+        """
+        df = pd.DataFrame(self.columns)
+        return df if rows is None else df.iloc[rows].reset_index(drop=True)
+
+
+@st.cache_resource(max_entries=4)
+def build_holdings_table(stock_counter, stock_cap_details, market_caps):
+    """
+    Shared HoldingsTable per (weights, breakdown, caps); sort orders built by one
+    session are reused by the others.
+    """
+    return HoldingsTable(stock_counter, stock_cap_details, market_caps)
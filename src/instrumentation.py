@@ -0,0 +1,195 @@
+import threading
+import time
+import json
+import functools
+from collections import deque
+from contextlib import contextmanager
+
+# Upper bounds (ms) of the latency histogram buckets. The last bucket is open-ended.
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+MAX_ERRORS = 200
+
+_lock = threading.Lock()
+_counters = {}
+_timers = {}
+_histograms = {}
+_errors = deque(maxlen=MAX_ERRORS)
+_started_at = time.time()
+
+
+def _bucket_index(elapsed_ms):
+    for i, bound in enumerate(LATENCY_BUCKETS_MS):
+        if elapsed_ms <= bound:
+            return i
+    return len(LATENCY_BUCKETS_MS)
+
+
+def increment(name, n=1):
+    """
+    Increments a named counter (e.g. 'get_market_caps.path.fast_info').
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def record_time(name, seconds):
+    """
+    Records one sample for a named timer. Keeps count/total/min/max so the
+    samples can be aggregated without storing them.
+    """
+    ms = seconds * 1000.0
+    with _lock:
+        t = _timers.get(name)
+        if t is None:
+            _timers[name] = {"count": 1, "total_ms": ms, "min_ms": ms, "max_ms": ms}
+        else:
+            t["count"] += 1
+            t["total_ms"] += ms
+            t["min_ms"] = min(t["min_ms"], ms)
+            t["max_ms"] = max(t["max_ms"], ms)
+
+
+def observe_latency(name, label, seconds):
+    """
+    Adds a latency sample to the histogram `name`, bucketed per `label` (usually a ticker).
+    """
+    idx = _bucket_index(seconds * 1000.0)
+    with _lock:
+        hist = _histograms.setdefault(name, {})
+        buckets = hist.get(label)
+        if buckets is None:
+            buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+            hist[label] = buckets
+        buckets[idx] += 1
+
+
+def record_error(where, subject, exc):
+    """
+    Replaces the old `print(f"Debug Error ...")` calls: keeps the error in a
+    bounded log and counts it per call site.
+    """
+    increment(f"{where}.errors")
+    with _lock:
+        _errors.append({
+            "time": time.time(),
+            "where": where,
+            "subject": str(subject),
+            "error": f"{type(exc).__name__}: {exc}",
+        })
+
+
+@contextmanager
+def timer(name):
+    """
+    Context manager timing the enclosed block under `name`.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_time(name, time.perf_counter() - start)
+
+
+def timed(name=None):
+    """
+    Decorator timing every call of the wrapped function.
+    """
+    def decorator(func):
+        timer_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(timer_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def track_cache(name):
+    """
+    Decorator placed *outside* an `st.cache_data` function to count calls.
+    The cached function body calls `cache_miss(name)` when it actually runs,
+    so hits = calls - misses.
+    """
+    def decorator(cached_func):
+        @functools.wraps(cached_func)
+        def wrapper(*args, **kwargs):
+            increment(f"cache.{name}.calls")
+            with timer(f"cache.{name}"):
+                return cached_func(*args, **kwargs)
+        # Keep st.cache_data's clear() reachable through the wrapper
+        wrapper.clear = getattr(cached_func, "clear", None)
+        return wrapper
+    return decorator
+
+
+def cache_miss(name):
+    increment(f"cache.{name}.misses")
+
+
+@contextmanager
+def queued(name, submitted_at):
+    """
+    Used inside thread-pool workers: records how long the task waited in the
+    queue (submit -> start) and how long it ran.
+    """
+    record_time(f"{name}.queue_wait", time.perf_counter() - submitted_at)
+    with timer(f"{name}.run"):
+        yield
+
+
+def _cache_stats():
+    stats = {}
+    for key, value in _counters.items():
+        if key.startswith("cache.") and key.endswith(".calls"):
+            fname = key[len("cache."):-len(".calls")]
+            misses = _counters.get(f"cache.{fname}.misses", 0)
+            stats[fname] = {
+                "calls": value,
+                "misses": misses,
+                "hits": max(value - misses, 0),
+                "hit_rate": (value - misses) / value if value else 0.0,
+            }
+    return stats
+
+
+def snapshot():
+    """
+    Returns a JSON-serializable copy of every metric collected so far.
+    """
+    with _lock:
+        timers = {}
+        for k, t in _timers.items():
+            timers[k] = dict(t, avg_ms=t["total_ms"] / t["count"])
+        return {
+            "started_at": _started_at,
+            "generated_at": time.time(),
+            "latency_buckets_ms": list(LATENCY_BUCKETS_MS),
+            "counters": dict(_counters),
+            "timers": timers,
+            "cache": _cache_stats(),
+            "histograms": {k: {label: list(b) for label, b in v.items()} for k, v in _histograms.items()},
+            "errors": list(_errors),
+        }
+
+
+def export_json(path=None):
+    """
+    Serializes the snapshot to JSON. Writes to `path` if given, returns the string.
+    """
+    payload = json.dumps(snapshot(), indent=2, default=str)
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+    return payload
+
+
+def reset():
+    global _started_at
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+        _histograms.clear()
+        _errors.clear()
+        _started_at = time.time()
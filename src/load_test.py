@@ -0,0 +1,327 @@
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+import yfinance as yf
+import memory_monitor
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+VIEWS = ["Indy's ETF Information", "ETF Composition", "Invest in ETF"]
+SAMPLE_SECONDS = 0.05
+
+
+class ReplayMarket:
+    """
+    Local stand-in for the yfinance endpoints the app uses (Ticker.fast_info,
+    Ticker.info, Ticker.history, download). Quotes come from the catalog's last
+    recorded prices/market caps when available, otherwise from a deterministic
+    per-ticker value, so every run sees the same market. Every call is counted.
+
+    Args:
+        latency (float): seconds each upstream call sleeps, to mimic network time
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.requests = {}
+        self._prices = {}
+        self._caps = {}
+        try:
+            import catalog
+            self._prices = {t: v for t, (v, _) in catalog.latest_observations('price').items()}
+            for kind in ('market_cap', 'aum'):
+                self._caps.update({t: v for t, (v, _) in catalog.latest_observations(kind).items()})
+        except Exception:
+            pass
+        self._originals = None
+
+    def _count(self, endpoint, n=1):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + n
+        if self.latency:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def _seed(ticker):
+        return zlib.crc32(ticker.encode('utf-8'))
+
+    def price(self, ticker):
+        if ticker.endswith("USD=X"):
+            import fx_service
+            return fx_service.FALLBACK_EXCHANGE_RATES.get(ticker[:3], 1.0)
+        p = self._prices.get(ticker) or self._prices.get(ticker.replace('-', '.'))
+        return float(p) if p else 10.0 + self._seed(ticker) % 490
+
+    def market_cap(self, ticker):
+        cap = self._caps.get(ticker) or self._caps.get(ticker.replace('-', '.'))
+        return float(cap) if cap else 1e9 * (1 + self._seed(ticker) % 500)
+
+    def history(self, ticker, index):
+        rng = np.random.default_rng(self._seed(ticker))
+        walk = np.exp(np.cumsum(rng.normal(0.0003, 0.015, len(index))))
+        return self.price(ticker) * walk / walk[-1]
+
+    def _index(self, period=None, start=None, end=None, interval="1d"):
+        if interval.endswith("m"):
+            return pd.date_range(end=pd.Timestamp.now().floor("min"), periods=390, freq="min")
+        end = pd.Timestamp(end) if end else pd.Timestamp.today().normalize()
+        if start is not None:
+            return pd.bdate_range(start, end, inclusive="left")
+        import download_planner
+        first = download_planner.period_start(period or "1mo", end) or end - pd.DateOffset(years=10)
+        return pd.bdate_range(first, end)
+
+    def download(self, tickers, period=None, interval="1d", start=None, end=None, **kwargs):
+        symbols = tickers.split() if isinstance(tickers, str) else list(tickers)
+        self._count("download")
+        self._count("download.tickers", len(symbols))
+        index = self._index(period, start, end, interval)
+        if not len(index):
+            return pd.DataFrame()
+        closes = pd.DataFrame({s: self.history(s, index) for s in symbols}, index=index)
+        return pd.concat({"Close": closes}, axis=1)
+
+    def ticker(self, symbol):
+        market = self
+
+        class _Ticker:
+            @property
+            def fast_info(self):
+                market._count("fast_info")
+                price = market.price(symbol)
+                cap = market.market_cap(symbol)
+                return {
+                    "last_price": price, "previous_close": price, "market_cap": cap,
+                    "shares": cap / price, "currency": "USD",
+                }
+
+            @property
+            def info(self):
+                market._count("info")
+                return {"marketCap": market.market_cap(symbol), "currentPrice": market.price(symbol), "currency": "USD"}
+
+            def history(self, period="1d", **kwargs):
+                market._count("history")
+                index = market._index(period)
+                return pd.DataFrame({"Close": market.history(symbol, index)}, index=index)
+
+        return _Ticker()
+
+    def install(self):
+        self._originals = (yf.Ticker, yf.download)
+        yf.Ticker = self.ticker
+        yf.download = self.download
+
+    def uninstall(self):
+        if self._originals:
+            yf.Ticker, yf.download = self._originals
+            self._originals = None
+
+
+class ResourceSampler:
+    """
+    Background sampler of thread count and resident memory; keeps the peaks.
+    """
+
+    def __init__(self, interval=SAMPLE_SECONDS):
+        self.interval = interval
+        self.peak_threads = threading.active_count()
+        self.peak_rss_mb = memory_monitor.rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self.peak_rss_mb = max(self.peak_rss_mb, memory_monitor.rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _preimport():
+    # Import everything app.py imports up front: concurrent first imports (and the
+    # compiles they trigger) across session threads are racy and skew the first timings
+    import ast
+    import importlib
+    with open(APP_PATH, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                importlib.import_module(alias.name)
+    importlib.import_module("streamlit.testing.v1")
+
+
+def _make_apptest_concurrent():
+    """
+    AppTest assumes one run at a time per process. Two shims let sessions run in
+    parallel threads the way a real server runs them:
+      - every run installs a mock Runtime singleton and clears it when done; a run
+        still in flight falls back to the last installed one instead of failing
+      - a real server compiles app.py once into a shared script cache, while every
+        AppTest compiles its own copy; concurrent ast.parse calls can fail on
+        CPython 3.11 ("AST constructor recursion depth mismatch"), so compiles take turns
+    """
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner import script_cache
+    if getattr(Runtime, "_load_test_shimmed", False):
+        return
+    last_runtime = {}
+    original_instance = Runtime.instance.__func__
+
+    def instance(cls):
+        if cls._instance is not None:
+            last_runtime["runtime"] = cls._instance
+            return cls._instance
+        if "runtime" in last_runtime:
+            return last_runtime["runtime"]
+        return original_instance(cls)
+
+    Runtime.instance = classmethod(instance)
+
+    compile_lock = threading.Lock()
+    original_get_bytecode = script_cache.ScriptCache.get_bytecode
+
+    def get_bytecode(self, script_path):
+        with compile_lock:
+            return original_get_bytecode(self, script_path)
+
+    script_cache.ScriptCache.get_bytecode = get_bytecode
+    Runtime._load_test_shimmed = True
+
+
+def _session(session_id, iterations, timings, errors, timeout):
+    from streamlit.testing.v1 import AppTest
+    for it in range(iterations):
+        at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        for view in VIEWS:
+            start = time.perf_counter()
+            try:
+                if view == VIEWS[0]:
+                    at.run()
+                else:
+                    at.sidebar.radio[0].set_value(view).run()
+                if view == "Invest in ETF" and at.button:
+                    at.button[0].click().run()
+                failed = [str(e.value) for e in at.exception]
+            except Exception as e:
+                failed = [repr(e)]
+            timings.append((session_id, it, view, time.perf_counter() - start))
+            if failed:
+                errors.append({"session": session_id, "iteration": it, "view": view, "errors": failed})
+
+
+def run_load_test(sessions=5, iterations=1, latency=0.0, timeout=300, cold=False, market=None):
+    """
+    Drives `sessions` concurrent AppTest sessions through the three menu views
+    against the replay market.
+
+    Returns:
+        dict: per-view and overall p50/p95/p99 latency (ms), peak threads, peak RSS (MB),
+              upstream request counts and session errors
+    """
+    import instrumentation
+    import result_cache
+    import streamlit as st
+
+    market = market or ReplayMarket(latency=latency)
+    _preimport()
+    _make_apptest_concurrent()
+    market.install()
+    if cold:
+        st.cache_data.clear()
+        st.cache_resource.clear()
+        result_cache.clear()
+    instrumentation.reset()
+
+    timings, errors = [], []
+    started = time.perf_counter()
+    try:
+        with ResourceSampler() as sampler:
+            workers = [
+                threading.Thread(target=_session, args=(i, iterations, timings, errors, timeout))
+                for i in range(sessions)
+            ]
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+    finally:
+        market.uninstall()
+    elapsed = time.perf_counter() - started
+
+    df = pd.DataFrame(timings, columns=["session", "iteration", "view", "seconds"])
+
+    def percentiles(s):
+        ms = s.to_numpy() * 1000.0
+        return {"count": int(len(ms)), "p50_ms": float(np.percentile(ms, 50)),
+                "p95_ms": float(np.percentile(ms, 95)), "p99_ms": float(np.percentile(ms, 99)),
+                "max_ms": float(ms.max())}
+
+    return {
+        "sessions": sessions,
+        "iterations": iterations,
+        "upstream_latency_ms": latency * 1000.0,
+        "wall_seconds": elapsed,
+        "views": {view: percentiles(g["seconds"]) for view, g in df.groupby("view")} if len(df) else {},
+        "overall": percentiles(df["seconds"]) if len(df) else {},
+        "peak_threads": sampler.peak_threads,
+        "peak_rss_mb": sampler.peak_rss_mb,
+        "upstream_requests": dict(sorted(market.requests.items())),
+        "cache": instrumentation.snapshot()["cache"],
+        "errors": errors,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent-session load test of the Streamlit app against a replay market.")
+    parser.add_argument("--sessions", type=int, default=5, help="Concurrent simulated sessions")
+    parser.add_argument("--iterations", type=int, default=1, help="Passes through the three views per session")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated upstream latency per request")
+    parser.add_argument("--cold", action="store_true", help="Clear st.cache_data/st.cache_resource and the result cache first")
+    parser.add_argument("--timeout", type=float, default=300, help="Per-run AppTest timeout (s)")
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    # Replay quotes come from the real catalog; the run's own writes go to a scratch dir
+    market = ReplayMarket(latency=args.latency_ms / 1000.0)
+    scratch = tempfile.mkdtemp(prefix="etf_load_test_")
+    import catalog
+    import download_planner
+    import result_cache
+    catalog.CATALOG_PATH = os.path.join(scratch, "catalog.sqlite3")
+    download_planner.CACHE_DIR = os.path.join(scratch, "downloads")
+    result_cache.CACHE_DIR = os.path.join(scratch, "results")
+
+    report = run_load_test(args.sessions, args.iterations, args.latency_ms / 1000.0, args.timeout, args.cold, market)
+
+    print(f"{report['sessions']} sessions x {report['iterations']} iterations in {report['wall_seconds']:.1f}s")
+    for view, stats in report["views"].items():
+        print(f"  {view:<24} p50 {stats['p50_ms']:8.0f} ms   p95 {stats['p95_ms']:8.0f} ms   p99 {stats['p99_ms']:8.0f} ms")
+    print(f"  peak threads {report['peak_threads']}, peak RSS {report['peak_rss_mb']:.0f} MB")
+    print(f"  upstream requests: {report['upstream_requests']}")
+    if report["errors"]:
+        print(f"  {len(report['errors'])} view runs raised errors (see JSON report)")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, default=float)
+        print(f"Wrote {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+import os
+import sys
+import time
+import resource
+import threading
+import functools
+import tracemalloc
+import numpy as np
+import pandas as pd
+import instrumentation
+
+MB = 2**20
+# Budget for all registered st.cache_data entries together, and optional per-function budgets
+CACHE_BUDGET_MB = float(os.environ.get("ETF_CACHE_BUDGET_MB", 512))
+CACHE_BUDGETS_MB = {
+    "load_stock_data": 256,
+    "chart_frame": 64,
+}
+# "lru" (least recently used first) or "largest" (biggest entry first)
+EVICTION_POLICY = os.environ.get("ETF_CACHE_EVICTION", "lru")
+# Above this fraction of the container memory limit, caches are shrunk to PRESSURE_BUDGET_FRACTION of the budget
+HIGH_WATER_FRACTION = 0.8
+PRESSURE_BUDGET_FRACTION = 0.5
+TRACEMALLOC_FRAMES = 1
+
+_lock = threading.Lock()
+_usage = {}
+_objects = {}
+_caches = {}
+_last_used = {}
+_local = threading.local()
+
+
+# --- Process / container memory ---
+
+def rss_mb():
+    """
+    Current resident set size of the process in MB.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / MB
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is KB on Linux (peak rather than current, but monotone is enough here)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def container_limit_mb():
+    """
+    Memory limit of the container (cgroup v2, then v1) in MB, or None if unlimited.
+    """
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                raw = f.read().strip()
+        except OSError:
+            continue
+        if raw == "max":
+            return None
+        limit = int(raw) / MB
+        # v1 reports "unlimited" as a huge page-aligned number
+        return limit if limit < 2**40 else None
+    return None
+
+
+def sizeof(obj, _seen=None):
+    """
+    Approximate deep size in bytes of the objects the app keeps around
+    (DataFrames, Series, arrays, dicts/lists of them, scalars).
+    """
+    _seen = set() if _seen is None else _seen
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        usage = obj.memory_usage(deep=True, index=True)
+        return int(usage.sum()) if isinstance(obj, pd.DataFrame) else int(usage)
+    if isinstance(obj, pd.Index):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sizeof(k, _seen) + sizeof(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(sizeof(v, _seen) for v in obj)
+    return size
+
+
+def record_object(name, obj):
+    """
+    Records the deep size of a long-lived object (e.g. ETF_AUMS, the plan frames).
+    """
+    size = sizeof(obj)
+    with _lock:
+        _objects[name] = {"mb": size / MB, "type": type(obj).__name__, "updated_at": time.time()}
+    return size
+
+
+# --- tracemalloc profiling ---
+
+def tracing():
+    return tracemalloc.is_tracing()
+
+
+def start_tracing(frames=TRACEMALLOC_FRAMES):
+    """
+    Starts tracemalloc. Allocations get noticeably slower while tracing, so it is
+    off unless ETF_TRACEMALLOC=1 or started from the Diagnostics page.
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def stop_tracing():
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def _record_usage(name, net_bytes, peak_bytes, seconds):
+    with _lock:
+        u = _usage.get(name)
+        if u is None:
+            u = _usage[name] = {"count": 0, "last_net_mb": 0.0, "max_net_mb": 0.0, "max_peak_mb": 0.0, "total_s": 0.0}
+        u["count"] += 1
+        u["last_net_mb"] = net_bytes / MB
+        u["max_net_mb"] = max(u["max_net_mb"], net_bytes / MB)
+        u["max_peak_mb"] = max(u["max_peak_mb"], peak_bytes / MB)
+        u["total_s"] += seconds
+
+
+class track:
+    """
+    Measures the traced memory a block allocates: net (still held at the end) and
+    peak (high-water mark above the starting point). No-op unless tracemalloc is tracing.
+
+    Scopes nest per thread (a view containing cached calls): each one hands its
+    peak to the enclosing one, since tracemalloc has a single process-wide peak.
+    Sessions running in parallel share that counter, so concurrent numbers are approximate.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.frame = None
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            return self
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+        tracemalloc.reset_peak()
+        self.frame = {"start": current, "peak": current, "started": time.perf_counter()}
+        stack.append(self.frame)
+        return self
+
+    def __exit__(self, *exc):
+        frame, self.frame = self.frame, None
+        stack = getattr(_local, "stack", [])
+        depth = next((i for i, f in enumerate(stack) if f is frame), None)
+        if depth is None or not tracemalloc.is_tracing():
+            return False
+        del stack[depth:]
+        end, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, frame["peak"])
+        if stack:
+            stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+        _record_usage(self.name, end - frame["start"], peak - frame["start"], time.perf_counter() - frame["started"])
+        return False
+
+
+def begin(name):
+    """
+    Opens an outermost scope for code that does not fit a with-block (a Streamlit
+    view spans the rest of the script). Scopes left open by an interrupted run
+    (st.rerun, st.stop) are dropped. Pass the result to end().
+    """
+    _local.stack = []
+    return track(name).__enter__()
+
+
+def end(scope):
+    if scope is not None:
+        scope.__exit__(None, None, None)
+
+
+def top_allocations(limit=20, under=None):
+    """
+    Largest live allocation sites (by file:line) of the current tracemalloc snapshot,
+    optionally restricted to files under the directory `under`.
+    """
+    if not tracemalloc.is_tracing():
+        return pd.DataFrame(columns=["Site", "Size (MB)", "Blocks"])
+    snapshot = tracemalloc.take_snapshot()
+    if under:
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(True, os.path.join(os.path.abspath(under), "*"))])
+    rows = [
+        {"Site": f"{os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}",
+         "Size (MB)": s.size / MB, "Blocks": s.count}
+        for s in snapshot.statistics("lineno")[:limit]
+    ]
+    return pd.DataFrame(rows, columns=["Site", "Size (MB)", "Blocks"])
+
+
+def usage():
+    """
+    Returns:
+        pd.DataFrame: per tracked scope (views as "view.<name>", cached functions as
+            "cache.<name>"): calls, last/max net MB, max peak MB, total seconds
+    """
+    with _lock:
+        return pd.DataFrame.from_dict({k: dict(v) for k, v in _usage.items()}, orient="index")
+
+
+def objects():
+    """
+    Returns:
+        pd.DataFrame: the sizes recorded with record_object()
+    """
+    with _lock:
+        return pd.DataFrame.from_dict({k: dict(v) for k, v in _objects.items()}, orient="index")
+
+
+def reset():
+    with _lock:
+        _usage.clear()
+        _objects.clear()
+
+
+# --- st.cache_data budgets ---
+
+def cached(name):
+    """
+    Decorator placed directly above `st.cache_data`: registers the cached function
+    for budget enforcement and profiles every call (hits return a fresh unpickled
+    copy, so they allocate too) under f"cache.{name}".
+    """
+    def decorator(cached_func):
+        _caches[name] = cached_func
+
+        @functools.wraps(cached_func)
+        def wrapper(*args, **kwargs):
+            _last_used[name] = time.time()
+            with track(f"cache.{name}"):
+                return cached_func(*args, **kwargs)
+        wrapper.clear = getattr(cached_func, "clear", None)
+        return wrapper
+    return decorator
+
+
+def _storage(cached_func):
+    # Streamlit internals: the function's DataCache and its in-memory storage, whose
+    # entries are the pickled results in least-recently-used order
+    return cached_func._info.get_function_cache(cached_func._function_key).storage
+
+
+def _entries(cached_func):
+    storage = _storage(cached_func)
+    with storage._mem_cache_lock:
+        return [(key, len(value)) for key, value in storage._mem_cache.items()]
+
+
+def cache_usage():
+    """
+    Size of every registered st.cache_data function's entries.
+
+    Returns:
+        pd.DataFrame: Entries, Size (MB), Largest (MB) and Budget (MB) per function
+    """
+    rows = {}
+    for name, func in _caches.items():
+        try:
+            sizes = [size for _, size in _entries(func)]
+        except (AttributeError, RuntimeError):
+            # No script run context yet, or a Streamlit without these internals
+            continue
+        rows[name] = {
+            "Entries": len(sizes),
+            "Size (MB)": sum(sizes) / MB,
+            "Largest (MB)": max(sizes, default=0) / MB,
+            "Budget (MB)": CACHE_BUDGETS_MB.get(name, np.nan),
+        }
+    return pd.DataFrame.from_dict(rows, orient="index", columns=["Entries", "Size (MB)", "Largest (MB)", "Budget (MB)"])
+
+
+def _evict(candidates, target_bytes, policy):
+    # candidates: [(name, storage, key, size)], oldest first
+    total = sum(c[3] for c in candidates)
+    if policy == "largest":
+        candidates = sorted(candidates, key=lambda c: c[3], reverse=True)
+    evicted = []
+    for candidate in candidates:
+        if total <= target_bytes:
+            break
+        name, storage, key, size = candidate
+        storage.delete(key)
+        total -= size
+        evicted.append(candidate)
+        instrumentation.increment(f"memory.cache_evicted.{name}")
+    return evicted
+
+
+def enforce_budgets(budget_mb=None, policy=None):
+    """
+    Evicts st.cache_data entries until every function is within its own budget and
+    all registered functions together are within budget_mb (CACHE_BUDGET_MB by
+    default; shrunk when the process is close to the container limit).
+
+    Recency across functions is the function's last call; within a function it is
+    Streamlit's own LRU order.
+
+    Returns:
+        list: (function name, bytes) of the evicted entries
+    """
+    policy = policy or EVICTION_POLICY
+    budget_mb = CACHE_BUDGET_MB if budget_mb is None else budget_mb
+    limit = container_limit_mb()
+    if limit and rss_mb() > HIGH_WATER_FRACTION * limit:
+        instrumentation.increment("memory.pressure")
+        budget_mb *= PRESSURE_BUDGET_FRACTION
+
+    evicted = []
+    remaining = []
+    for name in sorted(_caches, key=lambda n: _last_used.get(n, 0.0)):
+        try:
+            storage = _storage(_caches[name])
+            candidates = [(name, storage, key, size) for key, size in _entries(_caches[name])]
+        except (AttributeError, RuntimeError):
+            continue
+        if name in CACHE_BUDGETS_MB:
+            dropped = _evict(candidates, CACHE_BUDGETS_MB[name] * MB, policy)
+            dropped_keys = {c[2] for c in dropped}
+            candidates = [c for c in candidates if c[2] not in dropped_keys]
+            evicted += dropped
+        remaining += candidates
+    evicted += _evict(remaining, budget_mb * MB, policy)
+    return [(name, size) for name, _, _, size in evicted]
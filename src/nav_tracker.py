@@ -0,0 +1,278 @@
+import time
+import numpy as np
+import pandas as pd
+import yfinance as yf
+import instrumentation
+import data_loader
+
+HISTORY_SIZE = 3600
+# Incremental sums are rebuilt from scratch this often to shed float drift
+RESYNC_EVERY = 1000
+
+
+class _RingBuffer:
+    """
+    Fixed-size history of (timestamp, nav, pnl, tracking_error) rows in preallocated arrays.
+    """
+    FIELDS = ("timestamp", "nav", "pnl", "tracking_error")
+
+    def __init__(self, capacity=HISTORY_SIZE):
+        self.capacity = capacity
+        self._data = np.full((capacity, len(self.FIELDS)), np.nan)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, row):
+        self._data[self._next] = row
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def to_frame(self):
+        """
+        Rows oldest first, indexed by timestamp.
+        """
+        if self._count < self.capacity:
+            data = self._data[:self._count]
+        else:
+            data = np.roll(self._data, -self._next, axis=0)
+        df = pd.DataFrame(data, columns=self.FIELDS)
+        df.index = pd.to_datetime(df.pop("timestamp"), unit="s")
+        return df
+
+
+class NavTracker:
+    """
+    Live NAV, intraday P&L and weight drift of a held portfolio.
+
+    Each tick only touches the symbols whose price changed: NAV, the sum of
+    squared position values and the value/target cross term are maintained
+    incrementally, which is all the tracking error needs
+
+        TE^2 = sum(v^2)/nav^2 - 2 sum(v t)/nav + sum(t^2)      (weights as fractions)
+
+    Full per-symbol weights and drift are only materialized on request.
+
+    Args:
+        holdings (dict): {ticker: shares}
+        target_weights (dict): {ticker: weight_percentage}, e.g. final_weights
+        reference_prices (dict): {ticker: price} the P&L is measured from
+            (e.g. the plan's purchase prices or the previous close)
+        cash (float): uninvested cash, part of the NAV
+        history_size (int): ring buffer capacity
+    """
+
+    def __init__(self, holdings, target_weights, reference_prices=None, cash=0.0, history_size=HISTORY_SIZE):
+        tickers = list(dict.fromkeys(list(holdings.keys()) + list(target_weights.keys())))
+        self.tickers = tickers
+        self._idx = {t: i for i, t in enumerate(tickers)}
+        self.shares = np.array([holdings.get(t, 0.0) for t in tickers], dtype=float)
+        self.targets = np.array([target_weights.get(t, 0.0) for t in tickers], dtype=float) / 100.0
+        self.cash = float(cash)
+
+        reference_prices = reference_prices or {}
+        self.prices = np.array([reference_prices.get(t, np.nan) for t in tickers], dtype=float)
+        self.reference_nav = None
+        self.history = _RingBuffer(history_size)
+        self.ticks = 0
+        self._resync()
+        if reference_prices:
+            self.reference_nav = self.nav
+
+    @classmethod
+    def from_plan(cls, plan, account=0, history_size=HISTORY_SIZE):
+        """
+        Tracker for one account of a purchase_plan.compute_purchase_plan result,
+        with the plan prices as the P&L reference.
+        """
+        tickers = plan["tickers"]
+        shares = plan["shares"][account]
+        bought = shares > 0
+        return cls(
+            holdings={t: float(s) for t, s, b in zip(tickers, shares, bought) if b},
+            target_weights=dict(zip(tickers, plan["weights"])),
+            reference_prices={t: float(p) for t, p, b in zip(tickers, plan["prices"], bought) if b},
+            cash=float(plan["cash"][account]),
+            history_size=history_size,
+        )
+
+    def _resync(self):
+        values = np.where(np.isnan(self.prices), 0.0, self.prices) * self.shares
+        self.values = values
+        self.nav = self.cash + values.sum()
+        self._sum_vv = float(values @ values)
+        self._sum_vt = float(values @ self.targets)
+        self._sum_tt = float(self.targets @ self.targets)
+
+    def update(self, quotes, timestamp=None):
+        """
+        Applies a batch of quotes {ticker: price}; unknown tickers and non-positive
+        prices are ignored. Cost is O(number of changed symbols).
+
+        Returns:
+            dict: current snapshot (see snapshot())
+        """
+        idx, new_prices = [], []
+        for t, p in quotes.items():
+            i = self._idx.get(t)
+            if i is not None and p is not None and p > 0 and p != self.prices[i]:
+                idx.append(i)
+                new_prices.append(p)
+
+        if idx:
+            idx = np.asarray(idx)
+            new_prices = np.asarray(new_prices, dtype=float)
+            old_values = self.values[idx]
+            new_values = self.shares[idx] * new_prices
+            self.prices[idx] = new_prices
+            self.values[idx] = new_values
+
+            self.nav += (new_values - old_values).sum()
+            self._sum_vv += float(new_values @ new_values - old_values @ old_values)
+            self._sum_vt += float((new_values - old_values) @ self.targets[idx])
+            instrumentation.increment("nav_tracker.changed_symbols", len(idx))
+
+        self.ticks += 1
+        if self.ticks % RESYNC_EVERY == 0:
+            self._resync()
+        if self.reference_nav is None and self.nav > self.cash:
+            self.reference_nav = self.nav
+
+        snap = self.snapshot()
+        self.history.append((timestamp or time.time(), snap["nav"], snap["pnl"], snap["tracking_error"]))
+        return snap
+
+    def tracking_error(self):
+        """
+        L2 distance between held and target weights, in %p (same scale as the purchase plan).
+        """
+        if self.nav <= 0:
+            return float("nan")
+        te2 = self._sum_vv / self.nav ** 2 - 2.0 * self._sum_vt / self.nav + self._sum_tt
+        return float(np.sqrt(max(te2, 0.0)) * 100.0)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: {"nav", "pnl", "pnl_pct", "tracking_error", "ticks"}
+        """
+        ref = self.reference_nav
+        pnl = self.nav - ref if ref else 0.0
+        return {
+            "nav": float(self.nav),
+            "pnl": float(pnl),
+            "pnl_pct": float(pnl / ref * 100.0) if ref else 0.0,
+            "tracking_error": self.tracking_error(),
+            "ticks": self.ticks,
+        }
+
+    def drift(self):
+        """
+        Per-symbol held vs. target weights (O(N), on demand).
+
+        Returns:
+            pd.DataFrame: Price, Value ($), Weight (%), Target (%), Drift (%p), sorted by |drift|
+        """
+        nav = self.nav if self.nav > 0 else 1.0
+        weights = self.values / nav * 100.0
+        df = pd.DataFrame({
+            "Price ($)": self.prices,
+            "Value ($)": self.values,
+            "Weight (%)": weights,
+            "Target (%)": self.targets * 100.0,
+            "Drift (%p)": weights - self.targets * 100.0,
+        }, index=pd.Index(self.tickers, name="Ticker"))
+        return df.reindex(df["Drift (%p)"].abs().sort_values(ascending=False).index)
+
+
+class YFinanceQuoteSource:
+    """
+    Polls the latest 1-minute bars for all symbols in one batched request and
+    returns only the quotes that changed since the previous poll.
+    """
+
+    def __init__(self, tickers):
+        self.symbols = {data_loader.normalize_ticker(t): t for t in tickers}
+        self._last = {}
+
+    def poll(self):
+        try:
+            with instrumentation.timer("nav_tracker.poll"):
+                data = yf.download(list(self.symbols), period="1d", interval="1m", progress=False, auto_adjust=False)
+        except Exception as e:
+            instrumentation.record_error("nav_tracker.poll", "yfinance", e)
+            return {}
+        if data.empty or "Close" not in data:
+            return {}
+        close = data["Close"]
+        if isinstance(close, pd.Series):
+            close = close.to_frame(next(iter(self.symbols)))
+        last = close.ffill().iloc[-1].dropna()
+        changed = {}
+        for symbol, price in last.items():
+            t = self.symbols.get(symbol, symbol)
+            if self._last.get(t) != price:
+                changed[t] = float(price)
+                self._last[t] = price
+        return changed
+
+
+class ReplayQuoteSource:
+    """
+    Replays a recorded price frame (index=timestamp, columns=tickers) one row per
+    poll, emitting only the cells that changed from the previous row.
+    """
+
+    def __init__(self, price_frame):
+        frame = price_frame.sort_index().ffill()
+        values = frame.to_numpy(dtype=float)
+        changed = np.ones_like(values, dtype=bool)
+        changed[1:] = values[1:] != values[:-1]
+        self._changed = changed & np.isfinite(values)
+        self._values = values
+        self.timestamps = frame.index
+        self.tickers = np.asarray(frame.columns, dtype=object)
+        self.position = 0
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls(pd.read_csv(path, index_col=0, parse_dates=True))
+
+    def exhausted(self):
+        return self.position >= len(self._values)
+
+    def poll(self):
+        if self.exhausted():
+            return {}
+        row = self.position
+        self.position += 1
+        mask = self._changed[row]
+        return dict(zip(self.tickers[mask], self._values[row, mask]))
+
+    def timestamp(self):
+        """
+        Timestamp (unix seconds) of the row returned by the last poll.
+        """
+        return pd.Timestamp(self.timestamps[max(self.position - 1, 0)]).timestamp()
+
+
+def run(tracker, source, interval=1.0, max_ticks=None, on_tick=None):
+    """
+    Drives a tracker from a quote source. Replay sources run without sleeping and
+    use their recorded timestamps.
+    """
+    replay = isinstance(source, ReplayQuoteSource)
+    ticks = 0
+    while max_ticks is None or ticks < max_ticks:
+        if replay and source.exhausted():
+            break
+        quotes = source.poll()
+        snap = tracker.update(quotes, timestamp=source.timestamp() if replay else None)
+        if on_tick is not None:
+            on_tick(snap)
+        ticks += 1
+        if not replay:
+            time.sleep(interval)
+    return tracker
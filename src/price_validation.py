@@ -0,0 +1,247 @@
+import numpy as np
+import pandas as pd
+import instrumentation
+import catalog
+
+# A daily move beyond this factor (either direction) is an anomaly candidate
+JUMP_RATIO = 1.8
+# Integer factors an unadjusted split / reverse split (or a unit change) snaps to
+SPLIT_FACTORS = [2, 3, 4, 5, 8, 10, 15, 20, 25, 50]
+# Minor-unit switches, e.g. GBp <-> GBP
+SCALE_FACTORS = [100]
+# How close a move must be to a factor to be treated as one
+SNAP_TOLERANCE = 0.05
+# A reported split within this many days of a split-like move confirms it
+SPLIT_DATE_TOLERANCE_DAYS = 3
+# Consecutive identical closes that count as a stale quote
+STALE_RUN = 5
+# Interior holes up to this many rows are filled from the previous close
+GAP_FILL_LIMIT = 5
+# Last close vs. an independent quote beyond this factor = wrong currency / units
+CURRENCY_TOLERANCE = 1.5
+MIN_OBSERVATIONS = 20
+QUARANTINE_BELOW = 0.5
+
+REPORT_COLUMNS = [
+    "observations", "gaps", "filled", "stale_days", "stale_tail", "splits", "unconfirmed_splits",
+    "scale_jumps", "spikes", "jumps", "currency_mismatch", "score", "quarantined",
+]
+
+
+def _snap(log_r, factors):
+    """
+    Per cell: the signed log of the factor the move matches, 0 where none does.
+    """
+    snapped = np.zeros_like(log_r)
+    for k in factors:
+        lk = np.log(k)
+        snapped = np.where(np.abs(log_r + lk) < SNAP_TOLERANCE, -lk, snapped)
+        snapped = np.where(np.abs(log_r - lk) < SNAP_TOLERANCE, lk, snapped)
+    return snapped
+
+
+def _run_lengths(flags):
+    """
+    Length of the run of True ending at each cell, per column (0 where False).
+    """
+    rows = np.arange(flags.shape[0])[:, None]
+    last_reset = np.maximum.accumulate(np.where(flags, -1, rows), axis=0)
+    return np.where(flags, rows - last_reset, 0)
+
+
+def _confirmed(split_log, dates, tickers, splits):
+    """
+    Keeps the split-like moves that match a reported split (same factor, within
+    SPLIT_DATE_TOLERANCE_DAYS); zero elsewhere.
+    """
+    confirmed = np.zeros_like(split_log)
+    tolerance = pd.Timedelta(days=SPLIT_DATE_TOLERANCE_DAYS)
+    for j in np.flatnonzero((split_log != 0).any(axis=0)):
+        reported = splits.get(tickers[j])
+        if reported is None or len(reported) == 0:
+            continue
+        reported = pd.Series(reported, dtype=float)
+        index = pd.to_datetime(reported.index)
+        reported.index = index.tz_localize(None) if index.tz is not None else index
+        for i in np.flatnonzero(split_log[:, j]):
+            near = reported[(reported.index >= dates[i] - tolerance) & (reported.index <= dates[i] + tolerance)]
+            # A k-for-1 split divides the unadjusted price by k: a move of -log(k)
+            if len(near) and np.any(np.abs(-np.log(near.to_numpy()) - split_log[i, j]) < SNAP_TOLERANCE):
+                confirmed[i, j] = split_log[i, j]
+    return confirmed
+
+
+def validate_prices(price_data, reference_prices=None, splits=None):
+    """
+    Checks and repairs a close-price matrix with column-wise numpy operations.
+
+    Detected per ticker:
+        gaps               missing closes between the first and last print
+        splits             persistent moves matching an integer split factor that `splits`
+                           confirms (history rescaled)
+        unconfirmed_splits split-like moves with no reported split: flagged, prices kept
+                           (the input is already split-adjusted, so these are usually real moves)
+        scale_jumps        persistent 100x moves, e.g. a GBp/GBP unit change (history rescaled)
+        spikes             one-day moves that fully revert (the bad print is dropped)
+        jumps              other moves beyond JUMP_RATIO (kept, but lower the score)
+        stale_days         closes repeated STALE_RUN days or more
+        currency_mismatch  last close disagrees with `reference_prices` by CURRENCY_TOLERANCE
+
+    The score reflects all of the above. Only broken data is quarantined (removed from
+    the returned frame): too few observations, a currency mismatch, or gaps and stale
+    quotes alone scoring below QUARANTINE_BELOW. Volatile tickers with many jumps keep
+    their prices and are recorded with a low score instead.
+
+    Args:
+        price_data (pd.DataFrame): close prices (index=Date, columns=Tickers)
+        reference_prices (dict | pd.Series): optional independent quotes in the same currency
+        splits (dict | callable): reported splits {ticker: pd.Series(ratio, index=date)}, or a
+            function of a ticker list returning that dict; only called for tickers with
+            split-like moves. Without it no split is repaired.
+
+    Returns:
+        pd.DataFrame: repaired prices without quarantined tickers
+        pd.DataFrame: per-ticker report (REPORT_COLUMNS), indexed by ticker
+    """
+    if price_data is None or price_data.empty:
+        return price_data, pd.DataFrame(columns=REPORT_COLUMNS)
+
+    with instrumentation.timer("price_validation.validate_prices"):
+        prices = price_data.sort_index()
+        prices = prices.loc[:, ~prices.columns.duplicated()]
+        values = prices.to_numpy(dtype=float, copy=True)
+        values[~np.isfinite(values) | (values <= 0)] = np.nan
+        tickers = prices.columns
+
+        present = ~np.isnan(values)
+        n_obs = present.sum(axis=0)
+        after_first = np.maximum.accumulate(present, axis=0)
+        before_last = np.maximum.accumulate(present[::-1], axis=0)[::-1]
+        interior = after_first & before_last
+        gaps = interior & ~present
+
+        # Day-over-day log moves between consecutive prints (holes bridged)
+        carried = pd.DataFrame(values).ffill().to_numpy()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_r = np.log(carried[1:] / carried[:-1])
+        log_r = np.where(present[1:] & np.isfinite(log_r), log_r, 0.0)
+
+        big = np.abs(log_r) > np.log(JUMP_RATIO)
+        # Spike: a big move immediately undone by the next print
+        reverted = np.zeros_like(big)
+        reverted[:-1] = big[:-1] & big[1:] & (np.abs(log_r[:-1] + log_r[1:]) < SNAP_TOLERANCE)
+        spike_rows = np.zeros_like(present)
+        spike_rows[1:] = reverted
+
+        persistent = big & ~reverted
+        persistent[1:] &= ~reverted[:-1]
+        split_like = np.where(persistent, _snap(log_r, SPLIT_FACTORS), 0.0)
+        scale_log = np.where(persistent & (split_like == 0), _snap(log_r, SCALE_FACTORS), 0.0)
+        split_log = np.zeros_like(split_like)
+        candidates = tickers[(split_like != 0).any(axis=0)]
+        if splits is not None and len(candidates):
+            reported = splits(list(candidates)) if callable(splits) else splits
+            split_log = _confirmed(split_like, prices.index[1:], tickers, reported or {})
+        unconfirmed = (split_like != 0) & (split_log == 0)
+        event_log = split_log + scale_log
+        jumps = persistent & (event_log == 0) & ~unconfirmed
+
+        # Rescale everything before each split/scale event by the event factor:
+        # row t is multiplied by the product of all event factors after it.
+        after = np.cumsum(event_log[::-1], axis=0)[::-1]
+        adjust = np.vstack([after, np.zeros((1, values.shape[1]))])
+        repaired = values * np.exp(adjust)
+        repaired[spike_rows] = np.nan
+
+        same = np.zeros_like(present)
+        same[1:] = present[1:] & present[:-1] & (values[1:] == values[:-1])
+        run = _run_lengths(same)
+        stale = run >= STALE_RUN - 1
+        last_row = np.where(n_obs > 0, values.shape[0] - 1 - np.argmax(present[::-1], axis=0), 0)
+        stale_tail = run[last_row, np.arange(values.shape[1])] >= STALE_RUN - 1
+
+        repaired_df = pd.DataFrame(repaired, index=prices.index, columns=tickers)
+        # Fill interior holes only (never extend a series past its last print)
+        filled_df = repaired_df.ffill(limit=GAP_FILL_LIMIT).where(interior)
+        filled = filled_df.notna().to_numpy() & np.isnan(repaired)
+
+        mismatch = np.zeros(len(tickers), dtype=bool)
+        if reference_prices is not None:
+            ref = pd.Series(reference_prices, dtype=float).reindex(tickers).to_numpy()
+            last = repaired_df.ffill().iloc[-1].to_numpy()
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = np.abs(np.log(last / ref))
+            mismatch = np.isfinite(ratio) & (ratio > np.log(CURRENCY_TOLERANCE))
+
+        span = np.maximum(interior.sum(axis=0), 1)
+        report = pd.DataFrame({
+            "observations": n_obs,
+            "gaps": gaps.sum(axis=0),
+            "filled": filled.sum(axis=0),
+            "stale_days": stale.sum(axis=0),
+            "stale_tail": stale_tail,
+            "splits": (split_log != 0).sum(axis=0),
+            "unconfirmed_splits": unconfirmed.sum(axis=0),
+            "scale_jumps": (scale_log != 0).sum(axis=0),
+            "spikes": spike_rows.sum(axis=0),
+            "jumps": jumps.sum(axis=0),
+            "currency_mismatch": mismatch,
+        }, index=tickers)
+
+        integrity_penalty = (
+            (report["gaps"] - report["filled"]).clip(lower=0) / span
+            + report["stale_days"] / span
+            + 0.3 * report["stale_tail"]
+        )
+        volatility_penalty = (
+            0.1 * report["jumps"]
+            + 0.05 * report["unconfirmed_splits"]
+            + 0.02 * (report["splits"] + report["scale_jumps"] + report["spikes"])
+        )
+        broken = (report["observations"] < MIN_OBSERVATIONS) | report["currency_mismatch"]
+        score = (1.0 - integrity_penalty - volatility_penalty).clip(lower=0.0, upper=1.0)
+        score[broken] = 0.0
+        report["score"] = score.round(4)
+        report["quarantined"] = broken | (1.0 - integrity_penalty < QUARANTINE_BELOW)
+
+        clean = filled_df.loc[:, ~report["quarantined"].to_numpy()]
+
+    instrumentation.increment("price_validation.tickers", len(tickers))
+    instrumentation.increment("price_validation.quarantined", int(report["quarantined"].sum()))
+    instrumentation.increment("price_validation.low_quality", int((~report["quarantined"] & (report["score"] < QUARANTINE_BELOW)).sum()))
+    instrumentation.increment("price_validation.repaired_events", int((report["splits"] + report["scale_jumps"] + report["spikes"]).sum()))
+    instrumentation.increment("price_validation.unconfirmed_splits", int(report["unconfirmed_splits"].sum()))
+    return clean, report
+
+
+def valid_quotes(quotes):
+    """
+    Drops missing, non-finite and non-positive scalar quotes in one pass.
+
+    Returns:
+        dict: {ticker: float price}
+    """
+    s = pd.to_numeric(pd.Series(quotes, dtype=object), errors="coerce").astype(float)
+    s = s[np.isfinite(s) & (s > 0)]
+    return s.to_dict()
+
+
+def record_report(report):
+    """
+    Stores the quality scores as 'quality' observations in the catalog.
+    """
+    if report is None or report.empty:
+        return 0
+    return catalog.try_record_observations('quality', report["score"].to_dict(), currency="", source="price_validation")
+
+
+def latest_quality(tickers=None):
+    """
+    Most recent quality score per ticker from the catalog: {ticker: score}.
+    """
+    try:
+        rows = catalog.latest_observations('quality', tickers)
+    except Exception as e:
+        instrumentation.record_error("price_validation.latest_quality", "catalog", e)
+        return {}
+    return {t: v for t, (v, _) in rows.items()}
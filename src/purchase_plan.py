@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+import instrumentation
+import theme_index
+
+
+def _lookup_prices(tickers, prices):
+    # Same lookup rule the app has always used: exact key, then 'BRK.B' -> 'BRK-B'
+    return np.array(
+        [prices.get(t) or prices.get(t.replace('.', '-'), 0) or 0 for t in tickers],
+        dtype=float
+    )
+
+
+def _redistribute_cash(shares, targets, price_vec, cash, buyable):
+    """
+    Residual-cash pass for whole-share mode, vectorized across accounts.
+
+    After flooring, every position is short of its target by less than one share.
+    Buying one more share of name i changes the squared tracking error by
+    p_i * (p_i - 2 * deficit_i), so only names with deficit > p/2 improve it and
+    each of them is bought at most once. The greedy walks those names from the
+    largest improvement down, buying whatever still fits in the remaining cash.
+    Each round buys the longest affordable prefix of that order for every account,
+    then drops names that no longer fit; this is equivalent to the sequential walk.
+    """
+    n_accounts = shares.shape[0]
+    rows = np.arange(n_accounts)[:, None]
+    deficit = targets - shares * price_vec
+    gain = price_vec * (price_vec - 2.0 * deficit)
+    eligible = buyable & (gain < 0)
+
+    while True:
+        eligible &= price_vec <= cash[:, None]
+        if not eligible.any():
+            break
+        instrumentation.increment("purchase_plan.redistribution_rounds")
+
+        masked_gain = np.where(eligible, gain, np.inf)
+        order = np.argsort(masked_gain, axis=1, kind="stable")
+        sorted_eligible = np.take_along_axis(eligible, order, axis=1)
+        sorted_cost = np.where(sorted_eligible, price_vec[order], np.inf)
+        buy_sorted = sorted_eligible & (np.cumsum(sorted_cost, axis=1) <= cash[:, None])
+        if not buy_sorted.any():
+            break
+
+        buy = np.zeros_like(eligible)
+        buy[np.broadcast_to(rows, order.shape)[buy_sorted], order[buy_sorted]] = True
+        shares += buy
+        cash -= (buy * price_vec).sum(axis=1)
+        eligible &= ~buy
+
+    return shares, cash
+
+
+@instrumentation.timed("purchase_plan.compute_purchase_plan")
+def compute_purchase_plan(final_weights, prices, investments, allow_fractional=True, redistribute=True):
+    """
+    Sizes orders for one or many account sizes against the same target weights.
+
+    Args:
+        final_weights (dict): {ticker: weight_percentage} from calculate_consolidated_weights
+        prices (dict): {ticker: latest_price} from data_loader.get_latest_prices
+        investments (float | list): one total investment or a list (one per account)
+        allow_fractional (bool): fractional shares (6 decimals) instead of whole shares
+        redistribute (bool): in whole-share mode, spend the leftover cash on the names
+            that reduce tracking error the most
+
+    Returns:
+        dict: {
+            "tickers": list of N tickers,
+            "prices": (N,) prices (0 where missing),
+            "weights": (N,) target weights in %,
+            "investments": (K,) account sizes,
+            "shares": (K, N) shares to buy,
+            "cost": (K, N) cost per position,
+            "cash": (K,) uninvested cash,
+            "tracking_error": (K,) L2 distance between held and target weights (in %),
+            "missing": tickers without a usable price,
+        }
+    """
+    tickers = list(final_weights.keys())
+    weight_vec = np.array([final_weights[t] for t in tickers], dtype=float)
+    price_vec = _lookup_prices(tickers, prices)
+    investments = np.atleast_1d(np.asarray(investments, dtype=float))
+
+    buyable = price_vec > 0
+    safe_price = np.where(buyable, price_vec, 1.0)
+
+    # (K, N) target dollar amount per position
+    targets = investments[:, None] * (weight_vec / 100.0)[None, :]
+
+    if allow_fractional:
+        shares = np.where(buyable, np.round(targets / safe_price, 6), 0.0)
+    else:
+        shares = np.where(buyable, np.floor(targets / safe_price), 0.0)
+
+    cost = shares * price_vec
+    cash = investments - cost.sum(axis=1)
+
+    if not allow_fractional and redistribute and len(tickers):
+        shares, cash = _redistribute_cash(shares, targets, price_vec, cash, np.broadcast_to(buyable, shares.shape).copy())
+        cost = shares * price_vec
+
+    safe_inv = np.where(investments > 0, investments, 1.0)
+    held_weights = cost / safe_inv[:, None] * 100.0
+    tracking_error = np.sqrt(((held_weights - weight_vec[None, :]) ** 2).sum(axis=1))
+
+    return {
+        "tickers": tickers,
+        "prices": price_vec,
+        "weights": weight_vec,
+        "investments": investments,
+        "shares": shares,
+        "cost": cost,
+        "cash": cash,
+        "tracking_error": tracking_error,
+        "missing": [t for t, ok in zip(tickers, buyable) if not ok],
+    }
+
+
+def plan_frames(plan, account=0, stock_cap_details=None):
+    """
+    Builds the display/order-sheet tables for one account of a plan.
+
+    Returns:
+        pd.DataFrame: buy list (Ticker, Shares, Price ($), Cost ($), Weight (%), Sectors)
+        pd.DataFrame: skipped list (Ticker, Price ($), Required ($), Allocated ($))
+    """
+    tickers = np.asarray(plan["tickers"], dtype=object)
+    shares = plan["shares"][account]
+    price_vec = plan["prices"]
+    allocated = plan["investments"][account] * plan["weights"] / 100.0
+
+    bought = shares > 0
+    skipped = (price_vec > 0) & ~bought
+
+    df_buy = pd.DataFrame({
+        "Ticker": tickers[bought],
+        "Shares": shares[bought],
+        "Price ($)": price_vec[bought],
+        "Cost ($)": plan["cost"][account][bought],
+        "Weight (%)": plan["weights"][bought],
+    })
+    sectors = theme_index.sectors_by_stock(stock_cap_details or {})
+    df_buy["Sectors"] = sectors.reindex(df_buy["Ticker"]).fillna("").to_numpy()
+    df_buy = df_buy.sort_values("Cost ($)", ascending=False)
+
+    df_skipped = pd.DataFrame({
+        "Ticker": tickers[skipped],
+        "Price ($)": price_vec[skipped],
+        "Required ($)": price_vec[skipped],
+        "Allocated ($)": allocated[skipped],
+    })
+    return df_buy, df_skipped
@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+import data_loader
+import catalog
+import instrumentation
+
+
+def read_holdings(file):
+    """
+    Reads current positions from a CSV path or file-like object.
+    Expects columns `Ticker` and `Shares` (case-insensitive).
+
+    Returns:
+        pd.Series: shares indexed by normalized ticker (duplicates summed)
+    """
+    holdings = pd.read_csv(file)
+    holdings.columns = [str(c).strip().lower() for c in holdings.columns]
+    missing = {"ticker", "shares"} - set(holdings.columns)
+    if missing:
+        raise ValueError(f"Holdings file is missing columns: {', '.join(sorted(missing))}")
+
+    holdings = holdings.dropna(subset=["ticker"])
+    shares = pd.to_numeric(holdings["shares"], errors="coerce").fillna(0.0)
+    symbols = holdings["ticker"].astype(str).map(data_loader.normalize_ticker)
+    return shares.groupby(symbols.to_numpy()).sum()
+
+
+def _symbol_series(values_by_ticker):
+    # Key everything by the normalized symbol so 'BRK.B' / 'BRK-B' / names join on one ID
+    s = pd.Series(values_by_ticker, dtype=float)
+    if s.empty:
+        return s
+    return s.groupby(s.index.map(data_loader.normalize_ticker)).first()
+
+
+def last_known_prices(tickers):
+    """
+    Last price recorded in the catalog per ticker, for positions without a live quote.
+    """
+    try:
+        recorded = catalog.latest_observations('price', tickers)
+    except Exception as e:
+        instrumentation.record_error("rebalance.last_known_prices", "price", e)
+        return {}
+    return {t: v for t, (v, _) in recorded.items()}
+
+
+@instrumentation.timed("rebalance.compute_rebalance_trades")
+def compute_rebalance_trades(holdings, final_weights, prices, tolerance=0.5, cash=0.0, allow_fractional=True,
+                             last_prices=None):
+    """
+    Minimal trade list that brings current holdings back to the target weights.
+
+    Only positions whose weight drifted more than `tolerance` percentage points
+    from target are traded (to their target). Buys are funded by the sells plus
+    `cash`; if that is not enough, buys are scaled down pro rata.
+
+    A held position without a live price is valued at its last known price (and
+    not traded); without one the NAV is unknown and no plan is made.
+
+    Args:
+        holdings (pd.Series): current shares indexed by ticker (see read_holdings)
+        final_weights (dict): {ticker: weight_percentage}
+        prices (dict): {ticker: latest_price}
+        tolerance (float): band in percentage points around each target weight
+        cash (float): uninvested cash available for buys
+        last_prices (dict): {ticker: last_known_price} (see last_known_prices)
+
+    Returns:
+        pd.DataFrame: one row per traded symbol
+        dict: summary (NAV, cash before/after, untradeable symbols, symbols valued at a last known price)
+
+    Raises:
+        ValueError: held positions have neither a live nor a last known price
+    """
+    targets = _symbol_series(final_weights)
+    price_s = _symbol_series(prices)
+    last_s = _symbol_series(last_prices or {})
+    original = pd.Series({data_loader.normalize_ticker(t): t for t in final_weights}, dtype=object)
+
+    current = holdings.copy()
+    current.index = current.index.map(data_loader.normalize_ticker)
+    current = current.groupby(level=0).sum()
+
+    # Indexed outer join over symbol IDs
+    book = pd.concat({"Current Shares": current, "Target Weight (%)": targets}, axis=1, join="outer")
+    book = book.fillna(0.0)
+    book["Price ($)"] = price_s.reindex(book.index)
+    book["Ticker"] = original.reindex(book.index).fillna(pd.Series(book.index, index=book.index))
+
+    priced = book["Price ($)"].notna() & (book["Price ($)"] > 0)
+    held = book["Current Shares"] != 0
+    last = last_s.reindex(book.index)
+    stale = ~priced & held & last.notna() & (last > 0)
+    # Stale-valued holdings are reported under last_known_price only
+    untradeable = book.index[~priced & ~stale & (held | (book["Target Weight (%)"] > 0))].tolist()
+    unvalued = book.index[~priced & held & ~stale].tolist()
+    if unvalued:
+        raise ValueError(f"No price for {len(unvalued)} held positions, so the portfolio value is unknown: {', '.join(unvalued)}")
+    if stale.any():
+        instrumentation.increment("rebalance.last_known_price", int(stale.sum()))
+
+    price = book["Price ($)"].where(priced, 0.0).to_numpy()
+    cur_shares = book["Current Shares"].to_numpy()
+    cur_value = cur_shares * np.where(stale, last.fillna(0.0), price)
+    nav = cur_value.sum() + cash
+
+    target_w = book["Target Weight (%)"].to_numpy()
+    cur_w = cur_value / nav * 100.0 if nav > 0 else np.zeros_like(cur_value)
+    drift = cur_w - target_w
+
+    trade = priced.to_numpy() & (np.abs(drift) > tolerance)
+    safe_price = np.where(priced, price, 1.0)
+    raw_shares = np.where(trade, (target_w / 100.0 * nav - cur_value) / safe_price, 0.0)
+
+    # Sells are rounded first (never more than held), then they fund the buys together with cash
+    sells = np.where(raw_shares < 0, raw_shares, 0.0)
+    sells = np.round(sells, 6) if allow_fractional else np.ceil(sells)
+    sells = np.maximum(sells, -cur_shares)
+
+    buys = np.where(raw_shares > 0, raw_shares, 0.0)
+    available = cash - (sells * price).sum()
+    buy_cost = (buys * price).sum()
+    if buy_cost > available and buy_cost > 0:
+        buys *= max(available, 0.0) / buy_cost
+    buys = np.floor(buys * 1e6) / 1e6 if allow_fractional else np.floor(buys)
+
+    trade_shares = sells + buys
+
+    book["Current Weight (%)"] = cur_w
+    book["Drift (%p)"] = drift
+    book["Trade Shares"] = trade_shares
+    book["Trade Value ($)"] = trade_shares * price
+    book["Action"] = np.where(trade_shares > 0, "BUY", "SELL")
+
+    trades = book[trade_shares != 0]
+    trades = trades[["Ticker", "Action", "Trade Shares", "Price ($)", "Trade Value ($)",
+                     "Current Shares", "Current Weight (%)", "Target Weight (%)", "Drift (%p)"]]
+    trades = trades.reindex(trades["Trade Value ($)"].abs().sort_values(ascending=False).index)
+
+    summary = {
+        "nav": float(nav),
+        "cash_before": float(cash),
+        "cash_after": float(cash - book["Trade Value ($)"].sum()),
+        "turnover": float(book["Trade Value ($)"].abs().sum()),
+        "in_band": int((~trade & priced.to_numpy() & ((cur_shares != 0) | (target_w > 0))).sum()),
+        "untradeable": untradeable,
+        "last_known_price": book.index[stale].tolist(),
+    }
+    return trades.reset_index(drop=True), summary
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import threading
+import instrumentation
+
+CACHE_DIR = os.environ.get("ETF_RESULT_CACHE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'cache', 'results'
+)
+MAX_BYTES = int(os.environ.get("ETF_RESULT_CACHE_MAX_BYTES", 64 * 2**20))
+
+_lock = threading.Lock()
+
+
+def _canonical(value):
+    # JSON-able, order-independent form of dicts/sets/tuples for hashing
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (set, frozenset)):
+        return sorted(_canonical(v) for v in value)
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def fingerprint(*parts):
+    """
+    Content hash of the inputs (dict key order does not matter).
+    """
+    payload = json.dumps([_canonical(p) for p in parts], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def _path(namespace, key, cache_dir=None):
+    return os.path.join(cache_dir or CACHE_DIR, f"{namespace}-{key}.pkl")
+
+
+def get(namespace, key, max_age_seconds=None, cache_dir=None):
+    """
+    Stored result or None. A hit refreshes the file's mtime, which is the
+    recency the eviction goes by.
+    """
+    path = _path(namespace, key, cache_dir)
+    try:
+        with open(path, 'rb') as f:
+            entry = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        instrumentation.increment(f"result_cache.{namespace}.miss")
+        return None
+    if max_age_seconds is not None and time.time() - entry["created_at"] > max_age_seconds:
+        instrumentation.increment(f"result_cache.{namespace}.expired")
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    instrumentation.increment(f"result_cache.{namespace}.hit")
+    return entry["value"]
+
+
+def put(namespace, key, value, cache_dir=None, max_bytes=None):
+    """
+    Stores a result atomically (temp file + rename), then evicts least recently
+    used entries until the directory is within max_bytes.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    path = _path(namespace, key, cache_dir)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump({"created_at": time.time(), "value": value}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError as e:
+        instrumentation.record_error("result_cache.put", namespace, e)
+        return
+    evict(max_bytes if max_bytes is not None else MAX_BYTES, cache_dir)
+
+
+def evict(max_bytes=None, cache_dir=None):
+    """
+    Deletes the least recently used entries until the cache fits in max_bytes.
+
+    Returns:
+        int: number of entries removed
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    max_bytes = max_bytes if max_bytes is not None else MAX_BYTES
+    with _lock:
+        try:
+            entries = []
+            for entry in os.scandir(cache_dir):
+                if entry.name.endswith(".pkl"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            return 0
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+    if removed:
+        instrumentation.increment("result_cache.evicted", removed)
+    return removed
+
+
+def clear(namespace=None, cache_dir=None):
+    """
+    Deletes every entry (or only those of `namespace`).
+
+    Returns:
+        int: number of entries removed
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    prefix = f"{namespace}-" if namespace else ""
+    removed = 0
+    with _lock:
+        try:
+            names = os.listdir(cache_dir)
+        except OSError:
+            return 0
+        for name in names:
+            if name.endswith(".pkl") and name.startswith(prefix):
+                try:
+                    os.remove(os.path.join(cache_dir, name))
+                    removed += 1
+                except OSError:
+                    continue
+    return removed
+
+
+def memoize(namespace, key, compute, max_age_seconds=None):
+    """
+    get() or compute() + put().
+    """
+    value = get(namespace, key, max_age_seconds)
+    if value is None:
+        value = compute()
+        put(namespace, key, value)
+    return value
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+import instrumentation
+
+FILL_POLICIES = ("ffill", "none")
+MASK_POLICIES = ("zero", "renormalize")
+
+
+class ReturnMatrix:
+    """
+    Universe-level daily return matrix, built once per price refresh.
+
+    Mixed-exchange universes (9984.T, 000660.KS, BHP.AX ...) trade on different
+    calendars. Instead of dropping every date where any market was closed, the
+    matrix keeps the union calendar and records which cells are real:
+
+        observed[t, i]  the ticker printed a price on date t
+        valid[t, i]     the return on date t is usable (both ends priced after filling)
+
+    Backtests slice columns by index and never recompute pct_change.
+
+    Args:
+        price_data (pd.DataFrame): close prices (index=Date, columns=Tickers)
+        fill (str): 'ffill' carries the last price over closed days (up to fill_limit
+            rows), so a holiday shows a 0% return and the move lands on the next open day;
+            'none' leaves holidays as invalid cells
+        fill_limit (int): max consecutive rows to forward-fill
+    """
+
+    def __init__(self, price_data, fill="ffill", fill_limit=5):
+        if fill not in FILL_POLICIES:
+            raise ValueError(f"Unknown fill policy '{fill}', expected one of {FILL_POLICIES}")
+
+        with instrumentation.timer("return_matrix.build"):
+            prices = price_data.sort_index().dropna(how="all")
+            # Keep the first occurrence of duplicated tickers
+            prices = prices.loc[:, ~prices.columns.duplicated()]
+
+            observed = prices.notna().to_numpy()
+            if fill == "ffill":
+                prices = prices.ffill(limit=fill_limit)
+
+            values = prices.to_numpy(dtype=float)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                returns = values[1:] / values[:-1] - 1.0
+            valid = np.isfinite(returns)
+
+            self.fill = fill
+            self.fill_limit = fill_limit
+            self.dates = prices.index[1:]
+            self.tickers = list(prices.columns)
+            self.returns = np.where(valid, returns, 0.0)
+            self.valid = valid
+            self.observed = observed[1:]
+            self._col = {t: i for i, t in enumerate(self.tickers)}
+
+    @property
+    def shape(self):
+        return self.returns.shape
+
+    def columns_for(self, tickers):
+        """
+        Column indices of the tickers present in the matrix (unknown tickers are skipped).
+        """
+        return np.array([self._col[t] for t in tickers if t in self._col], dtype=int)
+
+    def price_column(self, ticker):
+        """
+        Column holding a composition ticker's prices, or None. Compositions use
+        'BRK.B', Yahoo uses 'BRK-B'; exchange suffixes ('7203.T') match as they are.
+        """
+        if ticker in self._col:
+            return ticker
+        alt = ticker.replace('.', '-')
+        return alt if alt in self._col else None
+
+    def coverage(self):
+        """
+        Fraction of valid return cells per ticker.
+        """
+        return pd.Series(self.valid.mean(axis=0) if len(self.dates) else 0.0, index=self.tickers)
+
+    def to_frame(self, tickers=None, masked=True):
+        """
+        Returns as a DataFrame; invalid cells are NaN when masked=True.
+        """
+        idx = self.columns_for(tickers) if tickers is not None else np.arange(len(self.tickers))
+        data = self.returns[:, idx]
+        if masked:
+            data = np.where(self.valid[:, idx], data, np.nan)
+        return pd.DataFrame(data, index=self.dates, columns=[self.tickers[i] for i in idx])
+
+    def dead_tickers(self, tickers):
+        """
+        Tickers without a single valid return (not downloaded, delisted, failed fetch).
+        """
+        any_valid = self.valid.any(axis=0) if len(self.dates) else np.zeros(len(self.tickers), dtype=bool)
+        return [t for t in tickers if t not in self._col or not any_valid[self._col[t]]]
+
+    def portfolio_returns(self, weights, mask="zero"):
+        """
+        Daily and cumulative portfolio returns for {ticker: weight}.
+
+        Dead tickers (see dead_tickers(), which callers use to report them) are left
+        out and their weight is spread pro rata over the rest, so the portfolio stays
+        fully invested. The series starts on the first date where every remaining
+        ticker has a valid return. After that, invalid cells are handled by `mask`:
+            'zero'         the position contributes 0 that day
+            'renormalize'  that day's weights are rescaled over the valid positions
+
+        Returns:
+            pd.Series: cumulative return
+            pd.Series: daily return
+        """
+        if mask not in MASK_POLICIES:
+            raise ValueError(f"Unknown mask policy '{mask}', expected one of {MASK_POLICIES}")
+
+        dead = set(self.dead_tickers(weights.keys()))
+        selected = [t for t in weights.keys() if t not in dead]
+        if not selected:
+            return pd.Series(dtype=float), pd.Series(dtype=float)
+        if dead:
+            instrumentation.increment("return_matrix.dead_tickers", len(dead))
+
+        idx = self.columns_for(selected)
+        w = np.array([weights[t] for t in selected], dtype=float)
+        if dead and w.sum() != 0:
+            w *= sum(weights.values()) / w.sum()
+        valid = self.valid[:, idx]
+        start = int(valid.argmax(axis=0).max())
+
+        R = self.returns[start:, idx]
+        V = valid[start:]
+        daily = R @ w
+        if mask == "renormalize":
+            live = V @ w
+            with np.errstate(divide="ignore", invalid="ignore"):
+                daily = np.where(live != 0, daily * (w.sum() / live), 0.0)
+
+        daily = pd.Series(daily, index=self.dates[start:])
+        cumulative = (1 + daily).cumprod() - 1
+        return cumulative, daily
+
+
+@st.cache_resource(max_entries=4)
+def build_return_matrix(price_data, fill="ffill", fill_limit=5):
+    """
+    Cached ReturnMatrix for a price frame. cache_resource keeps one shared instance
+    per price refresh instead of pickling a copy per session.
+    """
+    return ReturnMatrix(price_data, fill=fill, fill_limit=fill_limit)
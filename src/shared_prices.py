@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+import instrumentation
+
+# Host-wide location of the shared matrices. /dev/shm keeps them in RAM on Linux.
+SHARED_DIR = os.environ.get("ETF_SHARED_PRICE_DIR") or (
+    os.path.join("/dev/shm", "etf_prices") if os.path.isdir("/dev/shm")
+    else os.path.join(tempfile.gettempdir(), "etf_prices")
+)
+
+
+class SharedPriceMatrix:
+    """
+    Read-only view of a published price matrix.
+
+    `values` is a memory-mapped (dates x tickers) array; every process that attaches
+    the same key shares the same physical pages, nothing is copied or unpickled.
+    """
+
+    def __init__(self, key, values, tickers, dates, published_at=None):
+        self.key = key
+        self.published_at = published_at
+        self.values = values
+        self.tickers = tickers
+        self.dates = dates
+        self._col = {t: i for i, t in enumerate(tickers)}
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    def column(self, ticker):
+        return self.values[:, self._col[ticker]]
+
+    def frame(self):
+        """
+        DataFrame wrapping the shared array without copying it.
+        """
+        return pd.DataFrame(self.values, index=self.dates, columns=self.tickers, copy=False)
+
+
+def _paths(key):
+    return os.path.join(SHARED_DIR, f"{key}.npy"), os.path.join(SHARED_DIR, f"{key}.json")
+
+
+def _pointer_path(name):
+    safe = hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(SHARED_DIR, f"latest-{safe}.json")
+
+
+def _content_key(price_data, dtype):
+    h = hashlib.sha1()
+    h.update(np.dtype(dtype).str.encode())
+    h.update("\x1f".join(map(str, price_data.columns)).encode('utf-8'))
+    h.update(pd.to_datetime(price_data.index).as_unit("ns").asi8.tobytes())
+    h.update(np.ascontiguousarray(price_data.to_numpy(dtype=dtype)).tobytes())
+    return h.hexdigest()[:24]
+
+
+def publish_price_matrix(price_data, name=None, dtype="float64"):
+    """
+    Writes the price frame once per host as an .npy file plus a ticker/date index.
+    The file name is a content hash, so publishing identical data is a no-op.
+    If `name` is given, it is pointed at the new key so other processes can attach by name.
+
+    Returns:
+        str: key of the published matrix
+    """
+    os.makedirs(SHARED_DIR, exist_ok=True)
+    key = _content_key(price_data, dtype)
+    npy_path, meta_path = _paths(key)
+
+    if not (os.path.exists(npy_path) and os.path.exists(meta_path)):
+        with instrumentation.timer("shared_prices.publish"):
+            tmp_npy = f"{npy_path}.{os.getpid()}.tmp"
+            arr = np.lib.format.open_memmap(tmp_npy, mode="w+", dtype=dtype, shape=price_data.shape)
+            arr[:] = price_data.to_numpy(dtype=dtype)
+            arr.flush()
+            del arr
+            os.replace(tmp_npy, npy_path)
+
+            meta = {
+                "tickers": [str(c) for c in price_data.columns],
+                "dates": pd.to_datetime(price_data.index).as_unit("ns").asi8.tolist(),
+                "tz": str(getattr(price_data.index, "tz", None) or ""),
+                "dtype": np.dtype(dtype).str,
+                "created_at": time.time(),
+            }
+            tmp_meta = f"{meta_path}.{os.getpid()}.tmp"
+            with open(tmp_meta, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(tmp_meta, meta_path)
+
+    if name:
+        tmp_ptr = f"{_pointer_path(name)}.{os.getpid()}.tmp"
+        with open(tmp_ptr, 'w', encoding='utf-8') as f:
+            json.dump({"name": name, "key": key, "updated_at": time.time()}, f)
+        os.replace(tmp_ptr, _pointer_path(name))
+
+    return key
+
+
+def attach_price_matrix(key=None, name=None):
+    """
+    Attaches to a published matrix by key (or by the name it was published under).
+    Returns None if nothing has been published yet.
+    """
+    published_at = None
+    if key is None and name is not None:
+        try:
+            with open(_pointer_path(name), 'r', encoding='utf-8') as f:
+                pointer = json.load(f)
+            key, published_at = pointer["key"], pointer.get("updated_at")
+        except (OSError, ValueError, KeyError):
+            return None
+    if key is None:
+        return None
+
+    npy_path, meta_path = _paths(key)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        values = np.load(npy_path, mmap_mode="r")
+    except (OSError, ValueError) as e:
+        instrumentation.record_error("shared_prices.attach", key, e)
+        return None
+
+    instrumentation.increment("shared_prices.attach")
+    dates = pd.to_datetime(np.array(meta["dates"], dtype="int64"))
+    if meta.get("tz"):
+        dates = dates.tz_localize("UTC").tz_convert(meta["tz"])
+    return SharedPriceMatrix(key, values, meta["tickers"], dates, published_at or meta.get("created_at"))
+
+
+def prune(max_age_seconds=3 * 24 * 3600):
+    """
+    Deletes name pointers not updated within `max_age_seconds`, then the published
+    matrices older than that which no remaining name points to.
+    Processes that still have them mapped keep working (the pages live until unmapped).
+    """
+    if not os.path.isdir(SHARED_DIR):
+        return 0
+
+    removed = 0
+    now = time.time()
+    referenced = set()
+    for fname in os.listdir(SHARED_DIR):
+        if fname.startswith("latest-") and fname.endswith(".json"):
+            path = os.path.join(SHARED_DIR, fname)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    pointer = json.load(f)
+                updated_at = pointer.get("updated_at") or os.path.getmtime(path)
+                if now - updated_at > max_age_seconds:
+                    os.remove(path)
+                    removed += 1
+                    continue
+                referenced.add(pointer["key"])
+            except (OSError, ValueError, KeyError):
+                continue
+
+    for fname in os.listdir(SHARED_DIR):
+        key, ext = os.path.splitext(fname)
+        if ext not in (".npy", ".json") or fname.startswith("latest-") or key in referenced:
+            continue
+        path = os.path.join(SHARED_DIR, fname)
+        try:
+            if now - os.path.getmtime(path) > max_age_seconds:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            # Another process pruned it first
+            continue
+    if removed:
+        instrumentation.increment("shared_prices.pruned", removed)
+    return removed
@@ -0,0 +1,295 @@
+import numpy as np
+import pandas as pd
+import instrumentation
+import fx_service
+import theme_index
+import attribution
+import data_loader
+from return_matrix import ReturnMatrix, build_return_matrix
+
+# Peak-to-trough windows of past drawdowns (closes of the first and last day)
+HISTORICAL_SCENARIOS = {
+    "2018 Q4 Selloff": ("2018-09-20", "2018-12-24"),
+    "2020 COVID Crash": ("2020-02-19", "2020-03-23"),
+    "2022 Rate Shock": ("2022-01-03", "2022-10-12"),
+}
+# Holdings without their own history in a window take their source ETFs' move, then this one's
+MARKET_PROXY = "VOO"
+# Share of a window's days a ticker needs valid returns on to use its own history
+MIN_WINDOW_COVERAGE = 0.9
+HISTORY_PERIOD = "10y"
+
+# Factor shocks (returns as fractions):
+#   "market": r                   every holding
+#   "theme": {theme: r}           holdings sourced from any ETF of the theme
+#   "etf": {etf: r}               holdings sourced from that ETF
+#   "currency": {ccy: r}          holdings quoted in that currency (USD value)
+#   "fx": r                       every non-USD holding
+#   "stock": {ticker: r}
+# Within "theme" and "etf" a holding takes its most severe shock; dimensions add up.
+FACTOR_SCENARIOS = {
+    "Semiconductors -30%": {"theme": {"Semiconductor": -0.30}},
+    "AI & Robotics -25%": {"theme": {"AI & Robotics": -0.25}},
+    "Growth Themes -20%": {"theme": {t: -0.20 for t in theme_index.THEME_TABS if t != "Core Index"}},
+    "Market -20%": {"market": -0.20},
+    "USD +10%": {"fx": -0.10},
+    "Semis -30% & USD +10%": {"theme": {"Semiconductor": -0.30}, "fx": -0.10},
+}
+
+
+def _group_shocks(specs, dimension, membership, labels):
+    """
+    (scenarios x stocks) shocks of one grouped dimension ('theme' or 'etf'): each
+    stock takes the largest-magnitude shock among the shocked groups it belongs to.
+    Loops over the groups only; scenarios and stocks are vectorized.
+    Groups no holding belongs to (e.g. a theme without an ETF in the portfolio)
+    shock nothing and are counted as skipped.
+    """
+    col_of = {g: j for j, g in enumerate(labels)}
+    F = np.zeros((len(specs), len(labels)))
+    for i, spec in enumerate(specs):
+        for group, shock in spec.get(dimension, {}).items():
+            if group not in col_of:
+                instrumentation.increment(f"stress_test.{dimension}.skipped")
+                continue
+            F[i, col_of[group]] = shock
+    out = np.zeros((len(specs), membership.shape[0]))
+    for j in np.flatnonzero(F.any(axis=0)):
+        candidate = F[:, j:j + 1] * membership[:, j][None, :]
+        out = np.where(np.abs(candidate) > np.abs(out), candidate, out)
+    return out
+
+
+def factor_shocks(scenarios, stocks, stock_breakdown):
+    """
+    Per-stock returns of factor scenarios as one (scenarios x stocks) matrix.
+
+    Args:
+        scenarios (dict): {name: shock spec}, see FACTOR_SCENARIOS
+        stocks (list): universe tickers (composition symbols, e.g. 'BRK.B', '9984.T')
+        stock_breakdown (dict): {ticker: {etf: raw_score}} from calculate_consolidated_weights
+
+    Returns:
+        pd.DataFrame: shocks (index=scenario, columns=stocks), floored at -100%
+    """
+    specs = list(scenarios.values())
+    S, etfs = attribution.share_matrix(stocks, stock_breakdown)
+    M, themes = attribution.theme_matrix(etfs)
+    etf_member = (S.toarray() > 0).astype(float)
+    theme_member = ((S @ M).toarray() > 0).astype(float)
+
+    X = np.array([spec.get("market", 0.0) for spec in specs], dtype=float)[:, None] * np.ones((1, len(stocks)))
+    X += _group_shocks(specs, "theme", theme_member, themes)
+    X += _group_shocks(specs, "etf", etf_member, etfs)
+
+    ccy = np.array([fx_service.currency_for_ticker(t) for t in stocks], dtype=object)
+    foreign = (ccy != "USD").astype(float)
+    X += np.array([spec.get("fx", 0.0) for spec in specs], dtype=float)[:, None] * foreign[None, :]
+    col_of = {t: j for j, t in enumerate(stocks)}
+    for i, spec in enumerate(specs):
+        for currency, shock in spec.get("currency", {}).items():
+            X[i] += shock * (ccy == currency)
+        for ticker, shock in spec.get("stock", {}).items():
+            if ticker in col_of:
+                X[i, col_of[ticker]] += shock
+    return pd.DataFrame(np.maximum(X, -1.0), index=list(scenarios), columns=stocks)
+
+
+def _window_returns(matrix, columns, windows):
+    """
+    Compounded returns and valid-day coverage of `columns` over each (start, end)
+    window, from prefix sums of log returns: one subtraction per window.
+    """
+    idx = matrix.columns_for(columns)
+    R = matrix.returns[:, idx]
+    V = matrix.valid[:, idx].astype(float)
+    log_prefix = np.vstack([np.zeros((1, len(idx))), np.cumsum(np.log1p(np.maximum(R, -0.999999)), axis=0)])
+    valid_prefix = np.vstack([np.zeros((1, len(idx))), np.cumsum(V, axis=0)])
+
+    # Returns dated in (start, end] compound the close-to-close move
+    starts = matrix.dates.searchsorted(pd.DatetimeIndex([pd.Timestamp(s) for s, _ in windows]), side="right")
+    ends = matrix.dates.searchsorted(pd.DatetimeIndex([pd.Timestamp(e) for _, e in windows]), side="right")
+    days = (ends - starts).astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.expm1(log_prefix[ends] - log_prefix[starts])
+        coverage = (valid_prefix[ends] - valid_prefix[starts]) / days[:, None]
+    last = matrix.dates[-1] if len(matrix.dates) else pd.Timestamp.min
+    available = (days > 0) & (starts > 0) & np.array([pd.Timestamp(e) <= last for _, e in windows])
+    returns[~available] = np.nan
+    coverage[~available] = 0.0
+    return returns, coverage, available
+
+
+def historical_shocks(windows, stocks, stock_breakdown, price_data):
+    """
+    Per-stock returns over historical windows as one (scenarios x stocks) matrix.
+
+    Holdings without enough history in a window (listed later, data gaps) take the
+    raw-score weighted move of their source ETFs, or MARKET_PROXY's move.
+
+    Args:
+        windows (dict): {name: (start, end)}, see HISTORICAL_SCENARIOS
+        price_data (pd.DataFrame | ReturnMatrix): USD close prices covering the windows,
+            ideally including the source ETFs and MARKET_PROXY
+
+    Returns:
+        pd.DataFrame: shocks (index=scenario, columns=stocks); windows outside the price
+            history are dropped
+        pd.DataFrame: True where the stock's own history was used
+    """
+    matrix = price_data if isinstance(price_data, ReturnMatrix) else build_return_matrix(price_data)
+    names, bounds = list(windows), list(windows.values())
+    available_cols = set(matrix.tickers)
+    symbol = [data_loader.normalize_ticker(t) for t in stocks]
+    own_cols = [s if s in available_cols else None for s in symbol]
+
+    # One column per distinct symbol (own, source ETFs, market proxy), one pass over the windows
+    S, etfs = attribution.share_matrix(stocks, stock_breakdown)
+    columns = [c for c in dict.fromkeys(own_cols + etfs + [MARKET_PROXY]) if c in available_cols]
+    pos = {c: j for j, c in enumerate(columns)}
+    returns, coverage, available = _window_returns(matrix, columns, bounds)
+    usable = coverage >= MIN_WINDOW_COVERAGE
+
+    def take(cols):
+        j = np.array([pos.get(c, -1) for c in cols], dtype=int)
+        r = np.where(j >= 0, returns[:, j], np.nan)
+        ok = (j >= 0)[None, :] & usable[:, j]
+        return np.where(ok, r, np.nan), ok
+
+    own, own_ok = take(own_cols)
+    etf_r, etf_ok = take(etfs)
+    # Source-ETF proxy: share-weighted mean over the ETFs that have the window
+    Sd = S.toarray()
+    weight_ok = etf_ok.astype(float) @ Sd.T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        etf_proxy = (np.where(etf_ok, etf_r, 0.0) @ Sd.T) / weight_ok
+    market, _ = take([MARKET_PROXY])
+
+    X = np.where(own_ok, own, np.where(weight_ok > 0, etf_proxy, market))
+    keep = available & ~np.isnan(X).all(axis=1)
+    instrumentation.increment("stress_test.window_unavailable", int((~keep).sum()))
+    X = np.where(np.isnan(X), 0.0, X)
+    return (
+        pd.DataFrame(X[keep], index=np.array(names)[keep], columns=stocks),
+        pd.DataFrame(own_ok[keep], index=np.array(names)[keep], columns=stocks),
+    )
+
+
+def theme_shares(stocks, stock_breakdown):
+    """
+    Dense (stocks x themes) split of each stock's weight across theme tabs (rows sum
+    to 1, as in theme_index.exposures); stocks without a breakdown go to 'Other'.
+    """
+    S, etfs = attribution.share_matrix(stocks, stock_breakdown)
+    M, themes = attribution.theme_matrix(etfs)
+    T = (S @ M).toarray() if len(etfs) else np.zeros((len(stocks), 0))
+    orphan = T.sum(axis=1) == 0
+    if orphan.any():
+        if "Other" not in themes:
+            themes = themes + ["Other"]
+            T = np.hstack([T, np.zeros((len(stocks), 1))])
+        T[orphan, themes.index("Other")] = 1.0
+    return T, themes
+
+
+@instrumentation.timed("stress_test.run_scenarios")
+def run_scenarios(portfolios, shocks, stock_breakdown, covered=None):
+    """
+    Evaluates every scenario against every portfolio in batched matrix products:
+
+        P&L      = W @ X.T                    (portfolios x scenarios)
+        by theme = X @ (diag(w_p) T), per p   (scenarios x themes)
+
+    Args:
+        portfolios (dict): {name: {ticker: weight_percentage}}
+        shocks (pd.DataFrame): (scenarios x stocks) returns, e.g. factor_shocks / historical_shocks
+        stock_breakdown (dict): {ticker: {etf: raw_score}}
+        covered (pd.DataFrame): optional (scenarios x stocks) mask of stocks with their own history
+
+    Returns:
+        dict: {
+            "pnl": pd.DataFrame portfolio return in % (index=scenario, columns=portfolio),
+            "theme": pd.DataFrame contribution in %p (index=scenario, columns=(portfolio, theme)),
+            "coverage": pd.DataFrame weight (%) with own history (index=scenario, columns=portfolio),
+            "weights": pd.DataFrame (portfolio x stock) weights as fractions,
+            "shocks": the shocks frame,
+        }
+    """
+    stocks = list(shocks.columns)
+    col_of = {t: j for j, t in enumerate(stocks)}
+    W = np.zeros((len(portfolios), len(stocks)))
+    for i, weights in enumerate(portfolios.values()):
+        for t, w in weights.items():
+            if t in col_of:
+                W[i, col_of[t]] += w / 100.0
+    X = shocks.to_numpy(dtype=float)
+
+    pnl = (W @ X.T).T * 100.0
+    T, themes = theme_shares(stocks, stock_breakdown)
+    by_theme = np.einsum("kn,pn,nt->pkt", X, W, T, optimize=True) * 100.0
+    theme_frame = pd.DataFrame(
+        by_theme.transpose(1, 0, 2).reshape(len(X), -1),
+        index=shocks.index,
+        columns=pd.MultiIndex.from_product([list(portfolios), themes], names=["portfolio", "theme"]),
+    )
+    cov = covered.reindex(index=shocks.index, columns=stocks).fillna(False).to_numpy(dtype=float) if covered is not None else np.ones_like(X)
+
+    return {
+        "pnl": pd.DataFrame(pnl, index=shocks.index, columns=list(portfolios)),
+        "theme": theme_frame,
+        "coverage": pd.DataFrame((W @ cov.T).T * 100.0, index=shocks.index, columns=list(portfolios)),
+        "weights": pd.DataFrame(W, index=list(portfolios), columns=stocks),
+        "shocks": shocks,
+    }
+
+
+def stock_losses(result, scenario, portfolio, top=15):
+    """
+    Largest per-stock contributions (in %p) of one portfolio to one scenario.
+
+    Returns:
+        pd.DataFrame: Weight (%), Shock (%), Contribution (%p), most negative first
+    """
+    w = result["weights"].loc[portfolio]
+    x = result["shocks"].loc[scenario]
+    df = pd.DataFrame({"Weight (%)": w * 100.0, "Shock (%)": x * 100.0, "Contribution (%p)": w * x * 100.0})
+    df = df[df["Weight (%)"] > 0]
+    return df.sort_values("Contribution (%p)").head(top)
+
+
+def stress_test(portfolios, stock_breakdown, price_data=None, historical=None, factors=None):
+    """
+    Historical windows (when price_data is given) and factor scenarios against the
+    portfolios, in one batch.
+
+    Args:
+        portfolios (dict): {name: {ticker: weight_percentage}}; the first one is the
+            consolidated portfolio whose stock_breakdown defines themes/ETFs
+        historical (dict): {name: (start, end)}, default HISTORICAL_SCENARIOS
+        factors (dict): {name: shock spec}, default FACTOR_SCENARIOS
+
+    Returns:
+        dict: see run_scenarios, plus "kind": pd.Series scenario -> 'historical'/'factor'
+    """
+    historical = HISTORICAL_SCENARIOS if historical is None else historical
+    factors = FACTOR_SCENARIOS if factors is None else factors
+    stocks = list(dict.fromkeys(t for weights in portfolios.values() for t in weights))
+
+    frames, covered, kinds = [], [], []
+    if price_data is not None and historical:
+        hist, own = historical_shocks(historical, stocks, stock_breakdown, price_data)
+        frames.append(hist)
+        covered.append(own)
+        kinds += ["historical"] * len(hist)
+    if factors:
+        fac = factor_shocks(factors, stocks, stock_breakdown)
+        frames.append(fac)
+        covered.append(pd.DataFrame(True, index=fac.index, columns=stocks))
+        kinds += ["factor"] * len(fac)
+    if not frames:
+        return {}
+
+    shocks = pd.concat(frames)
+    result = run_scenarios(portfolios, shocks, stock_breakdown, covered=pd.concat(covered))
+    result["kind"] = pd.Series(kinds, index=shocks.index)
+    return result
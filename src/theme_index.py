@@ -0,0 +1,186 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import fx_service
+import result_cache
+import instrumentation
+
+# Theme tabs of the "Indy's ETF Information" view -> ETFs in each theme
+THEME_TABS = {
+    "Core Index": ["VOO", "QQQ"],
+    "AI & Robotics": ["AIQ", "BOTZ", "ROBO", "CHAT", "QTUM"],
+    "Semiconductor": ["SMH", "SOXX", "CIBR", "HACK"],
+    "Future Mobility": ["ARKX", "UFO", "ROKT", "DRIV", "IDRV"],
+    "Bio & Resources": ["IBB", "XBI", "XME", "PICK", "SETM", "COPP"],
+}
+
+ETF_TO_THEME = {etf: theme for theme, etfs in THEME_TABS.items() for etf in etfs}
+
+# Exchange suffix -> listing country (shares its table with the currency lookup)
+SUFFIX_COUNTRY = {suffix: country for suffix, (country, _) in fx_service.EXCHANGE_SUFFIXES.items()}
+
+
+# Built indexes kept per input fingerprint (compositions, consolidated breakdowns)
+INDEX_CACHE_SIZE = 8
+
+_index_lock = threading.Lock()
+_indexes = OrderedDict()
+
+
+def country_for_ticker(ticker):
+    if not isinstance(ticker, str) or '.' not in ticker:
+        return "United States"
+    return SUFFIX_COUNTRY.get(ticker.rsplit('.', 1)[1].upper(), "United States")
+
+
+def membership_frame(compositions):
+    """
+    Long-form holdings table: one row per (etf, ticker) with weight and theme,
+    for ad-hoc grouping (reports); repeated lookups use ThemeIndex.
+    """
+    rows = [(etf, t, w) for etf, holdings in compositions.items() for t, w in holdings.items()]
+    df = pd.DataFrame(rows, columns=["etf", "ticker", "weight"])
+    df["theme"] = df["etf"].map(ETF_TO_THEME).fillna("Other")
+    return df
+
+
+def breakdown_frame(stock_breakdown):
+    """
+    Long-form version of the `stock_breakdown` returned by calculate_consolidated_weights:
+    one row per (ticker, etf) with the raw score (allocated capital in $B).
+    """
+    rows = [(t, etf, score) for t, per_etf in stock_breakdown.items() for etf, score in per_etf.items()]
+    df = pd.DataFrame(rows, columns=["ticker", "etf", "raw_score"])
+    df["theme"] = df["etf"].map(ETF_TO_THEME).fillna("Other")
+    return df
+
+
+class ThemeIndex:
+    """
+    Inverted index over an {etf: {ticker: value}} mapping (compositions with
+    weights, or a consolidated breakdown transposed, with raw scores).
+
+    Stocks and ETFs get integer IDs; the (stock, etf, value) memberships are kept
+    as three aligned arrays, and the lookup maps are built once:
+    etf_to_stocks / theme_to_stocks (stock ID arrays), stock_to_etfs /
+    stock_to_themes (tuples in listing order) and primary_theme (the theme of
+    the ETF with the largest value).
+    """
+
+    def __init__(self, holdings_by_etf):
+        with instrumentation.timer("theme_index.build"):
+            self.etfs = list(holdings_by_etf)
+            self.etf_themes = np.array([ETF_TO_THEME.get(e, "Other") for e in self.etfs], dtype=object)
+            stock_id = {}
+            rows, cols, values = [], [], []
+            for j, holdings in enumerate(holdings_by_etf.values()):
+                for t, v in holdings.items():
+                    rows.append(stock_id.setdefault(t, len(stock_id)))
+                    cols.append(j)
+                    values.append(v)
+            self.stocks = list(stock_id)
+            self.stock_id = stock_id
+            self.rows = np.array(rows, dtype=int)
+            self.cols = np.array(cols, dtype=int)
+            self.values = np.array(values, dtype=float)
+
+            order = np.argsort(self.rows, kind="stable")
+            bounds = np.searchsorted(self.rows[order], np.arange(len(self.stocks) + 1))
+            self.etf_to_stocks = {e: self.rows[self.cols == j] for j, e in enumerate(self.etfs)}
+            self.theme_to_stocks = {
+                theme: np.unique(self.rows[self.etf_themes[self.cols] == theme]) for theme in dict.fromkeys(self.etf_themes)
+            }
+            self.stock_to_etfs = {}
+            self.stock_to_themes = {}
+            self.primary_theme = {}
+            for i, t in enumerate(self.stocks):
+                members = order[bounds[i]:bounds[i + 1]]
+                self.stock_to_etfs[t] = tuple(self.etfs[j] for j in self.cols[members])
+                self.stock_to_themes[t] = tuple(dict.fromkeys(self.etf_themes[self.cols[members]]))
+                self.primary_theme[t] = self.etf_themes[self.cols[members[np.argmax(self.values[members])]]]
+
+    def totals(self):
+        """
+        Sum of the values per stock (e.g. allocated capital in $B for a breakdown).
+        """
+        return pd.Series(np.bincount(self.rows, weights=self.values, minlength=len(self.stocks)), index=self.stocks)
+
+    def labels(self):
+        """
+        'VOO, QQQ, SMH' label per stock.
+        """
+        return pd.Series({t: ", ".join(etfs) for t, etfs in self.stock_to_etfs.items()}, dtype=object)
+
+
+def get_index(holdings_by_etf):
+    """
+    ThemeIndex for the mapping, built once per content fingerprint.
+    """
+    key = result_cache.fingerprint(holdings_by_etf)
+    with _index_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            instrumentation.increment("theme_index.cache_hits")
+            return index
+    index = ThemeIndex(holdings_by_etf)
+    with _index_lock:
+        _indexes[key] = index
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def breakdown_index(stock_breakdown):
+    """
+    ThemeIndex over a consolidated `stock_breakdown` ({ticker: {etf: raw_score}}).
+    """
+    by_etf = {}
+    for t, per_etf in stock_breakdown.items():
+        for etf, score in per_etf.items():
+            by_etf.setdefault(etf, {})[t] = score
+    return get_index(by_etf)
+
+
+def sectors_by_stock(stock_breakdown):
+    """
+    'VOO, QQQ, SMH' label per ticker (its source ETFs), from the breakdown index.
+
+    Returns:
+        pd.Series: indexed by ticker
+    """
+    return breakdown_index(stock_breakdown).labels()
+
+
+def exposures(final_weights, stock_breakdown, by="theme"):
+    """
+    Portfolio exposure (in %) rolled up by 'theme', 'etf', 'country' or 'currency'.
+
+    For 'theme'/'etf', each stock's weight is split across its source ETFs in
+    proportion to their raw scores, so the rollup sums to 100%.
+
+    Returns:
+        pd.Series: exposure per group, sorted descending
+    """
+    weights = pd.Series(final_weights, dtype=float)
+    if weights.empty:
+        return pd.Series(dtype=float)
+
+    if by in ("theme", "etf"):
+        index = breakdown_index(stock_breakdown)
+        if not len(index.values):
+            return pd.Series(dtype=float)
+        totals = index.totals().to_numpy()
+        stock_weights = weights.reindex(index.stocks).fillna(0.0).to_numpy()
+        contribution = index.values / totals[index.rows] * stock_weights[index.rows]
+        by_etf = pd.Series(np.bincount(index.cols, weights=contribution, minlength=len(index.etfs)), index=index.etfs)
+        result = by_etf if by == "etf" else by_etf.groupby(index.etf_themes).sum()
+    elif by == "country":
+        result = weights.groupby(weights.index.map(country_for_ticker)).sum()
+    elif by == "currency":
+        result = weights.groupby(weights.index.map(fx_service.currency_for_ticker)).sum()
+    else:
+        raise ValueError(f"Unknown exposure dimension '{by}'")
+
+    return result.sort_values(ascending=False)
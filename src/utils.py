@@ -1,51 +1,58 @@
 import pandas as pd
 import numpy as np
+import instrumentation
+import result_cache
+from return_matrix import ReturnMatrix, build_return_matrix
 
-def calculate_portfolio_returns(weights, price_data):
+@instrumentation.timed("utils.calculate_portfolio_returns")
+def calculate_portfolio_returns(weights, price_data, mask="zero"):
     """
     Calculates the portfolio's cumulative return and daily returns.
     
     Args:
         weights (dict): Dictionary of {ticker: weight} (e.g., {'AAPL': 0.1, ...})
-        price_data (pd.DataFrame): DataFrame of historical close prices (index=Date, columns=Tickers)
+        price_data (pd.DataFrame | ReturnMatrix): DataFrame of historical close prices
+            (index=Date, columns=Tickers), or a prebuilt ReturnMatrix to reuse across backtests
+        mask (str): how non-trading days of a holding are treated (see ReturnMatrix.portfolio_returns)
         
     Returns:
         pd.Series: Portfolio cumulative return series
         pd.Series: Portfolio daily return series
     """
-    # Ensure weights sum to 1 (or allow leverage? For now normalize or assume user handled it)
-    # Filter price data to only include tickers in weights
-    available_tickers = [t for t in weights.keys() if t in price_data.columns]
+    # Union trading calendar instead of dropna(): dates where only some markets were
+    # closed are kept, and the return matrix is computed once per price frame
+    if isinstance(price_data, ReturnMatrix):
+        matrix = price_data
+    else:
+        if price_data.empty:
+            return pd.Series(dtype=float), pd.Series(dtype=float)
+        matrix = build_return_matrix(price_data)
     
-    if not available_tickers:
-        return pd.Series(), pd.Series()
-        
-    subset_data = price_data[available_tickers].dropna()
-    
-    # Calculate daily returns
-    daily_returns = subset_data.pct_change().dropna()
-    
-    # Portfolio daily return = sum(weight * daily_return for each stock)
-    # Align weights with the columns
-    
-    weighted_returns = daily_returns[available_tickers].mul([weights[t] for t in available_tickers], axis=1)
-    portfolio_daily_ret = weighted_returns.sum(axis=1)
-    
-    # Cumulative return
-    portfolio_cum_ret = (1 + portfolio_daily_ret).cumprod() - 1
-    
-    return portfolio_cum_ret, portfolio_daily_ret
+    return matrix.portfolio_returns(weights, mask=mask)
+
+# Top-N holdings taken from each ETF: broad index ETFs vs. theme ETFs
+INDEX_ETFS = ("VOO", "QQQ")
+TOP_N_INDEX = 20
+TOP_N_THEME = 10
+# AUMs (in $B) are rounded to this many decimals in the result-cache key
+AUM_KEY_DIGITS = 1
+
+TRADING_DAYS = 252
+RISK_FREE_RATE = 0.04
+ROLLING_WINDOWS = [63, 126, 252, 756]
 
-def calculate_metrics(daily_returns):
+@instrumentation.timed("utils.calculate_metrics")
+def calculate_metrics(daily_returns, benchmark_returns=None):
     """
     Calculates CAGR, MDD, Sharpe Ratio.
+    With benchmark_returns (e.g. VOO daily returns), also Beta and Tracking Error.
     """
     if daily_returns.empty:
         return {}
         
     # CAGR
     total_days = len(daily_returns)
-    years = total_days / 252
+    years = total_days / TRADING_DAYS
     total_return = (1 + daily_returns).prod() - 1
     cagr = (1 + total_return) ** (1 / years) - 1
     
@@ -56,18 +63,127 @@ def calculate_metrics(daily_returns):
     mdd = drawdown.min()
     
     # Sharpe (assuming risk-free rate ~ 4% or 0 for simplicity in comparison)
-    rf = 0.04
-    excess_ret = daily_returns.mean() * 252 - rf
-    volatility = daily_returns.std() * np.sqrt(252)
+    rf = RISK_FREE_RATE
+    excess_ret = daily_returns.mean() * TRADING_DAYS - rf
+    volatility = daily_returns.std() * np.sqrt(TRADING_DAYS)
     sharpe = excess_ret / volatility if volatility != 0 else 0
     
-    return {
+    metrics = {
         "CAGR": cagr,
         "MDD": mdd,
         "Sharpe": sharpe,
         "Total Return": total_return
     }
 
+    if benchmark_returns is not None:
+        r, b = daily_returns.align(benchmark_returns, join="inner")
+        b_var = b.var()
+        metrics["Beta"] = r.cov(b) / b_var if b_var else np.nan
+        metrics["Tracking Error"] = (r - b).std() * np.sqrt(TRADING_DAYS)
+
+    return metrics
+
+def _window_sums(prefix, w):
+    # Sum over the trailing w rows from a prefix array with a leading zero row
+    out = np.full((prefix.shape[0] - 1,) + prefix.shape[1:], np.nan)
+    out[w - 1:] = prefix[w:] - prefix[:-w]
+    return out
+
+def _prefix(x):
+    return np.vstack([np.zeros((1, x.shape[1])), np.cumsum(x, axis=0)])
+
+def _rolling_max(x, w):
+    """
+    Trailing w-row maximum per column in O(T) (van Herk / Gil-Werman):
+    block-wise prefix and suffix maxima, combined once per row.
+    """
+    T, N = x.shape
+    n_blocks = -(-T // w)
+    padded = np.full((n_blocks * w, N), -np.inf)
+    padded[:T] = x
+    blocks = padded.reshape(n_blocks, w, N)
+    prefix = np.maximum.accumulate(blocks, axis=1).reshape(-1, N)
+    suffix = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(-1, N)
+    out = np.full((T, N), np.nan)
+    if T >= w:
+        out[w - 1:] = np.maximum(suffix[:T - w + 1], prefix[w - 1:T])
+    return out
+
+@instrumentation.timed("utils.calculate_rolling_metrics")
+def calculate_rolling_metrics(daily_returns, benchmark_returns, windows=None, rf=RISK_FREE_RATE):
+    """
+    Rolling CAGR, Volatility, Sharpe, Beta, Tracking Error and Drawdown against a
+    benchmark (e.g. VOO), for many windows and many portfolios at once.
+
+    Every metric comes from prefix sums (of log returns, r, r^2, r*b, ...), so each
+    window costs O(T) regardless of its length. Drawdown is measured from the
+    trailing window's peak, using an O(T) sliding maximum.
+
+    Args:
+        daily_returns (pd.Series | pd.DataFrame): daily returns, one column per portfolio
+        benchmark_returns (pd.Series): benchmark daily returns
+        windows (list): window lengths in trading days (default ROLLING_WINDOWS)
+        rf (float): annual risk-free rate for Sharpe
+
+    Returns:
+        dict: {window: pd.DataFrame (index=Date, columns=MultiIndex (metric, portfolio))}
+            Rows before a full window of valid days are NaN.
+    """
+    windows = windows or ROLLING_WINDOWS
+    if isinstance(daily_returns, pd.Series):
+        daily_returns = daily_returns.to_frame(daily_returns.name or "Portfolio")
+    returns, bench = daily_returns.align(benchmark_returns, join="inner", axis=0)
+    if returns.empty:
+        return {}
+
+    R = returns.to_numpy(dtype=float)
+    B = np.broadcast_to(bench.to_numpy(dtype=float)[:, None], R.shape)
+    ok = np.isfinite(R) & np.isfinite(B)
+    # Centering keeps the r^2 prefix sums well conditioned; variances are shift-invariant
+    c_r, c_b = np.nanmean(R), np.nanmean(B)
+    r = np.where(ok, R - c_r, 0.0)
+    b = np.where(ok, B - c_b, 0.0)
+    d = r - b
+    log_growth = np.where(ok, np.log1p(np.where(ok, R, 0.0)), 0.0)
+
+    P = {
+        "n": _prefix(ok.astype(float)), "log": _prefix(log_growth),
+        "r": _prefix(r), "rr": _prefix(r * r),
+        "b": _prefix(b), "bb": _prefix(b * b), "rb": _prefix(r * b),
+        "d": _prefix(d), "dd": _prefix(d * d),
+    }
+    wealth = np.cumsum(log_growth, axis=0)
+    ann = np.sqrt(TRADING_DAYS)
+    results = {}
+
+    for w in windows:
+        if w < 2 or w > len(R):
+            continue
+        S = {k: _window_sums(v, w) for k, v in P.items()}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            full = S["n"] == w
+            var_r = (S["rr"] - S["r"] ** 2 / w) / (w - 1)
+            var_b = (S["bb"] - S["b"] ** 2 / w) / (w - 1)
+            cov_rb = (S["rb"] - S["r"] * S["b"] / w) / (w - 1)
+            var_d = (S["dd"] - S["d"] ** 2 / w) / (w - 1)
+
+            vol = np.sqrt(np.clip(var_r, 0, None)) * ann
+            mean_annual = (S["r"] / w + c_r) * TRADING_DAYS
+            metrics = {
+                "CAGR": np.expm1(S["log"] * TRADING_DAYS / w),
+                "Volatility": vol,
+                "Sharpe": np.where(vol > 0, (mean_annual - rf) / vol, np.nan),
+                "Beta": np.where(var_b > 0, cov_rb / var_b, np.nan),
+                "Tracking Error": np.sqrt(np.clip(var_d, 0, None)) * ann,
+                "Drawdown": np.expm1(wealth - _rolling_max(wealth, w)),
+            }
+        frames = {name: pd.DataFrame(np.where(full, v, np.nan), index=returns.index, columns=returns.columns)
+                  for name, v in metrics.items()}
+        results[w] = pd.concat(frames, axis=1)
+
+    return results
+
+@instrumentation.timed("utils.calculate_consolidated_weights")
 def calculate_consolidated_weights(etf_aums, compositions):
     """
     Centralized Logic 2.0: Calculates consolidated stock weights based on ETF AUMs.
@@ -83,7 +199,7 @@ def calculate_consolidated_weights(etf_aums, compositions):
     for etf, aum in etf_aums.items():
         if etf in compositions:
             # Step 3-5: Top 20 for Index, Top 10 for Themes
-            limit = 20 if etf in ["VOO", "QQQ"] else 10
+            limit = TOP_N_INDEX if etf in INDEX_ETFS else TOP_N_THEME
             
             # Sort to guarantee Top N
             top_holdings = sorted(compositions[etf].items(), key=lambda x: x[1], reverse=True)[:limit]
@@ -107,3 +223,24 @@ def calculate_consolidated_weights(etf_aums, compositions):
             final_weights[t] = (score / total_raw_score) * 100
             
     return final_weights, stock_breakdown
+
+def consolidation_fingerprint(etf_aums, compositions):
+    """
+    Key of a consolidation result: the compositions, the AUMs rounded to
+    AUM_KEY_DIGITS and the Top-N rules.
+    """
+    rounded = {etf: round(float(aum), AUM_KEY_DIGITS) for etf, aum in etf_aums.items()}
+    rules = {"index_etfs": sorted(INDEX_ETFS), "top_n_index": TOP_N_INDEX, "top_n_theme": TOP_N_THEME}
+    return result_cache.fingerprint(compositions, rounded, rules)
+
+def get_consolidated_weights(etf_aums, compositions):
+    """
+    calculate_consolidated_weights through the persistent result cache, so reruns,
+    restarts and other worker processes reuse the result for the same inputs.
+    AUM moves smaller than the key rounding reuse the stored result.
+    """
+    key = consolidation_fingerprint(etf_aums, compositions)
+    final_weights, stock_breakdown = result_cache.memoize(
+        "consolidation", key, lambda: calculate_consolidated_weights(etf_aums, compositions)
+    )
+    return final_weights, stock_breakdown